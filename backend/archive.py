@@ -0,0 +1,169 @@
+"""
+Archival of old finished games
+
+The hot queries read games: the live games behind /players and whichever game
+a request names. A finished game only matters to them while it's recent, the
+leaderboards, ranks and user stats are served from score_rollups, the rank
+index and user_stats, which counted it when it finished. Every
+GAME_ARCHIVE_INTERVAL seconds the app moves the finished games started more
+than GAME_ARCHIVE_AFTER_DAYS ago to games_archive, GAME_ARCHIVE_BATCH of them
+per transaction, so games stays the size of the recent load however long the
+history grows. Concurrent workers skip the games another one is moving.
+
+On Postgres games_archive is partitioned by the month of created_at, and a
+month's partition is created when its first game is moved in, so months past
+keeping can be detached or dropped whole. A user's game history and the
+rebuilds of the rollups and stats read both tables. The newest game is never
+moved, as SQLite numbers a new row from the highest id left in its table.
+
+    uv run python archive.py   # archive what's due now
+"""
+
+import asyncio
+import logging
+import os
+from datetime import date, datetime, timedelta
+from typing import Iterable, List, Optional
+
+from sqlalchemy import Row, delete, func, insert, select, text, union_all
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql import Subquery
+
+from models import Game, GameArchive, SessionLocal, get_engine
+
+logger = logging.getLogger(__name__)
+
+# Days after it started that a finished game is archived
+GAME_ARCHIVE_AFTER_DAYS = float(os.getenv("GAME_ARCHIVE_AFTER_DAYS", 30))
+# Seconds between archival runs
+GAME_ARCHIVE_INTERVAL = float(os.getenv("GAME_ARCHIVE_INTERVAL", 3600))
+# Games moved per transaction
+GAME_ARCHIVE_BATCH = int(os.getenv("GAME_ARCHIVE_BATCH", 1000))
+
+GAME_TABLES = (Game.__table__, GameArchive.__table__)
+
+
+def month_of(when: datetime) -> date:
+    return date(when.year, when.month, 1)
+
+
+def next_month(month: date) -> date:
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+async def ensure_partitions(db: AsyncSession, created: Iterable[datetime]) -> None:
+    """Create the games_archive partitions of the months these times fall in"""
+    if db.bind.dialect.name != "postgresql":
+        return
+    for month in sorted({month_of(when) for when in created}):
+        name = f"games_archive_{month:%Y_%m}"
+        # Looked up first, creating a partition locks the whole table
+        exists = await db.execute(text("SELECT to_regclass(:name)"), {"name": name})
+        if exists.scalar() is None:
+            await db.execute(
+                text(
+                    f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF games_archive "
+                    f"FOR VALUES FROM ('{month}') TO ('{next_month(month)}')"
+                )
+            )
+
+
+async def archive_batch(db: AsyncSession, before: datetime, batch: int) -> int:
+    """Move up to batch games finished and started before then, returns how many"""
+    newest = select(func.max(Game.id)).scalar_subquery()
+    due = (
+        await db.execute(
+            select(Game.id, Game.created_at)
+            .where(Game.status == "finished", Game.created_at < before)
+            .where(Game.id < newest)
+            .order_by(Game.created_at)
+            .limit(batch)
+            .with_for_update(skip_locked=True)
+        )
+    ).all()
+    if not due:
+        return 0
+    await ensure_partitions(db, [row.created_at for row in due])
+    moving = (Game.id.in_([row.id for row in due]), Game.status == "finished")
+    await db.execute(
+        insert(GameArchive).from_select(
+            [column.name for column in Game.__table__.columns],
+            select(*Game.__table__.columns).where(*moving),
+        )
+    )
+    moved = await db.execute(delete(Game).where(*moving))
+    await db.commit()
+    return moved.rowcount
+
+
+async def archive(
+    session_factory,
+    now: Optional[datetime] = None,
+    after_days: float = GAME_ARCHIVE_AFTER_DAYS,
+    batch: int = GAME_ARCHIVE_BATCH,
+) -> int:
+    """Archive every game that's due, returns how many were moved"""
+    before = (now or datetime.utcnow()) - timedelta(days=after_days)
+    total = 0
+    async with session_factory() as db:
+        while True:
+            moved = await archive_batch(db, before, batch)
+            total += moved
+            if moved < batch:
+                return total
+
+
+async def run_archival(session_factory) -> None:
+    """Archive the games that are due every GAME_ARCHIVE_INTERVAL seconds"""
+    while True:
+        await asyncio.sleep(GAME_ARCHIVE_INTERVAL)
+        try:
+            moved = await archive(session_factory)
+            if moved:
+                logger.info("Archived %d finished games", moved)
+        except Exception:
+            logger.exception("Archiving finished games failed, will retry")
+
+
+def finished_games(*names: str) -> Subquery:
+    """The named columns of every finished game, live or archived"""
+    return union_all(
+        select(*(Game.__table__.c[name] for name in names)).where(
+            Game.status == "finished"
+        ),
+        select(*(GameArchive.__table__.c[name] for name in names)),
+    ).subquery("finished_games")
+
+
+async def user_games(
+    db: AsyncSession, user_id: int, limit: int, before: Optional[int] = None
+) -> List[Row]:
+    """A user's games newest first, live or archived, below the game id before"""
+    # Each table gives its newest, read off its (user_id, id DESC) index
+    pages = []
+    for table in GAME_TABLES:
+        page = (
+            select(table)
+            .where(table.c.user_id == user_id)
+            .order_by(table.c.id.desc())
+            .limit(limit)
+        )
+        if before is not None:
+            page = page.where(table.c.id < before)
+        pages.append(select(page.subquery()))
+    games = union_all(*pages).subquery("games")
+    return (
+        await db.execute(select(games).order_by(games.c.id.desc()).limit(limit))
+    ).all()
+
+
+def main():
+    async def run():
+        print(f"Archived {await archive(SessionLocal)} finished games")
+        await get_engine().dispose()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
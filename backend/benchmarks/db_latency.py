@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Concurrent latency benchmark for the database-backed endpoints
+
+Many clients log in, start games and post scores while others read the
+leaderboard and the players list. Latency percentiles are reported per route.
+Run it against a server started from the commit before and after a change to
+compare the two:
+
+    uv run uvicorn main:app --port 8000
+    uv run python benchmarks/db_latency.py --url http://localhost:8000
+
+Without --url the app is driven in-process on a throwaway SQLite database.
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def player(client, worker, requests, latencies):
+    """One simulated client: a game with score updates mixed with reads"""
+    response = await client.post("/login", json={"username": f"bench_{worker}"})
+    user_id = response.json()["id"]
+    response = await client.post(
+        "/games", json={"user_id": user_id, "game_mode": "walls"}
+    )
+    game_id = response.json()["id"]
+
+    score = 0
+    for _ in range(requests):
+        roll = random.random()
+        started = time.perf_counter()
+        if roll < 0.5:
+            score += 10
+            route = "PUT /games/{id}/score"
+            await client.put(f"/games/{game_id}/score", json={"score": score})
+        elif roll < 0.75:
+            route = "GET /players"
+            await client.get("/players")
+        else:
+            route = "GET /leaderboard"
+            await client.get("/leaderboard")
+        latencies[route].append(time.perf_counter() - started)
+
+    await client.put(f"/games/{game_id}/status", json={"status": "finished"})
+
+
+async def run(client, concurrency, requests):
+    latencies = defaultdict(list)
+    started = time.perf_counter()
+    await asyncio.gather(
+        *(player(client, worker, requests, latencies) for worker in range(concurrency))
+    )
+    elapsed = time.perf_counter() - started
+
+    total = sum(len(samples) for samples in latencies.values())
+    print(f"{total} requests from {concurrency} clients in {elapsed:.2f}s")
+    print(f"{'route':<24}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    everything = [sample for samples in latencies.values() for sample in samples]
+    for route, samples in sorted(latencies.items()) + [("all", everything)]:
+        print(
+            f"{route:<24}{len(samples):>8}"
+            f"{percentile(samples, 50) * 1000:>10.2f}"
+            f"{percentile(samples, 95) * 1000:>10.2f}"
+            f"{percentile(samples, 99) * 1000:>10.2f}"
+        )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--url", help="base URL of a running server")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=40, help="per client")
+    parser.add_argument("--timeout", type=float, default=60.0, help="seconds")
+    args = parser.parse_args()
+
+    limits = httpx.Limits(max_connections=args.concurrency)
+    if args.url:
+        async with httpx.AsyncClient(
+            base_url=args.url, limits=limits, timeout=args.timeout
+        ) as client:
+            await run(client, args.concurrency, args.requests)
+        return
+
+    database = "./bench_db_latency.db"
+    if os.path.exists(database):
+        os.remove(database)
+    os.environ["DATABASE_URL"] = f"sqlite:///{database}"
+    from main import app
+    from models import create_tables
+
+    await create_tables()
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://bench", limits=limits
+        ) as client:
+            await run(client, args.concurrency, args.requests)
+    os.remove(database)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
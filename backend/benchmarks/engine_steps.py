@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Throughput benchmark for the server-side snake simulation
+
+Steps many concurrent games round robin, steering each one at random, and
+reports steps per second for every game count. A game that ends is replaced
+with a fresh one so the count stays constant. At the slowest speed a game
+needs about 7 steps per second, divide the rate by that to see how many
+games one core can keep up with.
+
+    uv run python benchmarks/engine_steps.py --games 1 100 1000 10000
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from engine import INITIAL_SPEED, SnakeGame
+
+
+def run(count, mode, duration, turn_rate):
+    rng = random.Random(count)
+    games = [SnakeGame(mode, seed) for seed in range(count)]
+    steps = 0
+    finished = 0
+    started = time.perf_counter()
+    deadline = started + duration
+    while time.perf_counter() < deadline:
+        for index, game in enumerate(games):
+            if rng.random() < turn_rate:
+                game.turn(rng.randrange(4))
+            if not game.step():
+                finished += 1
+                games[index] = SnakeGame(mode, steps)
+            steps += 1
+    elapsed = time.perf_counter() - started
+    return steps / elapsed, finished
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--games", type=int, nargs="+", default=[1, 10, 100, 1000, 10000]
+    )
+    parser.add_argument("--mode", default="pass-through")
+    parser.add_argument("--duration", type=float, default=2.0, help="seconds per run")
+    parser.add_argument(
+        "--turn-rate", type=float, default=0.1, help="chance of a turn per step"
+    )
+    args = parser.parse_args()
+
+    real_time = 1000 / INITIAL_SPEED
+    print(f"{'games':>8}{'steps/s':>14}{'games/core':>14}{'finished':>10}")
+    for count in args.games:
+        rate, finished = run(count, args.mode, args.duration, args.turn_rate)
+        print(f"{count:>8}{rate:>14,.0f}{rate / real_time:>14,.0f}{finished:>10}")
+
+
+if __name__ == "__main__":
+    main()
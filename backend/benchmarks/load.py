@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+"""
+Load test of the API under a realistic mix of clients
+
+Players log in, start games, post scores one at a time and in batches, send
+heartbeats and finish; spectators poll /players with their ETag and page
+through it; readers fetch the all-time and the filtered leaderboards. Every
+client runs for --duration seconds. Reports requests per second and
+p50/p95/p99 latency per route, and in-process also the database statements
+each request issued, then saves it all as JSON. Given a --baseline from an
+earlier run, routes that got slower or chattier are listed and the exit
+status is 1, so a run can guard a change:
+
+    uv run python benchmarks/load.py --output baseline.json
+    # ... change things ...
+    uv run python benchmarks/load.py --baseline baseline.json
+
+The app is driven in-process on a throwaway SQLite database, or with
+--database postgres on the disposable database at TEST_POSTGRES_URL, whose
+tables are dropped and recreated. --url drives a running server instead,
+without statement counts.
+"""
+
+import argparse
+import asyncio
+import contextvars
+import json
+import os
+import platform
+import random
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SQLITE_DATABASE = "./bench_load.db"
+# Statements of the request running in the current task, None outside of one
+statements = contextvars.ContextVar("statements", default=None)
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class Recorder:
+    """Latencies and statement counts per route"""
+
+    def __init__(self, count_statements, think):
+        self.count_statements = count_statements
+        self.think = think
+        self.latencies = defaultdict(list)
+        self.statements = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    async def request(self, client, route, method, url, **kwargs):
+        counter = [0]
+        token = statements.set(counter)
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+        finally:
+            statements.reset(token)
+        self.latencies[route].append(time.perf_counter() - started)
+        if self.count_statements:
+            self.statements[route].append(counter[0])
+        if response.status_code >= 400:
+            self.errors[route] += 1
+        # In-process, a cached response never waits on anything, so always
+        # let the other clients run
+        await asyncio.sleep(self.think)
+        return response
+
+    def summary(self, elapsed):
+        routes = {}
+        everything = [s for samples in self.latencies.values() for s in samples]
+        counts = [s for samples in self.statements.values() for s in samples]
+        for route, samples, queries in [
+            *((r, s, self.statements.get(r, [])) for r, s in self.latencies.items()),
+            ("all", everything, counts),
+        ]:
+            routes[route] = {
+                "requests": len(samples),
+                "errors": sum(self.errors.values())
+                if route == "all"
+                else self.errors[route],
+                "rps": len(samples) / elapsed,
+                "p50_ms": percentile(samples, 50) * 1000,
+                "p95_ms": percentile(samples, 95) * 1000,
+                "p99_ms": percentile(samples, 99) * 1000,
+                "statements_per_request": sum(queries) / len(queries)
+                if queries
+                else None,
+            }
+        return routes
+
+
+async def player(client, recorder, worker, deadline, rng):
+    """Plays game after game, scoring as it eats"""
+    response = await recorder.request(
+        client, "POST /login", "POST", "/login", json={"username": f"load_{worker}"}
+    )
+    user_id = response.json()["id"]
+    while time.perf_counter() < deadline:
+        game_mode = rng.choice(["walls", "pass-through"])
+        response = await recorder.request(
+            client,
+            "POST /games",
+            "POST",
+            "/games",
+            json={"user_id": user_id, "game_mode": game_mode},
+        )
+        game_id = response.json()["id"]
+        score = 0
+        for _ in range(rng.randint(5, 30)):
+            if time.perf_counter() >= deadline:
+                break
+            score += 10
+            roll = rng.random()
+            if roll < 0.6:
+                await recorder.request(
+                    client,
+                    "POST /games/scores:batch",
+                    "POST",
+                    "/games/scores:batch",
+                    json={"scores": [{"game_id": game_id, "score": score}]},
+                )
+            elif roll < 0.9:
+                await recorder.request(
+                    client,
+                    "PUT /games/{id}/score",
+                    "PUT",
+                    f"/games/{game_id}/score",
+                    json={"score": score},
+                )
+            else:
+                await recorder.request(
+                    client,
+                    "POST /games/{id}/heartbeat",
+                    "POST",
+                    f"/games/{game_id}/heartbeat",
+                )
+        await recorder.request(
+            client,
+            "PUT /games/{id}/status",
+            "PUT",
+            f"/games/{game_id}/status",
+            json={"status": "finished"},
+        )
+
+
+async def spectator(client, recorder, worker, deadline, rng):
+    """Polls the players list like the watch page, revalidating by ETag"""
+    etag = None
+    while time.perf_counter() < deadline:
+        headers = {"If-None-Match": etag} if etag else {}
+        response = await recorder.request(
+            client, "GET /players", "GET", "/players?limit=50", headers=headers
+        )
+        etag = response.headers.get("etag", etag)
+        cursor = response.headers.get("x-next-cursor")
+        if cursor and rng.random() < 0.3:
+            await recorder.request(
+                client,
+                "GET /players?cursor",
+                "GET",
+                f"/players?limit=50&cursor={cursor}",
+            )
+
+
+async def reader(client, recorder, worker, deadline, rng):
+    """Reads the leaderboards, all time and filtered"""
+    while time.perf_counter() < deadline:
+        if rng.random() < 0.5:
+            await recorder.request(
+                client, "GET /leaderboard", "GET", "/leaderboard?limit=10"
+            )
+        else:
+            game_mode = rng.choice(["walls", "pass-through"])
+            window = rng.choice(["today", "week", "all"])
+            await recorder.request(
+                client,
+                "GET /leaderboard?game_mode&window",
+                "GET",
+                f"/leaderboard?limit=10&game_mode={game_mode}&window={window}",
+            )
+
+
+async def run(client, args, count_statements):
+    recorder = Recorder(count_statements, args.think)
+    rng = random.Random(args.seed)
+    started = time.perf_counter()
+    deadline = started + args.duration
+    clients = []
+    for role, count in (
+        (player, args.players),
+        (spectator, args.spectators),
+        (reader, args.readers),
+    ):
+        for worker in range(count):
+            seed = rng.random()
+            clients.append(
+                role(client, recorder, worker, deadline, random.Random(seed))
+            )
+    await asyncio.gather(*clients)
+    return recorder.summary(time.perf_counter() - started)
+
+
+def print_summary(routes):
+    print(
+        f"{'route':<36}{'count':>8}{'rps':>9}{'p50 ms':>9}{'p95 ms':>9}"
+        f"{'p99 ms':>9}{'stmts':>7}"
+    )
+    for route, row in routes.items():
+        queries = row["statements_per_request"]
+        print(
+            f"{route:<36}{row['requests']:>8}{row['rps']:>9.1f}"
+            f"{row['p50_ms']:>9.2f}{row['p95_ms']:>9.2f}{row['p99_ms']:>9.2f}"
+            f"{'-' if queries is None else f'{queries:.1f}':>7}"
+        )
+
+
+def regressions(routes, baseline, tolerance):
+    """Routes that got slower, lost throughput or issue more statements"""
+    found = []
+    for route, row in routes.items():
+        before = baseline.get(route)
+        if before is None:
+            continue
+        if row["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+            found.append(
+                f"{route}: p95 {before['p95_ms']:.2f} -> {row['p95_ms']:.2f} ms"
+            )
+        if row["rps"] < before["rps"] * (1 - tolerance):
+            found.append(f"{route}: {before['rps']:.1f} -> {row['rps']:.1f} req/s")
+        queries, queries_before = (
+            row["statements_per_request"],
+            before["statements_per_request"],
+        )
+        # Statement counts are exact, any growth is a regression
+        if queries is not None and queries_before is not None:
+            if queries > queries_before + 0.05:
+                found.append(
+                    f"{route}: {queries_before:.2f} -> {queries:.2f} statements"
+                )
+    return found
+
+
+async def in_process(args):
+    if args.database == "postgres":
+        url = os.getenv("TEST_POSTGRES_URL")
+        if not url:
+            sys.exit("--database postgres needs TEST_POSTGRES_URL")
+        os.environ["DATABASE_URL"] = url
+    else:
+        if os.path.exists(SQLITE_DATABASE):
+            os.remove(SQLITE_DATABASE)
+        os.environ["DATABASE_URL"] = f"sqlite:///{SQLITE_DATABASE}"
+
+    from sqlalchemy import event
+
+    from main import app
+    from models import Base, get_engine
+
+    engine = get_engine()
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def count(conn, cursor, statement, parameters, context, executemany):
+        counter = statements.get()
+        if counter is not None:
+            counter[0] += 1
+
+    try:
+        async with app.router.lifespan_context(app):
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(
+                transport=transport, base_url="http://load"
+            ) as client:
+                return await run(client, args, count_statements=True)
+    finally:
+        if args.database == "sqlite":
+            os.remove(SQLITE_DATABASE)
+
+
+async def against_server(args):
+    limits = httpx.Limits(max_connections=args.players + args.spectators + args.readers)
+    async with httpx.AsyncClient(
+        base_url=args.url, limits=limits, timeout=args.timeout
+    ) as client:
+        return await run(client, args, count_statements=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--url", help="base URL of a running server")
+    parser.add_argument("--database", choices=["sqlite", "postgres"], default="sqlite")
+    parser.add_argument("--players", type=int, default=40)
+    parser.add_argument("--spectators", type=int, default=20)
+    parser.add_argument("--readers", type=int, default=10)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds")
+    parser.add_argument(
+        "--think", type=float, default=0.0, help="seconds between a client's requests"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=60.0, help="seconds")
+    parser.add_argument("--output", help="save the results to this JSON file")
+    parser.add_argument("--baseline", help="JSON results of an earlier run")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="fraction p95 and req/s may worsen before it's a regression",
+    )
+    args = parser.parse_args()
+
+    routes = asyncio.run(against_server(args) if args.url else in_process(args))
+    print_summary(routes)
+
+    if args.output:
+        results = {
+            "created_at": datetime.utcnow().isoformat(),
+            "target": args.url or args.database,
+            "python": platform.python_version(),
+            "clients": {
+                "players": args.players,
+                "spectators": args.spectators,
+                "readers": args.readers,
+            },
+            "duration": args.duration,
+            "routes": routes,
+        }
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            found = regressions(routes, json.load(baseline)["routes"], args.tolerance)
+        for regression in found:
+            print(f"REGRESSION {regression}")
+        if found:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Serialization benchmark for large /players responses
+
+Serves the same rows through two routes of a throwaway app: the way the list
+endpoints used to, one Pydantic model per row validated again against the
+response_model and encoded by FastAPI, and the way they do now, plain dicts
+handed to ORJSONResponse. Reports requests per second and the peak memory
+allocated while serving one response, for every list size.
+
+    uv run python benchmarks/players_json.py --rows 100 1000 10000
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+import tracemalloc
+from typing import List
+
+import httpx
+from fastapi import FastAPI
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import Player
+from responses import ORJSONResponse
+
+COLUMNS = ("id", "game_id", "username", "score", "status", "game_mode")
+
+
+def make_rows(count):
+    return [
+        (index % 1000, index, f"player_{index}", index * 10 % 5000, "playing", "walls")
+        for index in range(count)
+    ]
+
+
+def make_app(rows):
+    app = FastAPI()
+
+    @app.get("/models", response_model=List[Player])
+    async def models():
+        return [
+            Player(
+                id=user_id,
+                game_id=game_id,
+                username=username,
+                score=score,
+                status=status,
+                game_mode=game_mode,
+            )
+            for user_id, game_id, username, score, status, game_mode in rows
+        ]
+
+    @app.get("/orjson", response_model=List[Player])
+    async def fast():
+        return ORJSONResponse([dict(zip(COLUMNS, row)) for row in rows])
+
+    return app
+
+
+async def measure(client, path, duration):
+    # Allocation peak of a single response, then throughput untraced
+    tracemalloc.start()
+    response = await client.get(path)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    assert response.status_code == 200
+
+    requests = 0
+    started = time.perf_counter()
+    deadline = started + duration
+    while time.perf_counter() < deadline:
+        await client.get(path)
+        requests += 1
+    return requests / (time.perf_counter() - started), peak, response.content
+
+
+async def run(counts, duration):
+    print(f"{'rows':>8}{'path':>8}{'req/s':>10}{'ms/req':>10}{'peak KiB':>12}")
+    for count in counts:
+        app = make_app(make_rows(count))
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://b"
+        ) as client:
+            bodies = []
+            for path in ("models", "orjson"):
+                rate, peak, body = await measure(client, f"/{path}", duration)
+                bodies.append(body)
+                print(
+                    f"{count:>8}{path:>8}{rate:>10,.0f}{1000 / rate:>10.2f}"
+                    f"{peak / 1024:>12,.0f}"
+                )
+            # Both paths have to send the very same JSON
+            assert bodies[0] == bodies[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--duration", type=float, default=2.0, help="seconds per run")
+    args = parser.parse_args()
+    asyncio.run(run(args.rows, args.duration))
+
+
+if __name__ == "__main__":
+    main()
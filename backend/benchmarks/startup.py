@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+Cold start of the API: import time and time to the first request
+
+Each run starts a fresh interpreter twice. One imports the app and reports
+how long that took, and which of the modules main imports took longest,
+from python -X importtime. The other launches serve.py with a single worker
+on a throwaway SQLite database, whose tables DB_CREATE_SCHEMA creates, and
+polls /health until it answers: the time from the launch to that answer is
+what a new Fargate task spends before it can serve. Reports the median and
+the spread over --runs runs and saves them as JSON. Given a --baseline from
+an earlier run, a start that got slower is listed and the exit status is 1:
+
+    uv run python benchmarks/startup.py --output startup.json
+    # ... change things ...
+    uv run python benchmarks/startup.py --baseline startup.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import httpx
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_APP = """
+import time
+started = time.perf_counter()
+import main
+print(time.perf_counter() - started)
+"""
+
+
+def free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def environment(database: str, **extra) -> dict:
+    return {
+        **os.environ,
+        "DATABASE_URL": f"sqlite:///{database}",
+        "DB_CREATE_SCHEMA": "true",
+        "STATE_BACKEND": "memory",
+        **extra,
+    }
+
+
+def import_time(database: str) -> float:
+    """Seconds a fresh interpreter takes to import the app"""
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT_APP],
+        cwd=BACKEND,
+        env=environment(database),
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return float(output.split()[-1])
+
+
+def slowest_imports(database: str, count: int) -> list:
+    """(module, ms) of the modules main imports itself, slowest first"""
+    report = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=BACKEND,
+        env=environment(database),
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stderr
+    # "import time: self [us] | cumulative | <two spaces per level>module",
+    # where a module's imports are listed right before it
+    modules, children = [], []
+    for line in report.splitlines():
+        fields = line.split("|")
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        _, cumulative, name = fields
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 0:
+            if name.strip() == "main":
+                modules = children
+                break
+            children = []
+        elif depth == 1:
+            children.append((name.strip(), int(cumulative) / 1000))
+    return sorted(modules, key=lambda module: -module[1])[:count]
+
+
+def first_request_time(database: str, timeout: float) -> float:
+    """Seconds from launching serve.py until /health answers"""
+    port = free_port()
+    env = environment(database, PORT=str(port), HOST="127.0.0.1", WEB_CONCURRENCY="1")
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "serve.py"],
+        cwd=BACKEND,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=1) as client:
+            while time.perf_counter() - started < timeout:
+                if server.poll() is not None:
+                    sys.exit(f"serve.py exited with {server.returncode}")
+                try:
+                    if client.get("/health").status_code == 200:
+                        return time.perf_counter() - started
+                except httpx.TransportError:
+                    pass
+                time.sleep(0.01)
+        sys.exit(f"serve.py didn't answer within {timeout} seconds")
+    finally:
+        server.send_signal(signal.SIGTERM)
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+
+def summarize(samples) -> dict:
+    return {
+        "median_ms": statistics.median(samples) * 1000,
+        "min_ms": min(samples) * 1000,
+        "max_ms": max(samples) * 1000,
+    }
+
+
+def regressions(results, baseline, tolerance):
+    """Measurements whose median got slower than the baseline allows"""
+    found = []
+    for name, row in results.items():
+        before = baseline.get(name)
+        if before and row["median_ms"] > before["median_ms"] * (1 + tolerance):
+            found.append(
+                f"{name}: {before['median_ms']:.0f} -> {row['median_ms']:.0f} ms"
+            )
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--modules", type=int, default=10, help="slowest to list")
+    parser.add_argument("--timeout", type=float, default=60.0, help="seconds")
+    parser.add_argument("--output", help="save the results to this JSON file")
+    parser.add_argument("--baseline", help="JSON results of an earlier run")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="fraction a median may worsen before it's a regression",
+    )
+    args = parser.parse_args()
+
+    imports, first_requests = [], []
+    with tempfile.TemporaryDirectory() as directory:
+        for run in range(args.runs):
+            # A new database every run, so each start creates the tables
+            database = os.path.join(directory, f"startup_{run}.db")
+            imports.append(import_time(database))
+            first_requests.append(first_request_time(database, args.timeout))
+        modules = slowest_imports(os.path.join(directory, "modules.db"), args.modules)
+
+    results = {
+        "import": summarize(imports),
+        "first_request": summarize(first_requests),
+    }
+    print(f"{'':<16}{'median ms':>11}{'min ms':>9}{'max ms':>9}")
+    for name, row in results.items():
+        print(
+            f"{name:<16}{row['median_ms']:>11.0f}{row['min_ms']:>9.0f}"
+            f"{row['max_ms']:>9.0f}"
+        )
+    print("\nslowest imports of main")
+    for module, ms in modules:
+        print(f"  {module:<40}{ms:>8.1f} ms")
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(
+                {
+                    "created_at": datetime.utcnow().isoformat(),
+                    "python": platform.python_version(),
+                    "runs": args.runs,
+                    "results": results,
+                    "slowest_imports": dict(modules),
+                },
+                output,
+                indent=2,
+            )
+
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            found = regressions(results, json.load(baseline)["results"], args.tolerance)
+        for regression in found:
+            print(f"REGRESSION {regression}")
+        if found:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
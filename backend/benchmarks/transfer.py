@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Throughput of the bulk export and import
+
+Fills a database with --users users and --games finished games, exports both
+tables in each format and imports the dump into an empty database, reporting
+the rows per second of each step. Without --url it runs on throwaway SQLite
+databases; given a Postgres URL it uses that one as the source and a second
+database, --target, as the destination, whose users and games are emptied
+first:
+
+    uv run python benchmarks/transfer.py --games 1000000
+    uv run python benchmarks/transfer.py --url postgresql://... --target postgresql://...
+
+Parquet is measured when pyarrow (the parquet extra) is installed.
+"""
+
+import argparse
+import asyncio
+import importlib.util
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import delete
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from models import Base, Game, ScoreRollup, User, UserStats, to_async_url
+import transfer
+
+
+async def fill(session_factory, users: int, games: int, chunk: int) -> None:
+    started = datetime(2026, 1, 1)
+    async with session_factory() as db:
+        for first in range(0, users, chunk):
+            rows = [
+                (id, f"bench_{id}", started)
+                for id in range(first + 1, min(first + chunk, users) + 1)
+            ]
+            await transfer.load_rows(db, User.__table__, rows)
+        for first in range(0, games, chunk):
+            rows = []
+            for id in range(first + 1, min(first + chunk, games) + 1):
+                created = started + timedelta(seconds=id)
+                rows.append(
+                    (
+                        id,
+                        random.randint(1, users),
+                        random.randrange(0, 5000, 10),
+                        random.choice(("walls", "pass-through")),
+                        "finished",
+                        created,
+                        created + timedelta(seconds=random.randint(10, 600)),
+                    )
+                )
+            await transfer.load_rows(db, Game.__table__, rows)
+        await db.commit()
+
+
+async def empty(engine) -> None:
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        for model in (ScoreRollup, UserStats, Game, User):
+            await conn.execute(delete(model))
+
+
+def rate(rows: int, seconds: float) -> str:
+    return f"{rows / seconds:>12,.0f}"
+
+
+async def run(args, source_url: str, target_url: str, directory: str) -> None:
+    source = create_async_engine(to_async_url(source_url))
+    target = create_async_engine(to_async_url(target_url))
+    source_sessions = async_sessionmaker(bind=source, expire_on_commit=False)
+    target_sessions = async_sessionmaker(bind=target, expire_on_commit=False)
+
+    await empty(source)
+    started = time.perf_counter()
+    await fill(source_sessions, args.users, args.games, args.chunk)
+    print(
+        f"filled {args.users:,} users and {args.games:,} games "
+        f"in {time.perf_counter() - started:.1f}s"
+    )
+
+    formats = [
+        format
+        for format in transfer.FORMATS
+        if format != "parquet" or importlib.util.find_spec("pyarrow")
+    ]
+    print(f"{'format':<10}{'export rows/s':>14}{'import rows/s':>14}{'dump MB':>10}")
+    for format in formats:
+        path = os.path.join(directory, format)
+        started = time.perf_counter()
+        counts = await transfer.export_dump(
+            source_sessions, path, format, chunk=args.chunk
+        )
+        exported = time.perf_counter() - started
+
+        await empty(target)
+        started = time.perf_counter()
+        # Only the tables themselves, the rebuilds aren't part of the transfer
+        for name, table in transfer.TABLES.items():
+            await transfer.import_table(
+                target_sessions,
+                table,
+                transfer.dump_path(path, name, format),
+                format,
+                args.chunk,
+            )
+        imported = time.perf_counter() - started
+
+        rows = sum(counts.values())
+        size = sum(
+            os.path.getsize(os.path.join(path, name)) for name in os.listdir(path)
+        )
+        print(
+            f"{format:<10}{rate(rows, exported)}  {rate(rows, imported)}"
+            f"{size / 1e6:>10.1f}"
+        )
+
+    await source.dispose()
+    await target.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--url", help="source database, a throwaway SQLite one by default"
+    )
+    parser.add_argument("--target", help="database to import into")
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--games", type=int, default=200000)
+    parser.add_argument("--chunk", type=int, default=transfer.TRANSFER_CHUNK)
+    args = parser.parse_args()
+    if args.url and not args.target:
+        parser.error("--url needs a --target to import into")
+
+    with tempfile.TemporaryDirectory() as directory:
+        source = args.url or f"sqlite:///{os.path.join(directory, 'source.db')}"
+        target = args.target or f"sqlite:///{os.path.join(directory, 'target.db')}"
+        asyncio.run(run(args, source, target, directory))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Response cache for the polled read endpoints
+
+The watching list and the leaderboard poll GET /players and GET /leaderboard
+every few seconds, mostly to learn that nothing changed. Their 200 responses
+are kept here as the bytes that were sent, keyed by path and query, along
+with the version of the shared state they were built from. The write
+endpoints, the rollup compaction and backfill move that version whenever the
+players or the leaderboard change, and the leaderboard's also holds the UTC
+day its today and week windows start from, so while it holds a request is
+answered with the stored bytes, or with an empty 304 if its If-None-Match
+already names them, without running the endpoint at all.
+"""
+
+import hashlib
+import os
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Hashable, List, Tuple
+
+# Responses kept per worker, one per path and query string
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", 256))
+# Seconds browsers may reuse a response before revalidating it
+RESPONSE_CACHE_MAX_AGE = int(os.getenv("RESPONSE_CACHE_MAX_AGE", 1))
+
+
+class CachedResponse:
+    __slots__ = ("version", "etag", "body", "headers")
+
+    def __init__(
+        self, version: Hashable, body: bytes, headers: List[Tuple[bytes, bytes]]
+    ):
+        self.version = version
+        # Strong, the same bytes always get the same tag on every worker
+        self.etag = f'"{hashlib.blake2b(body, digest_size=12).hexdigest()}"'.encode()
+        self.body = body
+        # The endpoint's own headers, e.g. its content type and next cursor
+        self.headers = headers
+
+
+def etag_matches(if_none_match: bytes, etag: bytes) -> bool:
+    if if_none_match.strip() == b"*":
+        return True
+    # If-None-Match compares weakly, so W/ prefixes don't matter
+    tags = (tag.strip() for tag in if_none_match.split(b","))
+    return etag in (tag[2:] if tag.startswith(b"W/") else tag for tag in tags)
+
+
+class ResponseCacheMiddleware:
+    """Serves GETs of the cached routes from memory while their version holds"""
+
+    def __init__(
+        self,
+        app,
+        routes: Dict[str, str],
+        version: Callable[[str], Awaitable[Hashable]],
+        size: int = RESPONSE_CACHE_SIZE,
+        max_age: int = RESPONSE_CACHE_MAX_AGE,
+    ):
+        self.app = app
+        # Path -> name of the version its responses depend on
+        self.routes = routes
+        self.version = version
+        self.size = size
+        self.cache_control = f"public, max-age={max_age}".encode()
+        self._entries: OrderedDict[Tuple[str, bytes], CachedResponse] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    async def __call__(self, scope, receive, send):
+        name = self.routes.get(scope["path"]) if scope["type"] == "http" else None
+        if name is None or scope["method"] != "GET":
+            await self.app(scope, receive, send)
+            return
+
+        key = (scope["path"], scope["query_string"])
+        # Read before building, so a change made meanwhile isn't hidden
+        version = await self.version(name)
+        entry = self._entries.get(key)
+        if entry is not None and entry.version == version:
+            self._entries.move_to_end(key)
+            await self._respond(scope, send, entry)
+            return
+
+        messages: List[dict] = []
+
+        async def capture(message):
+            messages.append(message)
+
+        await self.app(scope, receive, capture)
+        start = messages[0]
+        if start["type"] != "http.response.start" or start["status"] != 200:
+            for message in messages:
+                await send(message)
+            return
+
+        body = b"".join(m.get("body", b"") for m in messages[1:])
+        headers = [
+            (name, value)
+            for name, value in start["headers"]
+            if name.lower() != b"content-length"
+        ]
+        entry = CachedResponse(version, body, headers)
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+        await self._respond(scope, send, entry)
+
+    async def _respond(self, scope, send, entry: CachedResponse) -> None:
+        headers = [(b"etag", entry.etag), (b"cache-control", self.cache_control)]
+        if_none_match = dict(scope["headers"]).get(b"if-none-match")
+        if if_none_match is not None and etag_matches(if_none_match, entry.etag):
+            await send(
+                {"type": "http.response.start", "status": 304, "headers": headers}
+            )
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        headers += entry.headers
+        headers.append((b"content-length", str(len(entry.body)).encode()))
+        await send({"type": "http.response.start", "status": 200, "headers": headers})
+        await send({"type": "http.response.body", "body": entry.body})
@@ -0,0 +1,262 @@
+"""
+Server-side snake simulation
+
+Mirrors the rules of the frontend's GameBoard: the snake moves one cell per
+tick, eating food scores 10 points and every 50 points the tick interval
+shrinks by 10ms down to 50ms. In pass-through mode the board wraps around, in
+walls mode leaving it ends the game, and running into the body always does.
+
+Boards are kept small so that thousands of games fit in one worker. Cells
+are numbered y * size + x, the body is a ring buffer of cell numbers in an
+array and a bitmap with one bit per cell answers "is this cell taken" in
+constant time. Food placement draws from a per-game seeded mulberry32, the
+same generator the frontend uses, so a seed and the inputs of a game played
+in the browser replay to the same game here.
+"""
+
+import os
+import random
+import time
+from array import array
+from typing import Callable, Dict, List, Optional, Tuple
+
+GRID_SIZE = 20
+# Milliseconds per tick at the start, the floor and the step between them
+INITIAL_SPEED = 150
+MIN_SPEED = 50
+SPEED_STEP = 10
+FOOD_SCORE = 10
+SPEED_UP_EVERY = 50
+# Random draws before falling back to a scan for a free food cell
+FOOD_ATTEMPTS = 100
+
+GAME_MODES = ("pass-through", "walls")
+DIRECTIONS = ("UP", "RIGHT", "DOWN", "LEFT")
+UP, RIGHT, DOWN, LEFT = range(4)
+# (dx, dy) indexed by direction
+MOVES = ((0, -1), (1, 0), (0, 1), (-1, 0))
+# Seconds between passes of the loop that steps simulated games in real time
+SIMULATION_INTERVAL = float(os.getenv("SIMULATION_INTERVAL", 0.025))
+
+
+class Mulberry32:
+    """Small 32-bit PRNG that is easy to reproduce in JavaScript"""
+
+    __slots__ = ("state",)
+
+    def __init__(self, seed: int):
+        self.state = seed & 0xFFFFFFFF
+
+    def random(self) -> float:
+        self.state = a = (self.state + 0x6D2B79F5) & 0xFFFFFFFF
+        t = ((a ^ (a >> 15)) * (a | 1)) & 0xFFFFFFFF
+        t = ((t + (((t ^ (t >> 7)) * (t | 61)) & 0xFFFFFFFF)) & 0xFFFFFFFF) ^ t
+        return (t ^ (t >> 14)) / 4294967296
+
+
+class SnakeGame:
+    """One game's board, advanced a tick at a time"""
+
+    __slots__ = (
+        "mode",
+        "walls",
+        "size",
+        "cells",
+        "body",
+        "head",
+        "length",
+        "occupied",
+        "food",
+        "direction",
+        "next_direction",
+        "score",
+        "speed",
+        "tick",
+        "over",
+        "seed",
+        "rng",
+    )
+
+    def __init__(self, mode: str = "pass-through", seed=None, size: int = GRID_SIZE):
+        if mode not in GAME_MODES:
+            raise ValueError(f"Unknown game mode: {mode}")
+        self.mode = mode
+        self.walls = mode == "walls"
+        self.size = size
+        self.cells = size * size
+        # Ring buffer of body cells, body[head] is the head and the tail sits
+        # length - 1 slots behind it
+        self.body = array("H" if self.cells <= 0xFFFF else "L", [0]) * self.cells
+        self.occupied = bytearray((self.cells + 7) >> 3)
+        self.head = 0
+        self.length = 1
+        start = (size // 2) * size + size // 2
+        self.body[0] = start
+        self.occupied[start >> 3] |= 1 << (start & 7)
+
+        self.direction = self.next_direction = RIGHT
+        self.score = 0
+        self.speed = INITIAL_SPEED
+        self.tick = 0
+        self.over = False
+        if seed is None:
+            seed = random.getrandbits(32)
+        self.seed = seed
+        self.rng = Mulberry32(seed)
+        self.food = self._place_food()
+
+    def is_occupied(self, cell: int) -> bool:
+        return bool(self.occupied[cell >> 3] & (1 << (cell & 7)))
+
+    def _place_food(self) -> Optional[int]:
+        size = self.size
+        cells = self.cells
+        occupied = self.occupied
+        random = self.rng.random
+        for _ in range(FOOD_ATTEMPTS):
+            # x first, then y, in the same order as the client
+            x = int(random() * size)
+            cell = int(random() * size) * size + x
+            if not occupied[cell >> 3] & (1 << (cell & 7)):
+                return cell
+        # A crowded board: take the first free cell after the last draw
+        for offset in range(1, cells):
+            candidate = (cell + offset) % cells
+            if not occupied[candidate >> 3] & (1 << (candidate & 7)):
+                return candidate
+        return None
+
+    def turn(self, direction: int) -> bool:
+        """Queue a direction for the next tick, reversing onto the body is ignored"""
+        if direction == (self.direction + 2) % 4:
+            return False
+        self.next_direction = direction
+        return True
+
+    def step(self) -> bool:
+        """Advance one tick, returns False once the game is over"""
+        if self.over:
+            return False
+        size = self.size
+        occupied = self.occupied
+        body = self.body
+        self.direction = direction = self.next_direction
+
+        cell = body[self.head]
+        dx, dy = MOVES[direction]
+        x = cell % size + dx
+        y = cell // size + dy
+        if x < 0 or x >= size or y < 0 or y >= size:
+            if self.walls:
+                self.over = True
+                return False
+            x %= size
+            y %= size
+        cell = y * size + x
+
+        # The tail still counts as taken, like on the client
+        if occupied[cell >> 3] & (1 << (cell & 7)):
+            self.over = True
+            return False
+
+        ate = cell == self.food
+        if ate:
+            self.length += 1
+        else:
+            tail = body[(self.head - self.length + 1) % self.cells]
+            occupied[tail >> 3] &= ~(1 << (tail & 7))
+
+        self.head = (self.head + 1) % self.cells
+        body[self.head] = cell
+        occupied[cell >> 3] |= 1 << (cell & 7)
+        self.tick += 1
+
+        if ate:
+            self.score += FOOD_SCORE
+            if self.score % SPEED_UP_EVERY == 0 and self.speed > MIN_SPEED:
+                self.speed -= SPEED_STEP
+            self.food = self._place_food()
+            if self.food is None:
+                # Nowhere left to go
+                self.over = True
+                return False
+        return True
+
+    def snake(self) -> List[List[int]]:
+        """Body cells as [x, y] pairs from head to tail"""
+        size = self.size
+        cells = []
+        for index in range(self.length):
+            cell = self.body[(self.head - index) % self.cells]
+            cells.append([cell % size, cell // size])
+        return cells
+
+    def state(self) -> dict:
+        food = self.food
+        return {
+            "tick": self.tick,
+            "score": self.score,
+            "speed": self.speed,
+            "direction": DIRECTIONS[self.direction],
+            "snake": self.snake(),
+            "food": None if food is None else [food % self.size, food // self.size],
+            "over": self.over,
+        }
+
+
+class Arena:
+    """Live games of this worker, stepped on the server's clock"""
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self._games: Dict[int, SnakeGame] = {}
+        # Clock time at which each game's next tick is due
+        self._due: Dict[int, float] = {}
+        # Called with (game_id, game) after every tick and once the game is over
+        self.on_step: Optional[Callable[[int, SnakeGame], None]] = None
+
+    def __len__(self) -> int:
+        return len(self._games)
+
+    def start(self, game_id: int, mode: str, seed=None) -> SnakeGame:
+        game = SnakeGame(mode, seed)
+        self._games[game_id] = game
+        self._due[game_id] = self.clock() + game.speed / 1000
+        if self.on_step is not None:
+            self.on_step(game_id, game)
+        return game
+
+    def get(self, game_id: int) -> Optional[SnakeGame]:
+        return self._games.get(game_id)
+
+    def advance(self, game_id: int) -> Optional[SnakeGame]:
+        """Catch a game up with the clock, None if it isn't running here"""
+        game = self._games.get(game_id)
+        if game is None:
+            return None
+        now = self.clock()
+        due = self._due[game_id]
+        on_step = self.on_step
+        while due <= now and not game.over:
+            game.step()
+            if on_step is not None:
+                on_step(game_id, game)
+            due += game.speed / 1000
+        self._due[game_id] = due
+        return game
+
+    def advance_all(self) -> List[Tuple[int, SnakeGame]]:
+        """Catch every game up with the clock, returns the ones that are over"""
+        over = []
+        for game_id in list(self._games):
+            game = self.advance(game_id)
+            if game.over:
+                over.append((game_id, game))
+        return over
+
+    def remove(self, game_id: int) -> Optional[SnakeGame]:
+        self._due.pop(game_id, None)
+        return self._games.pop(game_id, None)
+
+
+arena = Arena()
@@ -0,0 +1,73 @@
+"""
+Process-local materialized leaderboard
+
+Holds the best finished score of the top users in memory so that
+GET /leaderboard never has to sort the games table. It is seeded once at
+startup and kept current by the game endpoints as games finish.
+"""
+
+import bisect
+import os
+from typing import Dict, List, Optional, Tuple
+
+# Number of users kept in memory, i.e. the deepest page that can be served
+LEADERBOARD_SIZE = int(os.getenv("LEADERBOARD_SIZE", 100))
+
+
+class Leaderboard:
+    """Bounded top-N of users ordered by their best score"""
+
+    def __init__(self, capacity: int = LEADERBOARD_SIZE):
+        self.capacity = capacity
+        # Sorted ascending on (-score, user_id), so the best score comes first
+        self._order: List[Tuple[int, int]] = []
+        self._entries: Dict[int, Tuple[int, str]] = {}
+
+    def __len__(self) -> int:
+        return len(self._order)
+
+    def submit(self, user_id: int, username: str, score: int) -> bool:
+        """Record a finished score, returns True if the leaderboard changed"""
+        current = self._entries.get(user_id)
+        if current is not None:
+            if score <= current[0]:
+                return False
+            del self._order[bisect.bisect_left(self._order, (-current[0], user_id))]
+        elif len(self._order) >= self.capacity and (-score, user_id) >= self._order[-1]:
+            return False
+
+        bisect.insort(self._order, (-score, user_id))
+        self._entries[user_id] = (score, username)
+
+        # A user pushed off the bottom can only come back with a better score,
+        # which goes through submit again, so dropping them is safe
+        if len(self._order) > self.capacity:
+            _, evicted = self._order.pop()
+            del self._entries[evicted]
+        return True
+
+    def top(
+        self,
+        limit: int,
+        offset: int = 0,
+        after: Optional[Tuple[int, int]] = None,
+    ) -> List[Tuple[int, str, int]]:
+        """Return (user_id, username, score) rows for one page"""
+        # Keyset pages start right past the (score, user_id) of the last row
+        if after is not None:
+            score, user_id = after
+            offset += bisect.bisect_right(self._order, (-score, user_id))
+        rows = []
+        for negative_score, user_id in self._order[offset : offset + limit]:
+            rows.append((user_id, self._entries[user_id][1], -negative_score))
+        return rows
+
+    def load(self, rows) -> None:
+        """Replace the contents with (user_id, username, score) rows"""
+        self._order.clear()
+        self._entries.clear()
+        for user_id, username, score in rows:
+            self.submit(user_id, username, score)
+
+
+leaderboard = Leaderboard()
@@ -0,0 +1,115 @@
+"""
+In-memory change feed for the live players list
+
+The game endpoints publish small diff events (a game joined the list, its
+score changed, it left the list) and every /ws/players or /players/stream
+connection receives them through its own bounded buffer. A slow consumer
+never holds up the publisher: pending events for the same game are coalesced
+and if too many distinct games pile up the buffer is dropped and the
+connection is told to fetch a fresh snapshot instead.
+"""
+
+import asyncio
+import os
+from typing import Dict, List, Optional, Set
+
+# Distinct games that may be pending for one connection before it resyncs
+PLAYER_FEED_BUFFER = int(os.getenv("PLAYER_FEED_BUFFER", 256))
+
+
+class Subscription:
+    """Pending events for one connection, keyed by game id"""
+
+    def __init__(self, buffer: int):
+        self.buffer = buffer
+        self.pending: Dict[int, dict] = {}
+        self.resync = False
+        self._loop = asyncio.get_running_loop()
+        self._ready = asyncio.Event()
+
+    def deliver(self, event: dict) -> None:
+        game_id = event["game_id"]
+        previous = self.pending.pop(game_id, None)
+        if previous is not None and previous["type"] == "joined":
+            # A left replaces the join, the connection may have had the game
+            # in its snapshot already and deleting an unknown one is harmless
+            if event["type"] == "score":
+                event = {
+                    **previous,
+                    "player": {**previous["player"], "score": event["score"]},
+                }
+
+        self.pending[game_id] = event
+        if len(self.pending) > self.buffer:
+            self.request_resync()
+        else:
+            self._ready.set()
+
+    def request_resync(self) -> None:
+        self.pending.clear()
+        self.resync = True
+        self._ready.set()
+
+    async def get(self) -> Optional[List[dict]]:
+        """Wait for events, returns None when a fresh snapshot is needed"""
+        while not self.pending and not self.resync:
+            self._ready.clear()
+            await self._ready.wait()
+
+        if self.resync:
+            self.resync = False
+            return None
+        events = list(self.pending.values())
+        self.pending.clear()
+        return events
+
+
+class PlayerFeed:
+    """Fans player events out to every connected watcher"""
+
+    def __init__(self, buffer: int = PLAYER_FEED_BUFFER):
+        self.buffer = buffer
+        self._subscriptions: Set[Subscription] = set()
+
+    def subscribe(self) -> Subscription:
+        subscription = Subscription(self.buffer)
+        self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        self._subscriptions.discard(subscription)
+
+    def resync(self) -> None:
+        """Send every subscriber a fresh snapshot, e.g. after missed events"""
+        for subscription in list(self._subscriptions):
+            if subscription._loop.is_closed():
+                self.unsubscribe(subscription)
+            else:
+                subscription._loop.call_soon_threadsafe(subscription.request_resync)
+
+    def publish(self, event: dict) -> None:
+        """Queue an event for every subscriber, safe to call from any thread"""
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+
+        for subscription in list(self._subscriptions):
+            if subscription._loop.is_closed():
+                self.unsubscribe(subscription)
+            elif running is subscription._loop:
+                subscription.deliver(event)
+            else:
+                subscription._loop.call_soon_threadsafe(subscription.deliver, event)
+
+    def joined(self, player: dict) -> None:
+        self.publish({"type": "joined", "game_id": player["game_id"], "player": player})
+
+    def score_changed(self, game_id: int, score: int) -> None:
+        self.publish({"type": "score", "game_id": game_id, "score": score})
+
+    def left(self, game_id: int, status: str) -> None:
+        self.publish({"type": "left", "game_id": game_id, "status": status})
+
+
+player_feed = PlayerFeed()
@@ -1,37 +1,131 @@
-from fastapi import FastAPI, Depends, HTTPException, status
-from fastapi.security import HTTPBearer
+from fastapi import APIRouter, FastAPI, Depends, HTTPException, Query, WebSocket, status
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import AsyncIterator, Dict, List, Literal, Optional, Tuple
 from datetime import datetime
-from sqlalchemy.orm import Session
-import uvicorn
+from contextlib import asynccontextmanager
+from sqlalchemy import insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+import asyncio
+import base64
+import hmac
+import json
+import logging
 import os
 from fastapi.middleware.cors import CORSMiddleware
 
 # Import database models and setup
-from models import Base, engine, get_db, User, Game
-
-# Initialize FastAPI app
-app = FastAPI(
-    title="Snake Game API",
-    version="1.0.0",
-    description="API for the Snake Game application with multiplayer features",
+from models import (
+    create_tables,
+    dialect_insert,
+    get_db,
+    get_engine,
+    SessionLocal,
+    User,
+    Game,
 )
-
-# Add CORS middleware to fix OPTIONS request issues
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # In production, specify exact origins
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+from leaderboard import LEADERBOARD_SIZE
+from live import player_feed
+from state import state
+from cache import ResponseCacheMiddleware
+from responses import JSONResponse, ORJSONResponse
+from profiling import (
+    ProfilingMiddleware,
+    process_uptime,
+    request_metrics,
+    resident_memory,
 )
+from paging import decode_cursor, encode_cursor, window_start
+from archive import run_archival, user_games
+from reaper import game_reaper, live_games
+from rollups import (
+    leaderboard_page,
+    load_best_scores,
+    record_game,
+    run_compaction,
+)
+from scores import score_buffer
+from stats import first_finish, record_games, summary, user_stats
+from transfer import MEDIA_TYPES, TABLES, export_stream
+from pool import pool_metrics, warm_pool
+from users import MISSING, user_cache
+from engine import DIRECTIONS, GAME_MODES, SIMULATION_INTERVAL, SnakeGame, arena
+from replays import MAX_REPLAY_TICKS, decode_inputs, replay_verifier
+from spectate import END, end_after, is_valid_frame, spectators
+
+logger = logging.getLogger(__name__)
+
+# Create the tables at startup, for development and benchmarks on a fresh
+# database. Deployments run the migrations instead
+DB_CREATE_SCHEMA = os.getenv("DB_CREATE_SCHEMA", "false").lower() in ("1", "true")
+
+# Spectators of simulated games get frames straight from the engine
+arena.on_step = spectators.publish_game
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # The schema is managed by migrations: run `alembic upgrade head` first
+    if DB_CREATE_SCHEMA:
+        await create_tables()
+
+    await state.start()
+    # Seed the shared state once, the game endpoints keep it current
+    if await state.needs_seeding():
+        async with SessionLocal() as db:
+            await load_best_scores(db)
+            players = await get_players_from_db(db)
+            live = await live_games(db)
+        await state.load_players(players)
+        # Every live game gets a full timeout before it's reaped
+        for status in ("playing", "idle"):
+            await state.track([id for id, s in live if s == status], status)
+
+    score_buffer.start(SessionLocal)
+    simulations = asyncio.create_task(run_simulations())
+    compaction = asyncio.create_task(run_compaction(SessionLocal))
+    archival = asyncio.create_task(run_archival(SessionLocal))
+    game_reaper.start(SessionLocal)
+
+    # Connect ahead of the first requests, the server only accepts them once
+    # this returns
+    connections = await warm_pool(get_engine())
+    request_metrics.startup_seconds = process_uptime()
+    logger.info(
+        "Worker %d ready with %d connections, %s seconds after it started, "
+        "%s bytes resident",
+        os.getpid(),
+        connections,
+        request_metrics.startup_seconds,
+        resident_memory(),
+    )
+    yield
+    simulations.cancel()
+    compaction.cancel()
+    archival.cancel()
+    await game_reaper.stop()
+    # Write any buffered scores before the connections go away
+    await score_buffer.stop(SessionLocal)
+    replay_verifier.shutdown()
+    await state.stop()
+    await get_engine().dispose()
+
+
+# Endpoints, served by the app create_app() builds
+router = APIRouter(default_response_class=JSONResponse)
 
 # Security
 security = HTTPBearer()
+# Bearer token of the /admin endpoints, which are off while it's unset
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
 
-# Create database tables
-Base.metadata.create_all(bind=engine)
+def require_admin(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    if not ADMIN_TOKEN or not hmac.compare_digest(
+        credentials.credentials.encode(), ADMIN_TOKEN.encode()
+    ):
+        raise HTTPException(status_code=403, detail="Not allowed")
 
 
 # Pydantic models
@@ -61,8 +155,22 @@ class LeaderboardEntry(BaseModel):
     score: int
 
 
+class RankedEntry(LeaderboardEntry):
+    rank: int
+
+
+class RankResponse(RankedEntry):
+    # Users with a finished game
+    total: int
+
+
+GameMode = Literal["pass-through", "walls"]
+Window = Literal["today", "week", "all"]
+
+
 class Player(BaseModel):
     id: int
+    game_id: int
     username: str
     score: int
     status: str  # playing, idle, finished
@@ -72,14 +180,60 @@ class Player(BaseModel):
 class GameStart(BaseModel):
     user_id: int
     game_mode: str  # pass-through, walls
+    # Run the game on the server, which then owns the score
+    simulated: bool = False
 
 
 class ScoreUpdate(BaseModel):
     score: int
 
 
+class ScoreBatchItem(BaseModel):
+    game_id: int
+    score: int
+
+
+class ScoreBatch(BaseModel):
+    scores: List[ScoreBatchItem]
+
+
+class ScoreBatchResponse(BaseModel):
+    accepted: int
+
+
+class Replay(BaseModel):
+    seed: int  # seed of the client's food RNG
+    ticks: int  # moves made before the game ended
+    inputs: str  # base64 of the encoded direction changes
+    # The final score, checked instead of whatever score reached the server
+    # last, as queued batches may land after the finish or on another worker
+    score: Optional[int] = None
+
+
+# Statuses a game can still leave, and those a client can move it to
+LIVE_STATUSES = ("playing", "idle")
+GameStatus = Literal["playing", "idle", "finished"]
+
+
 class GameStatusUpdate(BaseModel):
-    status: str  # playing, idle, finished
+    status: GameStatus
+    # Sent with finished to have the score checked before it's ranked
+    replay: Optional[Replay] = None
+
+
+class GameInput(BaseModel):
+    direction: Literal["UP", "DOWN", "LEFT", "RIGHT"]
+
+
+class GameState(BaseModel):
+    game_id: int
+    tick: int
+    score: int
+    speed: int  # milliseconds per tick
+    direction: str
+    snake: List[List[int]]  # [x, y] cells from head to tail
+    food: Optional[List[int]]
+    over: bool
 
 
 class GameResponse(BaseModel):
@@ -87,167 +241,752 @@ class GameResponse(BaseModel):
     user_id: int
     score: int
     game_mode: str  # pass-through, walls
-    status: str  # playing, idle, finished
+    status: str  # playing, idle, finished, rejected
     created_at: datetime
 
 
-# Helper functions
-def get_user_by_username(db: Session, username: str) -> Optional[User]:
-    return db.query(User).filter(User.username == username).first()
+class GameHistoryEntry(GameResponse):
+    finished_at: Optional[datetime] = None
 
 
-def create_user_in_db(db: Session, username: str) -> User:
-    user = User(username=username)
-    db.add(user)
-    db.commit()
-    db.refresh(user)
-    return user
+class ModeStats(BaseModel):
+    games_played: int
+    best_score: Optional[int]
+    average_score: Optional[float]
+    play_seconds: float
 
 
-def create_game_in_db(db: Session, user_id: int, game_mode: str) -> Game:
-    game = Game(user_id=user_id, game_mode=game_mode)
-    db.add(game)
-    db.commit()
-    db.refresh(game)
-    return game
+class UserStatsResponse(ModeStats):
+    id: int
+    username: str
+    modes: Dict[str, ModeStats]
 
 
-def get_leaderboard_from_db(db: Session) -> List[LeaderboardEntry]:
-    # Get top 10 players by highest score
-    # This query gets the highest score for each user
-    leaderboard_query = (
-        db.query(User.id.label("user_id"), User.username, Game.score.label("score"))
-        .join(Game)
-        .filter(Game.status == "finished")
-        .order_by(Game.score.desc())
-        .limit(10)
+# Helper functions
+async def get_user_by_username(db: AsyncSession, username: str) -> Optional[User]:
+    result = await db.execute(select(User).where(User.username == username))
+    return result.scalars().first()
+
+
+async def create_user_in_db(db: AsyncSession, username: str) -> Optional[User]:
+    """Insert a user unless the name is taken, returns None if it was"""
+    # ON CONFLICT DO NOTHING leaves no window between checking and inserting,
+    # RETURNING reads back id and defaults without a refresh SELECT
+    user = await db.scalar(
+        dialect_insert(db)(User)
+        .values(username=username)
+        .on_conflict_do_nothing(index_elements=[User.username])
+        .returning(User)
     )
+    await db.commit()
+    return user
 
-    leaderboard = []
-    for user_id, username, score in leaderboard_query:
-        leaderboard.append(LeaderboardEntry(id=user_id, username=username, score=score))
 
-    return leaderboard
+async def get_or_create_user(db: AsyncSession, username: str) -> Tuple[int, str]:
+    """Return (user_id, username), creating the user on first login"""
+    cached = user_cache.get(username)
+    if cached is not None and cached is not MISSING:
+        return cached
+
+    async with user_cache.lock(username):
+        # Another request for this name may have filled the cache meanwhile
+        cached = user_cache.get(username)
+        if cached is not None and cached is not MISSING:
+            return cached
+
+        user = None
+        if cached is None:
+            user = await get_user_by_username(db, username)
+            if user is None:
+                # Retries after a failed insert skip straight to the upsert
+                user_cache.put_missing(username)
+        if user is None:
+            user = await create_user_in_db(db, username)
+        if user is None:
+            # Created by another worker between our SELECT and INSERT
+            user = await get_user_by_username(db, username)
+
+        user_cache.put(user.id, user.username)
+        return user.id, user.username
+
+
+async def create_game_in_db(db: AsyncSession, user_id: int, game_mode: str) -> Game:
+    game = await db.scalar(
+        insert(Game).values(user_id=user_id, game_mode=game_mode).returning(Game)
+    )
+    await db.commit()
+    return game
 
 
-def get_players_from_db(db: Session) -> List[Player]:
-    # Get all players currently playing
+async def update_game_in_db(
+    db: AsyncSession, game_id: int, current: Tuple[str, ...] = LIVE_STATUSES, **values
+):
+    # A single UPDATE ... RETURNING gives back the game and its owner's name,
+    # or None when there is no such game or it's no longer in a current status.
+    # Finished and rejected games are never changed, so a game is only ranked
+    # on its way into finished
+    finished_at = datetime.utcnow()
+    if values.get("status") == "finished":
+        values["finished_at"] = first_finish(finished_at)
+    owner = select(User.username).where(User.id == Game.user_id).scalar_subquery()
+    result = await db.execute(
+        update(Game)
+        .where(Game.id == game_id, Game.status.in_(current))
+        .values(**values)
+        .returning(Game, owner)
+        .execution_options(synchronize_session=False)
+    )
+    row = result.one_or_none()
+    if row is not None and row[0].status == "finished":
+        # The filtered leaderboards and the user's stats change in the same
+        # transaction
+        await record_game(db, row[0])
+        await record_games(db, [row[0]], {row[0].id: finished_at})
+    await db.commit()
+    return row
+
+
+async def game_not_updated(db: AsyncSession, game_id: int) -> HTTPException:
+    """404 for a game that doesn't exist, 409 for one past the update"""
+    if await db.scalar(select(Game.id).where(Game.id == game_id)) is None:
+        return HTTPException(status_code=404, detail="Game not found")
+    return HTTPException(status_code=409, detail="Game is no longer live")
+
+
+async def get_leaderboard_from_db(
+    db: AsyncSession, limit: int = 10
+) -> List[Tuple[int, str, int]]:
+    # Get (user_id, username, score) of the top players by highest score
+    # Each user's best game of all time is their all-time rollup, so this is
+    # a range of the rollups' index, archived games included
+    rows = await leaderboard_page(db, limit)
+    return [(user_id, username, score) for user_id, username, score, _ in rows]
+
+
+async def get_players_from_db(db: AsyncSession) -> List[dict]:
+    # Get all players currently playing, as dicts shaped like Player
     players_query = (
-        db.query(
-            User.id.label("user_id"),
+        select(
+            User.id,
+            Game.id.label("game_id"),
             User.username,
             Game.score,
             Game.status,
             Game.game_mode,
         )
         .join(Game)
-        .filter(Game.status == "playing")
+        .where(Game.status == "playing")
     )
 
-    players = []
-    for user_id, username, score, game_status, game_mode in players_query:
-        players.append(
-            Player(
-                id=user_id,
-                username=username,
-                score=score,
-                status=game_status,
-                game_mode=game_mode,
-            )
+    result = await db.execute(players_query)
+    return [dict(row) for row in result.mappings()]
+
+
+async def record_finished_score(game: Game, username: str) -> None:
+    # Offer a finished game's score to the shared leaderboard
+    await state.submit_score(game.user_id, username, game.score)
+
+
+async def simulation_state(
+    db: AsyncSession, game_id: int, simulation: SnakeGame
+) -> GameState:
+    """Report a simulated game, finishing it in the database once it's over"""
+    if simulation.over:
+        arena.remove(game_id)
+        score_buffer.take(game_id)
+        row = await update_game_in_db(
+            db, game_id, score=simulation.score, status="finished"
+        )
+        if row:
+            game, username = row
+            await state.player_left(game.id, game.status)
+            await record_finished_score(game, username)
+
+    return GameState(game_id=game_id, **simulation.state())
+
+
+def decode_replay(replay: Replay) -> List[Tuple[int, int]]:
+    """The (tick, direction) inputs of a replay, 400 if they don't decode"""
+    if not 0 <= replay.ticks <= MAX_REPLAY_TICKS:
+        raise HTTPException(status_code=400, detail="Replay is too long")
+    try:
+        return decode_inputs(
+            base64.b64decode(replay.inputs, validate=True), replay.ticks
         )
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Malformed replay")
+
+
+async def verify_replay(
+    db: AsyncSession,
+    game_id: int,
+    replay: Replay,
+    inputs: List[Tuple[int, int]],
+    claimed: Optional[int],
+) -> str:
+    """Replay a finishing game, returns finished or rejected"""
+    result = await db.execute(
+        select(Game.game_mode, Game.score, Game.status).where(Game.id == game_id)
+    )
+    row = result.one_or_none()
+    if row is None:
+        raise HTTPException(status_code=404, detail="Game not found")
+    if row.status not in LIVE_STATUSES:
+        # Not worth replaying, the update would be refused
+        raise HTTPException(status_code=409, detail="Game is no longer live")
+    if row.game_mode not in GAME_MODES:
+        return "rejected"
+    if claimed is None:
+        claimed = row.score
+
+    score = await replay_verifier.score(
+        row.game_mode, replay.seed, replay.ticks, inputs
+    )
+    return "finished" if score == claimed else "rejected"
+
+
+async def run_simulations() -> None:
+    """Step simulated games in real time, finishing the ones that end"""
+    while True:
+        await asyncio.sleep(SIMULATION_INTERVAL)
+        over = arena.advance_all()
+        if not over:
+            continue
+        try:
+            async with SessionLocal() as db:
+                for game_id, simulation in over:
+                    await simulation_state(db, game_id, simulation)
+        except Exception:
+            logger.exception("Finishing simulated games failed, will retry")
+
+
+def player_from_game(game: Game, username: str) -> Player:
+    return Player(
+        id=game.user_id,
+        game_id=game.id,
+        username=username,
+        score=game.score,
+        status=game.status,
+        game_mode=game.game_mode,
+    )
 
-    return players
+
+def parse_cursor(cursor: Optional[str]) -> Optional[Tuple[int, int]]:
+    if cursor is None:
+        return None
+    try:
+        return decode_cursor(cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Malformed cursor")
+
+
+def page_response(
+    rows: List[dict], limit: int, last: Optional[Tuple[int, int]]
+) -> ORJSONResponse:
+    """One page of a list, with the cursor of the next if there may be one"""
+    response = ORJSONResponse(rows)
+    if len(rows) == limit and last is not None:
+        response.headers["X-Next-Cursor"] = encode_cursor(*last)
+    return response
+
+
+async def player_updates() -> AsyncIterator[dict]:
+    # Yield a snapshot of the players list, then diff events as they happen.
+    # Subscribing first means nothing published during the snapshot is lost.
+    subscription = player_feed.subscribe()
+    try:
+        events = None
+        while True:
+            if events is None:
+                yield {"type": "snapshot", "players": await state.players()}
+            else:
+                for event in events:
+                    yield event
+            events = await subscription.get()
+    finally:
+        player_feed.unsubscribe(subscription)
 
 
 # API Endpoints
-@app.post("/login", response_model=LoginResponse)
-async def login(request: LoginRequest, db: Session = Depends(get_db)):
+@router.post("/login", response_model=LoginResponse)
+async def login(request: LoginRequest, db: AsyncSession = Depends(get_db)):
     """Authenticate a user and return a token"""
-    user = get_user_by_username(db, request.username)
-    if not user:
-        # Create new user if doesn't exist
-        user = create_user_in_db(db, request.username)
+    user_id, username = await get_or_create_user(db, request.username)
 
     # In a real app, this would be a JWT token
-    token = f"mock_token_for_{user.username}"
+    token = f"mock_token_for_{username}"
 
-    return LoginResponse(id=user.id, username=user.username, token=token)
+    return LoginResponse(id=user_id, username=username, token=token)
 
 
-@app.post("/users", response_model=UserResponse, status_code=status.HTTP_201_CREATED)
-async def create_user_endpoint(user_create: UserCreate, db: Session = Depends(get_db)):
+@router.post("/users", response_model=UserResponse, status_code=status.HTTP_201_CREATED)
+async def create_user_endpoint(
+    user_create: UserCreate, db: AsyncSession = Depends(get_db)
+):
     """Create a new user"""
-    existing_user = get_user_by_username(db, user_create.username)
-    if existing_user:
+    cached = user_cache.get(user_create.username)
+    user = None
+    if cached is None or cached is MISSING:
+        user = await create_user_in_db(db, user_create.username)
+    if user is None:
         raise HTTPException(status_code=409, detail="User already exists")
 
-    user = create_user_in_db(db, user_create.username)
+    user_cache.put(user.id, user.username)
     return user
 
 
-@app.get("/leaderboard", response_model=List[LeaderboardEntry])
-async def get_leaderboard_endpoint(db: Session = Depends(get_db)):
+@router.get("/leaderboard", response_model=List[LeaderboardEntry])
+async def get_leaderboard_endpoint(
+    limit: int = Query(10, ge=1, le=LEADERBOARD_SIZE),
+    offset: int = Query(0, ge=0),
+    cursor: Optional[str] = None,
+    game_mode: Optional[GameMode] = None,
+    window: Window = "all",
+    db: AsyncSession = Depends(get_db),
+):
     """Get leaderboard data"""
-    return get_leaderboard_from_db(db)
+    after = parse_cursor(cursor)
+    if game_mode is None and window == "all":
+        # The all-time leaderboard is kept in the shared state, its cursors
+        # hold (score, user_id). It only holds the top LEADERBOARD_SIZE, so
+        # one more row tells whether there's a next page to point to
+        rows = await state.top(limit + 1, offset, after)
+        last = (rows[limit - 1][2], rows[limit - 1][0]) if len(rows) > limit else None
+        rows = rows[:limit]
+    else:
+        # Filtered ones are paged through the rollups, with (score, game_id)
+        if offset:
+            raise HTTPException(
+                status_code=400, detail="Filtered leaderboards are paged by cursor"
+            )
+        page = await leaderboard_page(db, limit, game_mode, window, after)
+        rows = [(user_id, username, score) for user_id, username, score, _ in page]
+        last = (page[-1][2], page[-1][3]) if page else None
+
+    entries = [
+        {"id": user_id, "username": username, "score": score}
+        for user_id, username, score in rows
+    ]
+    return page_response(entries, limit, last)
 
 
-@app.get("/players", response_model=List[Player])
-async def get_players_endpoint(db: Session = Depends(get_db)):
+async def usernames(db: AsyncSession, user_ids: List[int]) -> dict:
+    result = await db.execute(
+        select(User.id, User.username).where(User.id.in_(user_ids))
+    )
+    return dict(result.all())
+
+
+@router.get("/users/{user_id}/rank", response_model=RankResponse)
+async def get_user_rank(user_id: int, db: AsyncSession = Depends(get_db)):
+    """A user's place among everyone by their best finished score"""
+    user = await db.get(User, user_id)
+    if user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    found = await state.rank(user_id)
+    if found is None:
+        raise HTTPException(status_code=404, detail="User has no finished games")
+    rank, score, total = found
+    return {
+        "id": user.id,
+        "username": user.username,
+        "score": score,
+        "rank": rank,
+        "total": total,
+    }
+
+
+@router.get("/users/{user_id}/games", response_model=List[GameHistoryEntry])
+async def get_user_games(
+    user_id: int,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_db),
+):
+    """A user's games, newest first"""
+    if await db.get(User, user_id) is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    # Cursors hold (user_id, game_id)
+    after = parse_cursor(cursor)
+    # One statement per page, whatever its size, archived games included
+    games = await user_games(db, user_id, limit, after[1] if after else None)
+    entries = [
+        {
+            "id": game.id,
+            "user_id": game.user_id,
+            "score": game.score,
+            "game_mode": game.game_mode,
+            "status": game.status,
+            "created_at": game.created_at,
+            "finished_at": game.finished_at,
+        }
+        for game in games
+    ]
+    return page_response(entries, limit, (user_id, games[-1].id) if games else None)
+
+
+@router.get("/users/{user_id}/stats", response_model=UserStatsResponse)
+async def get_user_stats(user_id: int, db: AsyncSession = Depends(get_db)):
+    """Games played, best and average score and play time, per game mode too"""
+    user = await db.get(User, user_id)
+    if user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return {
+        "id": user.id,
+        "username": user.username,
+        **summary(await user_stats(db, user_id)),
+    }
+
+
+@router.get("/leaderboard/around/{user_id}", response_model=List[RankedEntry])
+async def get_leaderboard_around(
+    user_id: int,
+    count: int = Query(5, ge=0, le=50),
+    db: AsyncSession = Depends(get_db),
+):
+    """A user's leaderboard entry with count entries above and below"""
+    rows = await state.around(user_id, count)
+    if not rows:
+        raise HTTPException(status_code=404, detail="User has no finished games")
+    names = await usernames(db, [other for _, other, _ in rows])
+    return [
+        {"id": other, "username": names[other], "score": score, "rank": rank}
+        for rank, other, score in rows
+    ]
+
+
+@router.get("/players", response_model=List[Player])
+async def get_players_endpoint(
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    game_mode: Optional[GameMode] = None,
+):
     """Get list of players with their current status"""
-    return get_players_from_db(db)
+    # Best score first, cursors hold (score, game_id)
+    players = await state.players_page(limit, parse_cursor(cursor), game_mode)
+    last = (players[-1]["score"], players[-1]["game_id"]) if players else None
+    return page_response(players, limit, last)
+
+
+@router.websocket("/ws/players")
+async def players_websocket(websocket: WebSocket):
+    """Stream the players list: a snapshot followed by incremental updates"""
+    await websocket.accept()
+
+    async def forward():
+        async for message in player_updates():
+            await websocket.send_json(message)
+
+    sender = asyncio.create_task(forward())
+    try:
+        # Watchers don't send anything, receiving only notices the disconnect
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+    finally:
+        sender.cancel()
+
+
+@router.websocket("/ws/games/{game_id}/watch")
+async def watch_game_websocket(websocket: WebSocket, game_id: int):
+    """Stream a game's binary board frames, see spectate.py for the format"""
+    await websocket.accept()
+    spectator = spectators.subscribe(game_id)
+
+    async def forward():
+        # Every spectator is sent the publisher's bytes as they are
+        while frames := await spectator.get():
+            for frame in frames:
+                await websocket.send_bytes(frame)
+
+    sender = asyncio.create_task(forward())
+    try:
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+    finally:
+        sender.cancel()
+        spectators.unsubscribe(game_id, spectator)
+
+
+@router.websocket("/ws/games/{game_id}/play")
+async def publish_game_websocket(
+    websocket: WebSocket, game_id: int, db: AsyncSession = Depends(get_db)
+):
+    """Relay the board frames of a game played in the browser to its spectators"""
+    game = await db.get(Game, game_id)
+    await db.close()
+    # Games simulated here are published by the server itself
+    if game is None or game.status != "playing" or arena.get(game_id) is not None:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    await websocket.accept()
+    last_frame = None
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            frame = message.get("bytes")
+            if frame is None or not is_valid_frame(frame):
+                continue
+            spectators.publish(game_id, frame)
+            last_frame = frame
+            if frame[0] == END:
+                break
+    finally:
+        # Let spectators know when the player leaves without ending the game
+        if last_frame is not None and last_frame[0] != END:
+            spectators.publish(game_id, end_after(last_frame))
+
+
+@router.get("/players/stream")
+async def players_stream():
+    """Server-sent events fallback for /ws/players"""
+
+    async def events():
+        async for message in player_updates():
+            yield f"data: {json.dumps(message)}\n\n"
+
+    return StreamingResponse(
+        events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"}
+    )
 
 
-@app.post("/games", response_model=GameResponse, status_code=status.HTTP_201_CREATED)
-async def start_game(game_start: GameStart, db: Session = Depends(get_db)):
+@router.post("/games", response_model=GameResponse, status_code=status.HTTP_201_CREATED)
+async def start_game(game_start: GameStart, db: AsyncSession = Depends(get_db)):
     """Start a new game"""
     # Verify user exists
-    user = db.query(User).filter(User.id == game_start.user_id).first()
+    user = await db.get(User, game_start.user_id)
     if not user:
         raise HTTPException(status_code=400, detail="User not found")
 
-    game = create_game_in_db(db, game_start.user_id, game_start.game_mode)
+    if game_start.simulated and game_start.game_mode not in GAME_MODES:
+        raise HTTPException(status_code=400, detail="Unknown game mode")
+
+    game = await create_game_in_db(db, game_start.user_id, game_start.game_mode)
+    if game_start.simulated:
+        arena.start(game.id, game.game_mode)
+    await state.player_joined(player_from_game(game, user.username).model_dump())
     return game
 
 
-@app.put("/games/{game_id}/score", response_model=GameResponse)
+@router.post(
+    "/games/scores:batch",
+    response_model=ScoreBatchResponse,
+    status_code=status.HTTP_202_ACCEPTED,
+)
+async def update_scores_batch(batch: ScoreBatch, db: AsyncSession = Depends(get_db)):
+    """Buffer many score updates, they are written by the next flush"""
+    game_ids = list(dict.fromkeys(item.game_id for item in batch.scores))
+    found = await game_reaper.touch(db, game_ids)
+    # Finished, unknown and simulated games don't take scores, their items
+    # aren't accepted
+    live = {
+        game_id
+        for game_id, is_live in zip(game_ids, found)
+        if is_live and arena.get(game_id) is None
+    }
+    scores = {}
+    accepted = 0
+    for item in batch.scores:
+        if item.game_id in live:
+            scores[item.game_id] = score_buffer.add(item.game_id, item.score)
+            accepted += 1
+    await state.player_scores(scores)
+
+    return ScoreBatchResponse(accepted=accepted)
+
+
+@router.put("/games/{game_id}/score", response_model=GameResponse)
 async def update_score(
-    game_id: int, score_update: ScoreUpdate, db: Session = Depends(get_db)
+    game_id: int, score_update: ScoreUpdate, db: AsyncSession = Depends(get_db)
 ):
     """Update game score"""
-    game = db.query(Game).filter(Game.id == game_id).first()
-    if not game:
-        raise HTTPException(status_code=404, detail="Game not found")
-
-    game.score = score_update.score
-    db.commit()
-    db.refresh(game)
-
+    if arena.get(game_id) is not None:
+        raise HTTPException(status_code=409, detail="Score is kept by the server")
+    await game_reaper.touch(db, [game_id])
+    # An explicit score supersedes anything still in the write-behind buffer
+    score_buffer.take(game_id)
+    # Only a game being played takes a score, a finished one keeps the score
+    # it was ranked or rejected with
+    row = await update_game_in_db(db, game_id, ("playing",), score=score_update.score)
+    if not row:
+        raise await game_not_updated(db, game_id)
+    game, _ = row
+
+    await state.player_scores({game.id: game.score})
     return game
 
 
-@app.put("/games/{game_id}/status", response_model=GameResponse)
+@router.put("/games/{game_id}/status", response_model=GameResponse)
 async def update_game_status(
-    game_id: int, status_update: GameStatusUpdate, db: Session = Depends(get_db)
+    game_id: int, status_update: GameStatusUpdate, db: AsyncSession = Depends(get_db)
 ):
     """Update game status"""
-    game = db.query(Game).filter(Game.id == game_id).first()
-    if not game:
-        raise HTTPException(status_code=404, detail="Game not found")
+    replay_inputs = None
+    if status_update.status == "finished" and status_update.replay is not None:
+        # Refuse a malformed replay before anything leaves the score buffer
+        replay_inputs = decode_replay(status_update.replay)
+
+    values = {"status": status_update.status}
+    # Scores still in the write-behind buffer land together with the status
+    buffered_score = score_buffer.take(game_id)
+    if buffered_score is not None:
+        values["score"] = buffered_score
+    if status_update.status == "finished" and arena.get(game_id) is not None:
+        # A simulated game ends with the score the server counted
+        simulation = arena.advance(game_id)
+        values["score"] = simulation.score
+        arena.remove(game_id)
+        simulation.over = True
+        spectators.publish_game(game_id, simulation)
+    elif replay_inputs is not None:
+        claimed = buffered_score
+        if status_update.replay.score is not None:
+            claimed = values["score"] = status_update.replay.score
+        # A score that doesn't replay is kept for reference but never ranked
+        values["status"] = await verify_replay(
+            db, game_id, status_update.replay, replay_inputs, claimed
+        )
 
-    game.status = status_update.status
-    db.commit()
-    db.refresh(game)
+    row = await update_game_in_db(db, game_id, **values)
+    if not row:
+        raise await game_not_updated(db, game_id)
+    game, username = row
+
+    # The live players list only holds games that are playing. Watchers
+    # treat joined as an upsert and left as a delete, and a pending join is
+    # replaced by a later left rather than dropped, so repeats are harmless
+    if game.status == "playing":
+        await state.player_joined(player_from_game(game, username).model_dump())
+    else:
+        await state.player_left(game.id, game.status)
+
+    # Only reached on the way out of playing or idle, so once per game
+    if game.status == "finished":
+        await record_finished_score(game, username)
 
     return game
 
 
-@app.get("/health")
+@router.post("/games/{game_id}/heartbeat", status_code=status.HTTP_204_NO_CONTENT)
+async def game_heartbeat(game_id: int, db: AsyncSession = Depends(get_db)):
+    """Keep a game from being reaped while nothing else is sent"""
+    (live,) = await game_reaper.touch(db, [game_id])
+    if not live:
+        raise HTTPException(status_code=404, detail="Game is not live")
+
+
+@router.post("/games/{game_id}/input", response_model=GameState)
+async def send_game_input(
+    game_id: int, game_input: GameInput, db: AsyncSession = Depends(get_db)
+):
+    """Steer a simulated game, the turn applies from the next tick"""
+    simulation = arena.advance(game_id)
+    if simulation is None:
+        raise HTTPException(status_code=404, detail="Game is not simulated")
+    simulation.turn(DIRECTIONS.index(game_input.direction))
+    await game_reaper.touch(db, [game_id])
+    return await simulation_state(db, game_id, simulation)
+
+
+@router.get("/games/{game_id}/state", response_model=GameState)
+async def get_game_state(game_id: int, db: AsyncSession = Depends(get_db)):
+    """Authoritative state of a simulated game"""
+    simulation = arena.advance(game_id)
+    if simulation is None:
+        raise HTTPException(status_code=404, detail="Game is not simulated")
+    await game_reaper.touch(db, [game_id])
+    return await simulation_state(db, game_id, simulation)
+
+
+@router.get("/admin/export/{table}", dependencies=[Depends(require_admin)])
+async def export_table(
+    table: Literal["users", "games", "games_archive"],
+    format: Literal["ndjson", "csv"] = "ndjson",
+    db: AsyncSession = Depends(get_db),
+):
+    """Stream every row of a table, read off a server-side cursor"""
+    return StreamingResponse(
+        export_stream(db, TABLES[table], format),
+        media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{table}.{format}"'},
+    )
+
+
+@router.get("/internal/metrics/db-pool")
+async def db_pool_metrics():
+    """Connection pool usage, checkout wait times and connection churn"""
+    return pool_metrics.snapshot(get_engine().pool)
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Per route latency, statements and time split, for Prometheus"""
+    return PlainTextResponse(
+        request_metrics.render(), media_type="text/plain; version=0.0.4"
+    )
+
+
+@router.get("/internal/metrics/reaper")
+async def reaper_metrics():
+    """Games idled, finished and revived by the stale game reaper"""
+    return game_reaper.snapshot()
+
+
+@router.get("/health")
 async def health_check():
     """Health check endpoint"""
     return {"status": "healthy"}
 
 
-# Main entry point
+async def cache_version(name: str) -> Tuple[int, Optional[datetime]]:
+    """What cached players or leaderboard responses were built from"""
+    # The today and week leaderboards move on at midnight UTC without a write
+    day = window_start("today") if name == "leaderboard" else None
+    return await state.version(name), day
+
+
+def create_app() -> FastAPI:
+    """The API, which connects and starts its background tasks in the lifespan"""
+    app = FastAPI(
+        title="Snake Game API",
+        version="1.0.0",
+        description="API for the Snake Game application with multiplayer features",
+        lifespan=lifespan,
+        default_response_class=JSONResponse,
+    )
+
+    # Serve unchanged polled lists from memory, inside CORS so its headers
+    # aren't cached
+    app.add_middleware(
+        ResponseCacheMiddleware,
+        routes={"/leaderboard": "leaderboard", "/players": "players"},
+        version=cache_version,
+    )
+
+    # Add CORS middleware to fix OPTIONS request issues
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],  # In production, specify exact origins
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+        expose_headers=["X-Next-Cursor"],
+    )
+
+    # Outermost, so cached and preflight responses are timed too
+    app.add_middleware(ProfilingMiddleware, metrics=request_metrics)
+    app.include_router(router)
+    return app
+
+
+app = create_app()
+
+
+# Development server, production runs serve.py
 if __name__ == "__main__":
+    import uvicorn
+
     port = int(os.getenv("PORT", 8000))
     uvicorn.run("main:app", host="0.0.0.0", port=port, reload=False)
@@ -0,0 +1,52 @@
+"""initial schema
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-17 09:00:00
+
+Databases created before migrations existed already have these tables from
+Base.metadata.create_all, so they are only created when missing.
+"""
+
+from alembic import context, op
+import sqlalchemy as sa
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    existing = []
+    if not context.is_offline_mode():
+        existing = sa.inspect(op.get_bind()).get_table_names()
+
+    if "users" not in existing:
+        op.create_table(
+            "users",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("username", sa.String(), nullable=False),
+            sa.Column("created_at", sa.DateTime(), nullable=True),
+        )
+        op.create_index("ix_users_id", "users", ["id"])
+        op.create_index("ix_users_username", "users", ["username"], unique=True)
+
+    if "games" not in existing:
+        op.create_table(
+            "games",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column(
+                "user_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=False
+            ),
+            sa.Column("score", sa.Integer(), nullable=True),
+            sa.Column("game_mode", sa.String(), nullable=False),
+            sa.Column("status", sa.String(), nullable=True),
+            sa.Column("created_at", sa.DateTime(), nullable=True),
+        )
+        op.create_index("ix_games_id", "games", ["id"])
+
+
+def downgrade() -> None:
+    op.drop_table("games")
+    op.drop_table("users")
@@ -0,0 +1,42 @@
+"""indexes for the players and leaderboard queries
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17 09:30:00
+
+- (status, score DESC, id DESC) lets the leaderboard walk finished games
+  from the top score down, a page at a time, without sorting.
+- (user_id, status) serves per-user lookups and the users/games join.
+- A partial index on user_id for playing games keeps /players proportional
+  to the number of live games rather than to all history.
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        "ix_games_status_score_id",
+        "games",
+        ["status", sa.text("score DESC"), sa.text("id DESC")],
+    )
+    op.create_index("ix_games_user_id_status", "games", ["user_id", "status"])
+    op.create_index(
+        "ix_games_playing_user_id",
+        "games",
+        ["user_id"],
+        postgresql_where=sa.text("status = 'playing'"),
+        sqlite_where=sa.text("status = 'playing'"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_games_playing_user_id", table_name="games")
+    op.drop_index("ix_games_user_id_status", table_name="games")
+    op.drop_index("ix_games_status_score_id", table_name="games")
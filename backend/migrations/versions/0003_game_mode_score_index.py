@@ -0,0 +1,29 @@
+"""index for leaderboards filtered by game mode
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17 15:00:00
+
+- (status, game_mode, score DESC, id DESC) lets a per-mode leaderboard page
+  seek to its cursor and walk down that mode's finished games only.
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        "ix_games_status_mode_score_id",
+        "games",
+        ["status", "game_mode", sa.text("score DESC"), sa.text("id DESC")],
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_games_status_mode_score_id", table_name="games")
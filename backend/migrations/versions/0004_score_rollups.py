@@ -0,0 +1,46 @@
+"""per mode and period best score rollups
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17 16:00:00
+
+Holds each user's best finished game per game mode and per day, ISO week and
+all time, so filtered leaderboards page through one index instead of walking
+games. Fill it from existing games with `python rollups.py backfill`.
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "score_rollups",
+        sa.Column("period", sa.String(), primary_key=True),
+        sa.Column("period_start", sa.Date(), primary_key=True),
+        sa.Column("game_mode", sa.String(), primary_key=True),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id"), primary_key=True),
+        sa.Column("best_score", sa.Integer(), nullable=False),
+        sa.Column("best_game_id", sa.Integer(), nullable=False),
+    )
+    op.create_index(
+        "ix_score_rollups_ranking",
+        "score_rollups",
+        [
+            "period",
+            "period_start",
+            "game_mode",
+            sa.text("best_score DESC"),
+            sa.text("best_game_id DESC"),
+        ],
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_score_rollups_ranking", table_name="score_rollups")
+    op.drop_table("score_rollups")
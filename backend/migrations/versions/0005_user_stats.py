@@ -0,0 +1,53 @@
+"""per user game stats and history
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-17 20:00:00
+
+- games.finished_at records when a game first finished, which play time is
+  counted up to and which keeps a game from being counted twice.
+- user_stats adds up each user's finished games per game mode as they
+  finish. It starts out with the games finished so far, whose play time
+  isn't known.
+- (user_id, id DESC) pages through a user's games newest first.
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column("games", sa.Column("finished_at", sa.DateTime(), nullable=True))
+    op.create_index("ix_games_user_id_id", "games", ["user_id", sa.text("id DESC")])
+    op.create_table(
+        "user_stats",
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id"), primary_key=True),
+        sa.Column("game_mode", sa.String(), primary_key=True),
+        sa.Column("games_played", sa.Integer(), nullable=False),
+        sa.Column("total_score", sa.BigInteger(), nullable=False),
+        sa.Column("best_score", sa.Integer(), nullable=False),
+        sa.Column("play_seconds", sa.Float(), nullable=False),
+    )
+    # The games finished so far, the app adds later ones as they finish
+    op.execute(
+        """
+        INSERT INTO user_stats
+            (user_id, game_mode, games_played, total_score, best_score, play_seconds)
+        SELECT user_id, game_mode, COUNT(*), COALESCE(SUM(score), 0),
+               COALESCE(MAX(score), 0), 0
+        FROM games
+        WHERE status = 'finished'
+        GROUP BY user_id, game_mode
+        """
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("user_stats")
+    op.drop_index("ix_games_user_id_id", table_name="games")
+    op.drop_column("games", "finished_at")
@@ -0,0 +1,57 @@
+"""archive of old finished games
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-17 22:00:00
+
+- games_archive holds finished games the archival job moved out of games, so
+  games only holds the live and recent ones. On Postgres it's partitioned by
+  created_at, one partition per month, which the job creates as it needs
+  them. The leaderboards, ranks and user stats come from score_rollups and
+  user_stats, which keep counting archived games.
+- (status, created_at) finds the oldest finished games, the next ones to
+  archive.
+- (user_id, id DESC) pages through a user's archived games.
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "games_archive",
+        sa.Column("id", sa.Integer(), primary_key=True, autoincrement=False),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=False),
+        sa.Column("score", sa.Integer()),
+        sa.Column("game_mode", sa.String(), nullable=False),
+        sa.Column("status", sa.String()),
+        sa.Column("created_at", sa.DateTime(), primary_key=True),
+        sa.Column("finished_at", sa.DateTime(), nullable=True),
+        postgresql_partition_by="RANGE (created_at)",
+    )
+    op.create_index(
+        "ix_games_archive_user_id_id",
+        "games_archive",
+        ["user_id", sa.text("id DESC")],
+    )
+    op.create_index("ix_games_status_created_at", "games", ["status", "created_at"])
+
+
+def downgrade() -> None:
+    # Archived games go back where they came from
+    op.execute(
+        """
+        INSERT INTO games
+            (id, user_id, score, game_mode, status, created_at, finished_at)
+        SELECT id, user_id, score, game_mode, status, created_at, finished_at
+        FROM games_archive
+        """
+    )
+    op.drop_index("ix_games_status_created_at", table_name="games")
+    op.drop_table("games_archive")
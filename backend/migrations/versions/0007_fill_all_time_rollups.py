@@ -0,0 +1,76 @@
+"""fill the all-time rollups from the finished games
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-18 10:00:00
+
+The all-time leaderboard and the ranks are seeded from the all-time
+score_rollups rows, which 0004 created empty. Each user's best finished game,
+live or archived, per game mode and over any mode ("*") is offered to them
+here, keeping whichever of it and a row the app wrote since is better, the
+way the app does. Day and week rows only hold games finished since 0004,
+`rollups.py backfill` rebuilds those too.
+"""
+
+from datetime import date
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0007"
+down_revision = "0006"
+branch_labels = None
+depends_on = None
+
+# rollups.ALL_TIME and rollups.ANY_MODE
+ALL_TIME = date(1970, 1, 1)
+ANY_MODE = "*"
+
+
+def upgrade() -> None:
+    # A bare parameter would be text to Postgres, while SQLite stores dates as
+    # text and would turn a CAST into a number
+    all_time = ":all_time"
+    if op.get_context().dialect.name == "postgresql":
+        all_time = "CAST(:all_time AS DATE)"
+    # (game mode, what a best game is picked per) of each kind of row
+    for mode, partition in (
+        ("game_mode", "user_id, game_mode"),
+        (f"'{ANY_MODE}'", "user_id"),
+    ):
+        op.execute(
+            sa.text(
+                f"""
+                INSERT INTO score_rollups
+                    (period, period_start, game_mode, user_id, best_score,
+                     best_game_id)
+                SELECT 'all', {all_time}, game_mode, user_id, score, id
+                FROM (
+                    SELECT id, user_id, {mode} AS game_mode, score,
+                           ROW_NUMBER() OVER (
+                               PARTITION BY {partition}
+                               ORDER BY score DESC, id DESC
+                           ) AS place
+                    FROM (
+                        SELECT id, user_id, game_mode, COALESCE(score, 0) AS score
+                        FROM games
+                        WHERE status = 'finished'
+                        UNION ALL
+                        SELECT id, user_id, game_mode, COALESCE(score, 0)
+                        FROM games_archive
+                    ) finished_games
+                ) best
+                WHERE place = 1
+                ON CONFLICT (period, period_start, game_mode, user_id) DO UPDATE
+                SET best_score = excluded.best_score,
+                    best_game_id = excluded.best_game_id
+                WHERE (excluded.best_score, excluded.best_game_id)
+                    > (score_rollups.best_score, score_rollups.best_game_id)
+                """
+            ).bindparams(sa.bindparam("all_time", ALL_TIME, type_=sa.Date))
+        )
+
+
+def downgrade() -> None:
+    # The rows are derived data, the app keeps offering games to them
+    pass
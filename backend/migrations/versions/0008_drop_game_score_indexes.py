@@ -0,0 +1,37 @@
+"""drop the game score indexes
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-18 12:00:00
+
+- The leaderboards read score_rollups since 0004, so nothing walks games by
+  score any more. (status, score DESC, id DESC) from 0002 and (status,
+  game_mode, score DESC, id DESC) from 0003 only cost the score updates of
+  live games, as an update to an indexed column can't be a HOT update.
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0008"
+down_revision = "0007"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.drop_index("ix_games_status_mode_score_id", table_name="games")
+    op.drop_index("ix_games_status_score_id", table_name="games")
+
+
+def downgrade() -> None:
+    op.create_index(
+        "ix_games_status_score_id",
+        "games",
+        ["status", sa.text("score DESC"), sa.text("id DESC")],
+    )
+    op.create_index(
+        "ix_games_status_mode_score_id",
+        "games",
+        ["status", "game_mode", sa.text("score DESC"), sa.text("id DESC")],
+    )
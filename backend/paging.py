@@ -0,0 +1,45 @@
+"""
+Keyset cursors and time windows of the list endpoints
+
+/players and /leaderboard are paged by keyset rather than OFFSET: the next
+page starts right after the (score, id) of the last row of the previous one,
+which every backend can seek to directly however deep the page is. The
+cursor is handed to clients opaque, in the X-Next-Cursor header of each page
+that may have a next one.
+"""
+
+import base64
+import struct
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+
+# Time windows of the leaderboard, periods are calendar days and ISO weeks in UTC
+WINDOWS = ("today", "week", "all")
+
+CURSOR = struct.Struct("<qq")
+
+
+def encode_cursor(score: int, id: int) -> str:
+    return base64.urlsafe_b64encode(CURSOR.pack(score, id)).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[int, int]:
+    """The (score, id) of a cursor, ValueError if it isn't one"""
+    try:
+        data = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        return CURSOR.unpack(data)
+    except (ValueError, struct.error):
+        raise ValueError(f"Malformed cursor: {cursor!r}")
+
+
+def window_start(window: str, now: Optional[datetime] = None) -> Optional[datetime]:
+    """When a window began, None for all time"""
+    if window == "all":
+        return None
+    now = now or datetime.utcnow()
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    if window == "today":
+        return today
+    if window == "week":
+        return today - timedelta(days=today.weekday())
+    raise ValueError(f"Unknown window: {window}")
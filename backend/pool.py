@@ -0,0 +1,163 @@
+"""
+Connection pool settings and metrics
+
+The pool is sized from the environment so each deployment can fit its share
+of the database's connection budget. The RDS t2.micro behind the CDK stack
+only allows around a hundred connections across every Fargate task and
+worker. InstrumentedPool records how long requests wait for a connection and
+how often connections are opened and closed, served by
+/internal/metrics/db-pool.
+"""
+
+import asyncio
+import os
+import time
+from bisect import bisect_left
+from contextlib import AsyncExitStack
+from uuid import uuid4
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+# Seconds to wait for a connection before the request fails
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))
+# Seconds after which a connection is replaced, -1 keeps them forever
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", -1))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "false").lower() in ("1", "true")
+# Behind PgBouncer in transaction mode: no app-side pool, no prepared statements
+DB_PGBOUNCER = os.getenv("DB_PGBOUNCER", "false").lower() in ("1", "true")
+
+# Upper bounds in seconds of the connection wait histogram buckets
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+
+class PoolMetrics:
+    """Counters for connection waits and churn"""
+
+    def __init__(self):
+        self.wait_counts = [0] * (len(WAIT_BUCKETS) + 1)
+        self.wait_sum = 0.0
+        self.timeouts = 0
+        self.checkouts = 0
+        self.connects = 0
+        self.closes = 0
+        self.invalidations = 0
+
+    def observe_wait(self, seconds: float) -> None:
+        self.wait_counts[bisect_left(WAIT_BUCKETS, seconds)] += 1
+        self.wait_sum += seconds
+
+    def attach(self, engine) -> None:
+        """Count connection churn of an engine's pool"""
+        target = getattr(engine, "sync_engine", engine)
+
+        @event.listens_for(target, "connect")
+        def on_connect(dbapi_connection, connection_record):
+            self.connects += 1
+
+        @event.listens_for(target, "checkout")
+        def on_checkout(dbapi_connection, connection_record, connection_proxy):
+            self.checkouts += 1
+
+        @event.listens_for(target, "close")
+        def on_close(dbapi_connection, connection_record):
+            self.closes += 1
+
+        @event.listens_for(target, "close_detached")
+        def on_close_detached(dbapi_connection):
+            self.closes += 1
+
+        @event.listens_for(target, "invalidate")
+        def on_invalidate(dbapi_connection, connection_record, exception):
+            self.invalidations += 1
+
+    def snapshot(self, pool) -> dict:
+        """Current pool state plus the counters, as served to operators"""
+        sized = isinstance(pool, AsyncAdaptedQueuePool)
+        buckets = []
+        cumulative = 0
+        for bound, count in zip(WAIT_BUCKETS + ("+Inf",), self.wait_counts):
+            cumulative += count
+            buckets.append({"le": bound, "count": cumulative})
+
+        return {
+            "pool": type(pool).__name__,
+            "size": pool.size() if sized else 0,
+            "checked_out": pool.checkedout() if sized else 0,
+            "checked_in": pool.checkedin() if sized else 0,
+            "overflow": max(pool.overflow(), 0) if sized else 0,
+            "max_overflow": pool._max_overflow if sized else 0,
+            "wait_seconds": {
+                "buckets": buckets,
+                "sum": self.wait_sum,
+                "count": cumulative,
+            },
+            "timeouts": self.timeouts,
+            "checkouts": self.checkouts,
+            "connects": self.connects,
+            "closes": self.closes,
+            "invalidations": self.invalidations,
+        }
+
+
+pool_metrics = PoolMetrics()
+
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    """Queue pool that records how long each checkout waited"""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            pool_metrics.timeouts += 1
+            raise
+        finally:
+            pool_metrics.observe_wait(time.perf_counter() - started)
+
+
+async def warm_pool(engine, connections: int = DB_POOL_SIZE) -> int:
+    """Open pooled connections before the first requests need them"""
+    pool = engine.pool
+    # Unpooled engines only get their connectivity checked
+    if isinstance(pool, AsyncAdaptedQueuePool):
+        connections = min(connections, pool.size())
+    else:
+        connections = 1
+    # Held all at once, so each is a separate connection left in the pool
+    async with AsyncExitStack() as stack:
+        opened = await asyncio.gather(
+            *(stack.enter_async_context(engine.connect()) for _ in range(connections))
+        )
+        for connection in opened:
+            await connection.exec_driver_sql("SELECT 1")
+    return connections
+
+
+def engine_options(url: str) -> dict:
+    """Keyword arguments for create_async_engine from the DB_* settings"""
+    if DB_PGBOUNCER and url.startswith("postgresql"):
+        # Transaction pooling hands each transaction a different server
+        # connection, so named prepared statements can't be reused
+        return {
+            "poolclass": NullPool,
+            "connect_args": {
+                "statement_cache_size": 0,
+                "prepared_statement_cache_size": 0,
+                "prepared_statement_name_func": lambda: f"__asyncpg_{uuid4()}__",
+            },
+        }
+    if url.startswith("sqlite"):
+        return {"pool_pre_ping": DB_POOL_PRE_PING}
+
+    return {
+        "poolclass": InstrumentedPool,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
@@ -0,0 +1,411 @@
+"""
+Per request profiling, served to Prometheus at /metrics
+
+ProfilingMiddleware times every HTTP request and splits the time between the
+database, counted from SQLAlchemy's cursor events, rendering the JSON body
+and everything else, which is the handler. The split is kept per route, next
+to a latency histogram and the number of statements each request issued. A
+request that runs one statement N_PLUS_ONE_THRESHOLD times or more is
+counted, and logged, as a likely N+1. The worker's memory and how long it
+took to start are served along with them.
+
+Slow requests can also be sampled. With PROFILE_SLOW_REQUESTS set, or an
+X-Profile: 1 header when PROFILE_ALLOW_HEADER is set, a thread samples the
+event loop's stack every PROFILE_INTERVAL seconds while the request runs.
+Requests slower than PROFILE_THRESHOLD seconds leave their stacks in
+PROFILE_DIR as collapsed stacks, ready for flamegraph.pl or speedscope. The
+event loop serves other requests meanwhile, so their frames show up too.
+"""
+
+import contextvars
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import event
+from starlette.routing import Match
+
+logger = logging.getLogger(__name__)
+
+# Runs of one statement in a request that count as an N+1
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", 5))
+PROFILE_SLOW_REQUESTS = os.getenv("PROFILE_SLOW_REQUESTS", "false").lower() in (
+    "1",
+    "true",
+)
+PROFILE_ALLOW_HEADER = os.getenv("PROFILE_ALLOW_HEADER", "false").lower() in (
+    "1",
+    "true",
+)
+# Seconds between stack samples, and the duration that makes a request slow
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", 0.005))
+PROFILE_THRESHOLD = float(os.getenv("PROFILE_THRESHOLD", 0.5))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "./profiles")
+
+# Upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+# Upper bounds of the statements per request histogram buckets
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 25)
+
+
+class RequestProfile:
+    """Where one request's time went"""
+
+    __slots__ = ("db_seconds", "render_seconds", "statements", "stacks")
+
+    def __init__(self):
+        self.db_seconds = 0.0
+        self.render_seconds = 0.0
+        self.statements: Counter = Counter()
+        # Collapsed stacks, when sampled
+        self.stacks: Optional[Counter] = None
+
+    def repeated(self) -> List[Tuple[str, int]]:
+        """Statements run often enough to look like an N+1"""
+        return [
+            (statement, count)
+            for statement, count in self.statements.items()
+            if count >= N_PLUS_ONE_THRESHOLD
+        ]
+
+
+current_profile: contextvars.ContextVar[Optional[RequestProfile]] = (
+    contextvars.ContextVar("current_profile", default=None)
+)
+
+
+def record_render(seconds: float) -> None:
+    """Count time spent rendering a response body"""
+    profile = current_profile.get()
+    if profile is not None:
+        profile.render_seconds += seconds
+
+
+def instrument(engine) -> None:
+    """Count the statements of an engine, and their time, per request"""
+    target = getattr(engine, "sync_engine", engine)
+
+    @event.listens_for(target, "before_cursor_execute")
+    def before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(target, "after_cursor_execute")
+    def after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_started"].pop()
+        profile = current_profile.get()
+        if profile is not None:
+            profile.db_seconds += time.perf_counter() - started
+            profile.statements[statement] += 1
+
+
+class Histogram:
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def process_uptime() -> Optional[float]:
+    """Seconds since this process started, None without /proc"""
+    try:
+        with open("/proc/self/stat") as stat:
+            # Field 22, counted after the parenthesized command name
+            started = int(stat.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as uptime:
+            now = float(uptime.read().split()[0])
+        # Both count in hundredths of a second
+        return round(now - started / os.sysconf("SC_CLK_TCK"), 2)
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def resident_memory() -> Optional[int]:
+    """Bytes of memory this process holds, None without /proc"""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class RequestMetrics:
+    """Per route counters, rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self.latency: Dict[Tuple[str, str], Histogram] = defaultdict(
+            lambda: Histogram(LATENCY_BUCKETS)
+        )
+        self.statements: Dict[Tuple[str, str], Histogram] = defaultdict(
+            lambda: Histogram(STATEMENT_BUCKETS)
+        )
+        self.responses: Counter = Counter()
+        self.seconds: Counter = Counter()
+        self.n_plus_one: Counter = Counter()
+        # Seconds from the worker process starting to serving, once it does
+        self.startup_seconds: Optional[float] = None
+
+    def observe(
+        self,
+        route: str,
+        method: str,
+        status: int,
+        seconds: float,
+        profile: RequestProfile,
+    ) -> None:
+        key = (route, method)
+        self.latency[key].observe(seconds)
+        self.statements[key].observe(sum(profile.statements.values()))
+        self.responses[(route, method, str(status))] += 1
+        db = profile.db_seconds
+        render = profile.render_seconds
+        self.seconds[(route, method, "db")] += db
+        self.seconds[(route, method, "render")] += render
+        self.seconds[(route, method, "handler")] += max(0.0, seconds - db - render)
+        repeated = profile.repeated()
+        if repeated:
+            self.n_plus_one[key] += 1
+            statement, count = max(repeated, key=lambda item: item[1])
+            logger.warning(
+                "Likely N+1 in %s %s: %d runs of %s", method, route, count, statement
+            )
+
+    def _histogram(
+        self, name: str, histograms: Dict[Tuple[str, str], Histogram]
+    ) -> Iterable[str]:
+        for (route, method), histogram in sorted(histograms.items()):
+            labels = f'route="{escape(route)}",method="{method}"'
+            cumulative = 0
+            for bound, count in zip(histogram.bounds + ("+Inf",), histogram.counts):
+                cumulative += count
+                yield f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+            yield f"{name}_sum{{{labels}}} {histogram.sum}"
+            yield f"{name}_count{{{labels}}} {cumulative}"
+
+    def render(self) -> str:
+        lines = [
+            "# HELP snake_request_duration_seconds Time to serve a request",
+            "# TYPE snake_request_duration_seconds histogram",
+            *self._histogram("snake_request_duration_seconds", self.latency),
+            "# HELP snake_request_statements Database statements run by a request",
+            "# TYPE snake_request_statements histogram",
+            *self._histogram("snake_request_statements", self.statements),
+            "# HELP snake_responses_total Responses sent",
+            "# TYPE snake_responses_total counter",
+        ]
+        for (route, method, status), count in sorted(self.responses.items()):
+            lines.append(
+                f'snake_responses_total{{route="{escape(route)}",method="{method}",'
+                f'status="{status}"}} {count}'
+            )
+        lines += [
+            "# HELP snake_request_seconds_total Request time spent in the"
+            " database, rendering the body and in the handler",
+            "# TYPE snake_request_seconds_total counter",
+        ]
+        for (route, method, part), seconds in sorted(self.seconds.items()):
+            lines.append(
+                f'snake_request_seconds_total{{route="{escape(route)}",'
+                f'method="{method}",part="{part}"}} {seconds}'
+            )
+        lines += [
+            "# HELP snake_n_plus_one_total Requests that repeated one statement"
+            f" {N_PLUS_ONE_THRESHOLD} times or more",
+            "# TYPE snake_n_plus_one_total counter",
+        ]
+        for (route, method), count in sorted(self.n_plus_one.items()):
+            lines.append(
+                f'snake_n_plus_one_total{{route="{escape(route)}",'
+                f'method="{method}"}} {count}'
+            )
+        if self.startup_seconds is not None:
+            lines += [
+                "# HELP snake_worker_startup_seconds Time the worker took to start",
+                "# TYPE snake_worker_startup_seconds gauge",
+                f"snake_worker_startup_seconds {self.startup_seconds}",
+            ]
+        memory = resident_memory()
+        if memory is not None:
+            lines += [
+                "# HELP process_resident_memory_bytes Resident memory of the worker",
+                "# TYPE process_resident_memory_bytes gauge",
+                f"process_resident_memory_bytes {memory}",
+            ]
+        return "\n".join(lines) + "\n"
+
+
+def frame_name(frame) -> str:
+    code = frame.f_code
+    module = frame.f_globals.get("__name__", "?")
+    return f"{module}.{code.co_name}:{frame.f_lineno}"
+
+
+class StackSampler:
+    """Samples one thread's stack into every profile being recorded"""
+
+    def __init__(self, interval: float = PROFILE_INTERVAL):
+        self.interval = interval
+        self._profiles: List[RequestProfile] = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._target: Optional[int] = None
+
+    def begin(self, profile: RequestProfile) -> None:
+        """Start sampling the calling thread into a profile"""
+        profile.stacks = Counter()
+        with self._lock:
+            self._target = threading.get_ident()
+            self._profiles.append(profile)
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="stack-sampler", daemon=True
+                )
+                self._thread.start()
+        self._wake.set()
+
+    def end(self, profile: RequestProfile) -> None:
+        with self._lock:
+            self._profiles.remove(profile)
+
+    def sample(self) -> Optional[str]:
+        frame = sys._current_frames().get(self._target)
+        if frame is None:
+            return None
+        names = []
+        while frame is not None:
+            names.append(frame_name(frame))
+            frame = frame.f_back
+        return ";".join(reversed(names))
+
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                profiles = list(self._profiles)
+            if not profiles:
+                self._wake.clear()
+                self._wake.wait()
+                continue
+            stack = self.sample()
+            if stack is not None:
+                for profile in profiles:
+                    profile.stacks[stack] += 1
+            time.sleep(self.interval)
+
+
+def save_stacks(route: str, seconds: float, stacks: Counter, directory: str) -> str:
+    """Write collapsed stacks, one "frame;frame;frame count" line per stack"""
+    os.makedirs(directory, exist_ok=True)
+    slug = re.sub(r"[^A-Za-z0-9]+", "_", route).strip("_") or "root"
+    path = os.path.join(
+        directory, f"{time.strftime('%Y%m%dT%H%M%S')}-{slug}-{seconds * 1000:.0f}ms"
+    )
+    with open(f"{path}.folded", "w") as output:
+        for stack, count in stacks.most_common():
+            output.write(f"{stack} {count}\n")
+    return f"{path}.folded"
+
+
+def route_label(scope) -> str:
+    """The path template of the route a request is for, or "unmatched" """
+    route = scope.get("route")
+    if route is not None:
+        return route.path
+    # Served without reaching the router, like a cached list or a CORS
+    # preflight, so it's matched here. A route for another method still
+    # names the path.
+    router = getattr(scope.get("app"), "router", None)
+    return matching_path(scope, getattr(router, "routes", ())) or "unmatched"
+
+
+def matching_path(scope, routes) -> Optional[str]:
+    for route in routes:
+        match, _ = route.matches(scope)
+        if match == Match.NONE:
+            continue
+        if getattr(route, "path", None):
+            return route.path
+        # An included router, whose own routes hold the paths
+        included = getattr(route, "original_router", route)
+        path = matching_path(scope, getattr(included, "routes", ()))
+        if path:
+            return path
+    return None
+
+
+class ProfilingMiddleware:
+    """Records where the time of every HTTP request went"""
+
+    def __init__(
+        self,
+        app,
+        metrics: RequestMetrics,
+        sampler: Optional[StackSampler] = None,
+        profile_all: bool = PROFILE_SLOW_REQUESTS,
+        allow_header: bool = PROFILE_ALLOW_HEADER,
+        threshold: float = PROFILE_THRESHOLD,
+        directory: str = PROFILE_DIR,
+    ):
+        self.app = app
+        self.metrics = metrics
+        self.sampler = sampler or StackSampler()
+        self.profile_all = profile_all
+        self.allow_header = allow_header
+        self.threshold = threshold
+        self.directory = directory
+
+    def _sampled(self, scope) -> bool:
+        if self.profile_all:
+            return True
+        return self.allow_header and dict(scope["headers"]).get(b"x-profile") == b"1"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile()
+        token = current_profile.set(profile)
+        sampled = self._sampled(scope)
+        if sampled:
+            self.sampler.begin(profile)
+        status = 500
+
+        async def record_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, record_status)
+        finally:
+            seconds = time.perf_counter() - started
+            current_profile.reset(token)
+            if sampled:
+                self.sampler.end(profile)
+            # Templates, not paths, so ids don't each make a series
+            label = route_label(scope)
+            self.metrics.observe(label, scope["method"], status, seconds, profile)
+            if sampled and seconds >= self.threshold and profile.stacks:
+                path = save_stacks(label, seconds, profile.stacks, self.directory)
+                logger.info("Slow %s %s sampled to %s", scope["method"], label, path)
+
+
+request_metrics = RequestMetrics()
@@ -0,0 +1,177 @@
+"""
+Process-local ranks of every user by their best score
+
+GET /users/{id}/rank and /leaderboard/around/{id} need where a user stands
+among all of them, which in SQL is a COUNT over every better score. Here each
+user's best finished score sits in a bucket of RANK_BUCKET_WIDTH points, and
+a Fenwick tree over the bucket sizes counts the users above any bucket in
+O(log n). A rank is that count plus the user's place in their own bucket,
+which is kept sorted like the leaderboard: best score first, then lowest user
+id. Scores past the last of RANK_BUCKETS buckets share it, still in order.
+
+The index is filled at startup by streaming each user's best score out of the
+games table and kept current as games finish.
+"""
+
+import bisect
+import os
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+# Points of score per bucket, snake scores move in steps of 10
+RANK_BUCKET_WIDTH = int(os.getenv("RANK_BUCKET_WIDTH", 10))
+# Buckets the Fenwick tree may grow to
+RANK_BUCKETS = int(os.getenv("RANK_BUCKETS", 1 << 20))
+# Users read per chunk when the ranks are loaded at startup
+RANK_LOAD_CHUNK = int(os.getenv("RANK_LOAD_CHUNK", 10000))
+
+
+class RankIndex:
+    """Order statistics over the best score of every user"""
+
+    def __init__(self, width: int = RANK_BUCKET_WIDTH, buckets: int = RANK_BUCKETS):
+        self.width = width
+        self.buckets = buckets
+        self._best: Dict[int, int] = {}
+        # User ids of each non-empty bucket, sorted by (-score, user_id) unless
+        # they were loaded in bulk and not looked at since
+        self._members: Dict[int, List[int]] = {}
+        self._unsorted: Set[int] = set()
+        # 1-based Fenwick tree of bucket sizes, grown as higher scores arrive
+        self._tree: List[int] = [0] * 2
+
+    def __len__(self) -> int:
+        return len(self._best)
+
+    def _bucket(self, score: int) -> int:
+        return min(max(score // self.width, 0), self.buckets - 1)
+
+    def _key(self, user_id: int) -> Tuple[int, int]:
+        return -self._best[user_id], user_id
+
+    def _grow(self, bucket: int) -> bool:
+        """Make room for a bucket, returns True if the tree was rebuilt"""
+        size = len(self._tree) - 1
+        if bucket < size:
+            return False
+        while size <= bucket:
+            size *= 2
+        # Built from the bucket sizes in linear time
+        tree = [0] * (size + 1)
+        for index, users in self._members.items():
+            tree[index + 1] += len(users)
+        for i in range(1, size + 1):
+            parent = i + (i & -i)
+            if parent <= size:
+                tree[parent] += tree[i]
+        self._tree = tree
+        return True
+
+    def _add(self, bucket: int, delta: int) -> None:
+        i = bucket + 1
+        while i < len(self._tree):
+            self._tree[i] += delta
+            i += i & -i
+
+    def _below(self, bucket: int) -> int:
+        """Users in the buckets under this one"""
+        total = 0
+        i = min(bucket, len(self._tree) - 1)
+        while i:
+            total += self._tree[i]
+            i -= i & -i
+        return total
+
+    def _sorted(self, bucket: int) -> List[int]:
+        users = self._members[bucket]
+        if bucket in self._unsorted:
+            users.sort(key=self._key)
+            self._unsorted.discard(bucket)
+        return users
+
+    def _remove(self, user_id: int) -> None:
+        bucket = self._bucket(self._best[user_id])
+        users = self._sorted(bucket)
+        del users[bisect.bisect_left(users, self._key(user_id), key=self._key)]
+        if not users:
+            del self._members[bucket]
+        self._add(bucket, -1)
+        del self._best[user_id]
+
+    def submit(self, user_id: int, score: int) -> bool:
+        """Record a finished score, returns True if it's the user's best"""
+        current = self._best.get(user_id)
+        if current is not None:
+            if score <= current:
+                return False
+            self._remove(user_id)
+        self._best[user_id] = score
+        bucket = self._bucket(score)
+        self._grow(bucket)
+        if bucket in self._members:
+            bisect.insort(self._sorted(bucket), user_id, key=self._key)
+        else:
+            self._members[bucket] = [user_id]
+        self._add(bucket, 1)
+        return True
+
+    def extend(self, rows: Iterable[Tuple[int, int]]) -> None:
+        """Add (user_id, best score) rows in bulk, sorting buckets when used"""
+        added: Counter = Counter()
+        known = []
+        for user_id, score in rows:
+            if user_id in self._best:
+                known.append((user_id, score))
+                continue
+            self._best[user_id] = score
+            bucket = self._bucket(score)
+            self._members.setdefault(bucket, []).append(user_id)
+            self._unsorted.add(bucket)
+            added[bucket] += 1
+        # A grown tree is built from the buckets, which hold the new users
+        if added and not self._grow(max(added)):
+            for bucket, count in added.items():
+                self._add(bucket, count)
+        for user_id, score in known:
+            self.submit(user_id, score)
+
+    def rank(self, user_id: int) -> Optional[Tuple[int, int]]:
+        """(rank, best score) of a user, None without a finished game"""
+        score = self._best.get(user_id)
+        if score is None:
+            return None
+        bucket = self._bucket(score)
+        above = len(self._best) - self._below(bucket + 1)
+        place = bisect.bisect_left(
+            self._sorted(bucket), (-score, user_id), key=self._key
+        )
+        return above + place + 1, score
+
+    def _locate(self, rank: int) -> Tuple[int, int]:
+        """(bucket, index in it) of the user at a rank"""
+        # Descend the tree to the bucket holding the k-th lowest score
+        k = len(self._best) - rank + 1
+        bucket = 0
+        step = 1 << (len(self._tree) - 1).bit_length()
+        while step:
+            if bucket + step < len(self._tree) and self._tree[bucket + step] < k:
+                bucket += step
+                k -= self._tree[bucket]
+            step >>= 1
+        return bucket, len(self._members[bucket]) - k
+
+    def around(self, user_id: int, count: int) -> List[Tuple[int, int, int]]:
+        """(rank, user_id, score) of a user and of count users on either side"""
+        found = self.rank(user_id)
+        if found is None:
+            return []
+        first = max(1, found[0] - count)
+        last = min(len(self._best), found[0] + count)
+        rows = []
+        rank = first
+        while rank <= last:
+            bucket, index = self._locate(rank)
+            for other in self._sorted(bucket)[index : index + last - rank + 1]:
+                rows.append((rank, other, self._best[other]))
+                rank += 1
+        return rows
@@ -0,0 +1,234 @@
+"""
+Reaper of games whose browser went away
+
+A game only finishes when its browser says so, so one closed mid-game used to
+stay playing forever and every poll of /players paid for it. Score updates,
+simulated game moves and POST /games/{id}/heartbeat now mark the game as seen
+in the shared state, without touching the database. Every REAPER_INTERVAL
+seconds a background task moves the playing games not seen for
+GAME_IDLE_TIMEOUT seconds to idle, and the idle ones not seen for
+GAME_FINISH_TIMEOUT seconds to finished, with one UPDATE per batch of
+REAPER_BATCH_SIZE games. Watchers get the usual left events, finished games
+are ranked like any other, and an idle game that is seen again is playing
+again. What was reaped is served by /internal/metrics/reaper.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import case, select, update
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from engine import arena
+from models import Game, User
+from rollups import apply, fold
+from spectate import spectators
+from stats import first_finish, record_games
+from state import state
+
+logger = logging.getLogger(__name__)
+
+# Seconds without a sign of life before a playing game goes idle
+GAME_IDLE_TIMEOUT = float(os.getenv("GAME_IDLE_TIMEOUT", 60))
+# Seconds without a sign of life before an idle game is finished
+GAME_FINISH_TIMEOUT = float(os.getenv("GAME_FINISH_TIMEOUT", 600))
+# Seconds between reaper passes
+REAPER_INTERVAL = float(os.getenv("REAPER_INTERVAL", 15))
+# Games moved by one UPDATE
+REAPER_BATCH_SIZE = int(os.getenv("REAPER_BATCH_SIZE", 500))
+
+
+def player_row(game: Game, username: str) -> dict:
+    return {
+        "id": game.user_id,
+        "game_id": game.id,
+        "username": username,
+        "score": game.score,
+        "status": game.status,
+        "game_mode": game.game_mode,
+    }
+
+
+async def set_status(
+    db: AsyncSession,
+    game_ids: List[int],
+    status: str,
+    current: Iterable[str],
+    scores: Optional[Dict[int, int]] = None,
+    finished_at: Optional[Dict[int, datetime]] = None,
+) -> List[Tuple[Game, str]]:
+    """Move the games still in a current status, returns them with their owners"""
+    owner = select(User.username).where(User.id == Game.user_id).scalar_subquery()
+    values = {"status": status}
+    if scores:
+        values["score"] = case(scores, value=Game.id, else_=Game.score)
+    if status == "finished":
+        if finished_at is None:
+            now = datetime.utcnow()
+            finished_at = {game_id: now for game_id in game_ids}
+        values["finished_at"] = first_finish(case(finished_at, value=Game.id))
+    result = await db.execute(
+        update(Game)
+        .where(Game.id.in_(game_ids), Game.status.in_(list(current)))
+        .values(**values)
+        .returning(Game, owner)
+        .execution_options(synchronize_session=False)
+    )
+    rows = [tuple(row) for row in result]
+    if status == "finished":
+        # The filtered leaderboards and the users' stats change in the same
+        # transaction
+        await apply(
+            db,
+            fold(
+                (game.id, game.user_id, game.game_mode, game.score, game.created_at)
+                for game, _ in rows
+            ),
+        )
+        await record_games(db, [game for game, _ in rows], finished_at)
+    await db.commit()
+    return rows
+
+
+async def live_games(db: AsyncSession) -> List[Tuple[int, str]]:
+    """(game_id, status) of the games still playing or idle"""
+    result = await db.execute(
+        select(Game.id, Game.status).where(Game.status.in_(["playing", "idle"]))
+    )
+    return [tuple(row) for row in result]
+
+
+class GameReaper:
+    """Idles and then finishes the games that stopped being seen"""
+
+    def __init__(
+        self,
+        idle_timeout: float = GAME_IDLE_TIMEOUT,
+        finish_timeout: float = GAME_FINISH_TIMEOUT,
+        interval: float = REAPER_INTERVAL,
+        batch_size: int = REAPER_BATCH_SIZE,
+        clock=time.time,
+    ):
+        self.idle_timeout = idle_timeout
+        self.finish_timeout = finish_timeout
+        self.interval = interval
+        self.batch_size = batch_size
+        self.clock = clock
+        self._task: Optional[asyncio.Task] = None
+        self.passes = 0
+        self.failures = 0
+        self.idled = 0
+        self.finished = 0
+        self.revived = 0
+        self.last_pass_seconds = 0.0
+        self.last_pass_games = 0
+
+    async def touch(self, db: AsyncSession, game_ids: List[int]) -> List[bool]:
+        """Mark games as seen, returns which of them are live"""
+        found = await state.touch(game_ids, self.clock())
+        idle = [game_id for game_id, status in zip(game_ids, found) if status == "idle"]
+        if idle:
+            # Also when it's playing already, to bring the state back in line
+            revived = await set_status(db, idle, "playing", ["idle", "playing"])
+            self.revived += len(revived)
+            for game, username in revived:
+                await state.player_joined(player_row(game, username))
+        return [status is not None for status in found]
+
+    async def _batch(self, db: AsyncSession, status: str, before: float) -> int:
+        """Move one batch of games not seen since before, returns its size"""
+        stale = await state.stale_games(status, before, self.batch_size)
+        if not stale:
+            return 0
+        game_ids = [game_id for game_id, _ in stale]
+
+        if status == "playing":
+            moved = await set_status(db, game_ids, "idle", ["playing"])
+            await state.players_left({game.id: "idle" for game, _ in moved})
+            self.idled += len(moved)
+        else:
+            # Simulated games end with the score the server counted
+            scores = {}
+            for game_id in game_ids:
+                simulation = arena.remove(game_id)
+                if simulation is not None:
+                    simulation.over = True
+                    spectators.publish_game(game_id, simulation)
+                    scores[game_id] = simulation.score
+            # Their play time ends when they were last seen
+            finished_at = {
+                game_id: datetime.utcfromtimestamp(seen) for game_id, seen in stale
+            }
+            moved = await set_status(
+                db, game_ids, "finished", ["playing", "idle"], scores, finished_at
+            )
+            await state.players_left({game.id: "finished" for game, _ in moved})
+            for game, username in moved:
+                await state.submit_score(game.user_id, username, game.score)
+            self.finished += len(moved)
+
+        # Games that already moved on elsewhere just stop being watched
+        await state.untrack(set(game_ids) - {game.id for game, _ in moved})
+        return len(stale)
+
+    async def reap(self, db: AsyncSession, now: Optional[float] = None) -> int:
+        """One pass over every stale game, returns how many were looked at"""
+        now = self.clock() if now is None else now
+        started = time.perf_counter()
+        games = 0
+        for status, timeout in (
+            ("idle", self.finish_timeout),
+            ("playing", self.idle_timeout),
+        ):
+            while True:
+                count = await self._batch(db, status, now - timeout)
+                games += count
+                if count < self.batch_size:
+                    break
+        self.passes += 1
+        self.last_pass_seconds = time.perf_counter() - started
+        self.last_pass_games = games
+        return games
+
+    async def _run(self, session_factory: async_sessionmaker) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                async with session_factory() as db:
+                    await self.reap(db)
+            except Exception:
+                self.failures += 1
+                logger.exception("Reaping stale games failed, will retry")
+
+    def start(self, session_factory: async_sessionmaker) -> None:
+        self._task = asyncio.create_task(self._run(session_factory))
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def snapshot(self) -> dict:
+        """Counters of what was reaped, as served to operators"""
+        return {
+            "idle_timeout": self.idle_timeout,
+            "finish_timeout": self.finish_timeout,
+            "passes": self.passes,
+            "failures": self.failures,
+            "idled": self.idled,
+            "finished": self.finished,
+            "revived": self.revived,
+            "last_pass_seconds": self.last_pass_seconds,
+            "last_pass_games": self.last_pass_games,
+        }
+
+
+game_reaper = GameReaper()
@@ -0,0 +1,117 @@
+"""
+Score verification by replaying a game's inputs
+
+A client finishing a game may send the seed its food was placed with, the
+number of ticks it ran for and every direction change it made. The game is
+replayed headlessly on the server's engine and the score only reaches the
+leaderboard if the replay ends on the same score. Replays run in a process
+pool so a long game never holds up request handling.
+
+Direction changes are encoded as one unsigned LEB128 varint each, holding
+(ticks since the previous change << 2 | direction), and sent as base64. A
+ten minute game with a turn every second fits in well under a kilobyte.
+"""
+
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, List, Optional, Tuple
+
+from engine import SnakeGame
+
+# Processes replaying games, 0 replays inline on the event loop
+REPLAY_WORKERS = int(os.getenv("REPLAY_WORKERS", 1))
+# Longest game accepted for replay, over an hour even at the fastest speed
+MAX_REPLAY_TICKS = int(os.getenv("MAX_REPLAY_TICKS", 100_000))
+
+
+class ReplayError(ValueError):
+    """An input log that can't be decoded or doesn't fit the game"""
+
+
+def encode_inputs(inputs: Iterable[Tuple[int, int]]) -> bytes:
+    """Encode (tick, direction) pairs, ticks must not decrease"""
+    data = bytearray()
+    previous = 0
+    for tick, direction in inputs:
+        value = (tick - previous) << 2 | direction
+        previous = tick
+        while value > 0x7F:
+            data.append(value & 0x7F | 0x80)
+            value >>= 7
+        data.append(value)
+    return bytes(data)
+
+
+def decode_inputs(
+    data: bytes, max_tick: int = MAX_REPLAY_TICKS
+) -> List[Tuple[int, int]]:
+    """Decode (tick, direction) pairs, rejecting any past max_tick"""
+    inputs = []
+    tick = 0
+    value = shift = 0
+    for byte in data:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+            if shift > 35:
+                raise ReplayError("Input varint too long")
+            continue
+        tick += value >> 2
+        if tick > max_tick:
+            raise ReplayError("Input past the end of the game")
+        inputs.append((tick, value & 3))
+        value = shift = 0
+    if shift:
+        raise ReplayError("Truncated input log")
+    return inputs
+
+
+def replay_score(
+    mode: str, seed: int, ticks: int, inputs: List[Tuple[int, int]]
+) -> int:
+    """Play a game back and return the score it ends with"""
+    game = SnakeGame(mode, seed)
+    step = game.step
+    for tick, direction in inputs:
+        # Inputs for tick t were made after t moves, before the next one
+        while game.tick < tick and step():
+            pass
+        if game.over:
+            break
+        game.turn(direction)
+    while game.tick < ticks and step():
+        pass
+    return game.score
+
+
+class ReplayVerifier:
+    """Runs replays in a process pool created on first use"""
+
+    def __init__(self, workers: int = REPLAY_WORKERS):
+        self.workers = workers
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    async def score(
+        self, mode: str, seed: int, ticks: int, inputs: List[Tuple[int, int]]
+    ) -> int:
+        if self.workers <= 0:
+            return replay_score(mode, seed, ticks, inputs)
+        if self._pool is None:
+            # Forking a process that runs an event loop and threads isn't safe
+            self._pool = ProcessPoolExecutor(
+                self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._pool, replay_score, mode, seed, ticks, inputs
+        )
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+
+
+replay_verifier = ReplayVerifier()
@@ -0,0 +1,274 @@
+"""
+Best score rollups behind the filtered leaderboards
+
+A finished game offers its score to six score_rollups rows: its own game mode
+and any mode ("*"), each for the day and ISO week it was played in and for
+all time. A row only ever moves to a better (score, game id), so applying a
+game twice, or in any order, gives the same rows. A leaderboard for one mode
+and period is then a range of one index, one row per user.
+
+Rows of past days and weeks are no longer served and are pruned by the
+compaction job the app runs every ROLLUP_COMPACT_INTERVAL seconds. Migration
+0007 fills the all-time rows from the games finished before there were
+rollups. All the rows can be rebuilt from the games, live and archived, at any
+time, while they are being served, and the shared leaderboard and ranks
+reloaded from them:
+
+    uv run python rollups.py backfill
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+from datetime import date, datetime, timedelta
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import delete, or_, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from archive import finished_games
+from leaderboard import LEADERBOARD_SIZE
+from models import (
+    Game,
+    ScoreRollup,
+    SessionLocal,
+    User,
+    dialect_insert,
+    get_engine,
+)
+from paging import window_start
+from ranks import RANK_LOAD_CHUNK
+from state import state
+
+logger = logging.getLogger(__name__)
+
+# Days and weeks of rollups kept before compaction drops them
+ROLLUP_KEEP_DAYS = int(os.getenv("ROLLUP_KEEP_DAYS", 7))
+ROLLUP_KEEP_WEEKS = int(os.getenv("ROLLUP_KEEP_WEEKS", 4))
+# Seconds between compactions
+ROLLUP_COMPACT_INTERVAL = float(os.getenv("ROLLUP_COMPACT_INTERVAL", 3600))
+# Finished games read per chunk by the backfill
+ROLLUP_BACKFILL_CHUNK = int(os.getenv("ROLLUP_BACKFILL_CHUNK", 5000))
+
+ANY_MODE = "*"
+# period_start of the all-time rows
+ALL_TIME = date(1970, 1, 1)
+# Leaderboard window -> rollup period
+PERIODS = {"today": "day", "week": "week", "all": "all"}
+
+RollupKey = Tuple[str, date, str, int]
+
+
+def periods_of(played_at: Optional[datetime]) -> List[Tuple[str, date]]:
+    # Games from before created_at was recorded only count towards all time
+    if played_at is None:
+        return [("all", ALL_TIME)]
+    day = played_at.date()
+    return [
+        ("day", day),
+        ("week", day - timedelta(days=day.weekday())),
+        ("all", ALL_TIME),
+    ]
+
+
+def rollup_keys(
+    user_id: int, game_mode: str, played_at: Optional[datetime]
+) -> List[RollupKey]:
+    return [
+        (period, start, mode, user_id)
+        for period, start in periods_of(played_at)
+        for mode in (game_mode, ANY_MODE)
+    ]
+
+
+def _upsert(db: AsyncSession):
+    statement = dialect_insert(db)(ScoreRollup)
+    new = (statement.excluded.best_score, statement.excluded.best_game_id)
+    return statement.on_conflict_do_update(
+        index_elements=[
+            ScoreRollup.period,
+            ScoreRollup.period_start,
+            ScoreRollup.game_mode,
+            ScoreRollup.user_id,
+        ],
+        set_={"best_score": new[0], "best_game_id": new[1]},
+        where=tuple_(*new) > tuple_(ScoreRollup.best_score, ScoreRollup.best_game_id),
+    )
+
+
+async def apply(db: AsyncSession, best: Dict[RollupKey, Tuple[int, int]]) -> None:
+    """Offer (score, game_id) per rollup key, keeping the better of the two"""
+    if not best:
+        return
+    rows = [
+        {
+            "period": period,
+            "period_start": start,
+            "game_mode": mode,
+            "user_id": user_id,
+            "best_score": score,
+            "best_game_id": game_id,
+        }
+        for (period, start, mode, user_id), (score, game_id) in best.items()
+    ]
+    await db.execute(_upsert(db), rows)
+
+
+async def record_game(db: AsyncSession, game: Game) -> None:
+    """Roll up a finished game, in the caller's transaction"""
+    keys = rollup_keys(game.user_id, game.game_mode, game.created_at)
+    await apply(db, {key: (game.score, game.id) for key in keys})
+
+
+def fold(rows: Iterable[Tuple]) -> Dict[RollupKey, Tuple[int, int]]:
+    """Best (score, game_id) per key of (id, user_id, mode, score, created_at) rows"""
+    best: Dict[RollupKey, Tuple[int, int]] = {}
+    for game_id, user_id, game_mode, score, created_at in rows:
+        for key in rollup_keys(user_id, game_mode, created_at):
+            if key not in best or (score, game_id) > best[key]:
+                best[key] = (score, game_id)
+    return best
+
+
+async def leaderboard_page(
+    db: AsyncSession,
+    limit: int,
+    game_mode: Optional[str] = None,
+    window: str = "all",
+    after: Optional[Tuple[int, int]] = None,
+    now: Optional[datetime] = None,
+) -> List[Tuple[int, str, int, int]]:
+    """(user_id, username, score, game_id) past the (score, game_id) of after"""
+    period = PERIODS[window]
+    start = window_start(window, now)
+    page_query = (
+        select(User.id, User.username, ScoreRollup.best_score, ScoreRollup.best_game_id)
+        .join(User, User.id == ScoreRollup.user_id)
+        .where(
+            ScoreRollup.period == period,
+            ScoreRollup.period_start == (start.date() if start else ALL_TIME),
+            ScoreRollup.game_mode == (game_mode or ANY_MODE),
+        )
+        .order_by(ScoreRollup.best_score.desc(), ScoreRollup.best_game_id.desc())
+        .limit(limit)
+    )
+    if after is not None:
+        page_query = page_query.where(
+            tuple_(ScoreRollup.best_score, ScoreRollup.best_game_id) < after
+        )
+    return [tuple(row) for row in await db.execute(page_query)]
+
+
+async def stream_best_scores(
+    db: AsyncSession, chunk: int = RANK_LOAD_CHUNK
+) -> AsyncIterator[List[Tuple[int, int]]]:
+    """(user_id, best score) of every user with a finished game, in chunks"""
+    result = await db.stream(
+        select(ScoreRollup.user_id, ScoreRollup.best_score)
+        .where(
+            ScoreRollup.period == "all",
+            ScoreRollup.period_start == ALL_TIME,
+            ScoreRollup.game_mode == ANY_MODE,
+        )
+        .execution_options(yield_per=chunk)
+    )
+    async for rows in result.partitions():
+        yield [tuple(row) for row in rows]
+
+
+async def load_best_scores(db: AsyncSession) -> None:
+    """Offer the all-time rollups to the shared leaderboard and ranks"""
+    rows = await leaderboard_page(db, LEADERBOARD_SIZE)
+    await state.load_leaderboard([row[:3] for row in rows])
+    # Every user's best score, without holding them all at once
+    async for rows in stream_best_scores(db):
+        await state.load_ranks(rows)
+
+
+async def compact(db: AsyncSession, now: Optional[datetime] = None) -> int:
+    """Drop the rows of days and weeks past retention, returns how many"""
+    today = (now or datetime.utcnow()).date()
+    this_week = today - timedelta(days=today.weekday())
+    result = await db.execute(
+        delete(ScoreRollup).where(
+            or_(
+                (ScoreRollup.period == "day")
+                & (
+                    ScoreRollup.period_start <= today - timedelta(days=ROLLUP_KEEP_DAYS)
+                ),
+                (ScoreRollup.period == "week")
+                & (
+                    ScoreRollup.period_start
+                    <= this_week - timedelta(weeks=ROLLUP_KEEP_WEEKS)
+                ),
+            )
+        )
+    )
+    await db.commit()
+    if result.rowcount:
+        # Cached leaderboards are built again, like after any other change
+        await state.changed("leaderboard")
+    return result.rowcount
+
+
+async def backfill(session_factory, chunk: int = ROLLUP_BACKFILL_CHUNK) -> int:
+    """Offer every finished game to the rollups again, returns the games read"""
+    async with session_factory() as db:
+        # Rows only ever move up, so the rows are kept and served throughout
+        # rather than emptied first, and games finishing meanwhile can be
+        # rolled up by their requests at the same time
+        games = finished_games("id", "user_id", "game_mode", "score", "created_at")
+        count = 0
+        last_id = 0
+        while True:
+            rows = (
+                await db.execute(
+                    select(games)
+                    .where(games.c.id > last_id)
+                    .order_by(games.c.id)
+                    .limit(chunk)
+                )
+            ).all()
+            if not rows:
+                # The shared state is only seeded once, when it starts out
+                # empty, and both only ever move a user up too
+                await load_best_scores(db)
+                await state.changed("leaderboard")
+                return count
+            await apply(db, fold(rows))
+            await db.commit()
+            count += len(rows)
+            last_id = rows[-1].id
+
+
+async def run_compaction(session_factory) -> None:
+    """Compact the rollups every ROLLUP_COMPACT_INTERVAL seconds"""
+    while True:
+        await asyncio.sleep(ROLLUP_COMPACT_INTERVAL)
+        try:
+            async with session_factory() as db:
+                await compact(db)
+        except Exception:
+            logger.exception("Compacting score rollups failed, will retry")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the score rollups")
+    parser.add_argument("command", choices=["backfill", "compact"])
+    args = parser.parse_args()
+
+    async def run():
+        if args.command == "backfill":
+            print(f"Rolled up {await backfill(SessionLocal)} finished games")
+        else:
+            async with SessionLocal() as db:
+                print(f"Dropped {await compact(db)} expired rollups")
+        await get_engine().dispose()
+        await state.stop()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
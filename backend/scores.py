@@ -0,0 +1,134 @@
+"""
+Write-behind buffer for score updates
+
+POST /games/scores:batch only records the latest score of each live game in
+memory. A background task flushes the buffer every SCORE_FLUSH_INTERVAL
+seconds as a single bulk UPDATE, so a game posting a score on every food
+eaten costs one row in one statement per flush instead of a transaction per
+request. The UPDATE skips games that finished meanwhile, which keep the
+score they finished with. Anything still buffered is flushed on shutdown.
+"""
+
+import asyncio
+import logging
+import os
+from typing import Dict, Optional
+
+from sqlalchemy import Integer, bindparam, column, update, values
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from models import Game
+
+logger = logging.getLogger(__name__)
+
+# Seconds between flushes of the buffered scores
+SCORE_FLUSH_INTERVAL = float(os.getenv("SCORE_FLUSH_INTERVAL", 1.0))
+# How repeated updates to one game are coalesced: "max" or "last"
+SCORE_BUFFER_POLICY = os.getenv("SCORE_BUFFER_POLICY", "max")
+
+
+async def write_scores(db: AsyncSession, scores: Dict[int, int]) -> None:
+    """Write many game scores in one statement, to the games still playing"""
+    if db.bind.dialect.name == "postgresql":
+        # UPDATE games SET score = new_scores.score
+        # FROM (VALUES ...) AS new_scores (id, score) WHERE games.id = new_scores.id
+        new_scores = values(
+            column("id", Integer), column("score", Integer), name="new_scores"
+        ).data(list(scores.items()))
+        await db.execute(
+            update(Game)
+            .where(Game.id == new_scores.c.id, Game.status == "playing")
+            .values(score=new_scores.c.score)
+        )
+    else:
+        # SQLite can't alias the columns of a VALUES list, use executemany
+        games = Game.__table__
+        await db.execute(
+            update(games)
+            .where(games.c.id == bindparam("game_id"), games.c.status == "playing")
+            .values(score=bindparam("new_score")),
+            [
+                {"game_id": game_id, "new_score": score}
+                for game_id, score in scores.items()
+            ],
+        )
+    await db.commit()
+
+
+class ScoreBuffer:
+    """Coalesces score updates per game until the next flush"""
+
+    def __init__(
+        self,
+        interval: float = SCORE_FLUSH_INTERVAL,
+        policy: str = SCORE_BUFFER_POLICY,
+    ):
+        if policy not in ("max", "last"):
+            raise ValueError(f"Unknown score buffer policy: {policy}")
+        self.interval = interval
+        self.policy = policy
+        self._pending: Dict[int, int] = {}
+        self._flushing: Dict[int, int] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def add(self, game_id: int, score: int) -> int:
+        """Buffer a score, returns the score that will be written"""
+        current = self._pending.get(game_id)
+        if current is None or self.policy == "last" or score > current:
+            self._pending[game_id] = score
+        return self._pending[game_id]
+
+    def take(self, game_id: int) -> Optional[int]:
+        """Remove and return the buffered score of one game"""
+        score = self._pending.pop(game_id, None)
+        if score is None:
+            # A flush that is still being written may hold the latest score
+            score = self._flushing.get(game_id)
+        return score
+
+    async def flush(self, db: AsyncSession) -> int:
+        """Write everything buffered so far, returns the number of games"""
+        pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        self._flushing = pending
+        try:
+            await write_scores(db, pending)
+        except Exception:
+            # Put the scores back unless newer ones arrived meanwhile
+            for game_id, score in pending.items():
+                self._pending.setdefault(game_id, score)
+            raise
+        finally:
+            self._flushing = {}
+        return len(pending)
+
+    async def _run(self, session_factory: async_sessionmaker) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                async with session_factory() as db:
+                    await self.flush(db)
+            except Exception:
+                logger.exception("Flushing buffered scores failed, will retry")
+
+    def start(self, session_factory: async_sessionmaker) -> None:
+        self._task = asyncio.create_task(self._run(session_factory))
+
+    async def stop(self, session_factory: async_sessionmaker) -> None:
+        """Stop the flush task and write whatever is still buffered"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        async with session_factory() as db:
+            await self.flush(db)
+
+
+score_buffer = ScoreBuffer()
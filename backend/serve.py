@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Production entry point
+
+    uv run python serve.py
+
+Runs the app under uvicorn with WEB_CONCURRENCY workers. By default that's
+a single one, as the memory state backend only knows what its own process
+served; with STATE_BACKEND=redis it's one per CPU of the container's quota,
+the Fargate task's 256 CPU units being a quarter of a CPU and so still a
+single worker. More than one worker without Redis is refused.
+
+Spectator channels and simulated games live in the process that started
+them whatever the backend, so with more than one worker a spectator only
+gets frames published to its own worker, and only the worker running a
+simulated game takes its moves and guards its score. Deployments that use
+them run one worker per task and scale out by tasks behind a load balancer
+with sticky sessions. uvloop and httptools are used when
+they are installed. The app is imported before any worker starts, so a
+broken configuration fails the launch, and a single worker serves that very
+app instead of importing it again. Every worker opens its pooled connections
+before it accepts requests and logs how long it took to start and the memory
+it holds.
+
+On SIGTERM the workers stop accepting connections, give the requests in
+flight up to SHUTDOWN_TIMEOUT seconds and then shut the app down, which
+writes the buffered scores. ECS kills a container 30 seconds after SIGTERM.
+"""
+
+import importlib.util
+import logging
+import math
+import os
+import time
+from typing import Optional
+
+import uvicorn
+
+logger = logging.getLogger("serve")
+
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", 8000))
+# Seconds in flight requests get to finish on shutdown
+SHUTDOWN_TIMEOUT = float(os.getenv("SHUTDOWN_TIMEOUT", 25))
+CGROUP_ROOT = "/sys/fs/cgroup"
+
+
+def cpu_quota(root: str = CGROUP_ROOT) -> Optional[float]:
+    """CPUs the container's cgroup may use, None when it isn't limited"""
+    try:
+        # cgroup v2: "<quota> <period>", or "max <period>"
+        with open(os.path.join(root, "cpu.max")) as cpu_max:
+            quota, period = cpu_max.read().split()
+        return None if quota == "max" else int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    try:
+        # cgroup v1, where a quota of -1 means unlimited
+        with open(os.path.join(root, "cpu", "cpu.cfs_quota_us")) as quota_file:
+            quota = int(quota_file.read())
+        with open(os.path.join(root, "cpu", "cpu.cfs_period_us")) as period_file:
+            period = int(period_file.read())
+        return None if quota <= 0 else quota / period
+    except (OSError, ValueError):
+        return None
+
+
+def shared_state() -> bool:
+    """Whether the workers share their state, which lets there be several"""
+    return os.getenv("STATE_BACKEND", "memory") == "redis"
+
+
+def worker_count(root: str = CGROUP_ROOT) -> int:
+    """WEB_CONCURRENCY, else one per whole CPU of the quota if state is shared"""
+    if os.getenv("WEB_CONCURRENCY"):
+        return max(1, int(os.environ["WEB_CONCURRENCY"]))
+    if not shared_state():
+        return 1
+    quota = cpu_quota(root)
+    if quota is None:
+        return os.cpu_count() or 1
+    return max(1, math.floor(quota))
+
+
+def installed(module: str) -> bool:
+    return importlib.util.find_spec(module) is not None
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+    workers = worker_count()
+    if workers > 1:
+        if not shared_state():
+            raise SystemExit(
+                f"{workers} workers need STATE_BACKEND=redis, each would serve "
+                "a leaderboard and players list of its own"
+            )
+        logger.warning(
+            "Spectators and simulated games are only served by the worker "
+            "that started them, run one worker per task if they're used"
+        )
+    loop = "uvloop" if installed("uvloop") else "asyncio"
+    http = "httptools" if installed("httptools") else "h11"
+
+    started = time.perf_counter()
+    from main import app
+
+    logger.info(
+        "Imported the app in %.2fs, starting %d worker(s) on %s:%d with %s and %s",
+        time.perf_counter() - started,
+        workers,
+        HOST,
+        PORT,
+        loop,
+        http,
+    )
+    options = {
+        "host": HOST,
+        "port": PORT,
+        "loop": loop,
+        "http": http,
+        "timeout_graceful_shutdown": SHUTDOWN_TIMEOUT,
+        # Behind the load balancer
+        "proxy_headers": True,
+        "forwarded_allow_ips": "*",
+    }
+    if workers == 1:
+        uvicorn.run(app, **options)
+    else:
+        # Workers are spawned and import the app themselves
+        uvicorn.run("main:app", workers=workers, **options)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+"""
+Binary frame streams for spectating games
+
+A game's board is published as a stream of small binary frames and every
+spectator of that game is sent the very same bytes: a frame is encoded once
+by its publisher, which is either the playing browser or the server's
+engine, and fanned out unchanged. Most frames are deltas, the new head cell,
+whether the tail cell was dropped and where the food moved to. Every
+KEYFRAME_INTERVAL ticks a keyframe carries the whole snake, so a new or
+lagging spectator can start from there.
+
+All integers are little-endian, cells are numbered y * size + x:
+
+    keyframe  B type=0, I tick, I score, B size, H food, H length, H cells[length]
+              with the cells from head to tail
+    delta     B type=1, I tick, I score, B flags, H head, [H food]
+              flags: 1 the tail cell was removed, 2 the food moved (food follows)
+    end       B type=2, I tick, I score
+
+A food of 0xFFFF means there is none.
+"""
+
+import asyncio
+import os
+import struct
+from collections import deque
+from typing import Deque, Dict, List, Optional, Set
+
+from engine import SnakeGame
+
+# Ticks between keyframes of games simulated on the server
+KEYFRAME_INTERVAL = int(os.getenv("KEYFRAME_INTERVAL", 50))
+# Frames queued for one spectator before it's skipped to the next keyframe
+SPECTATOR_BUFFER = int(os.getenv("SPECTATOR_BUFFER", 128))
+
+KEYFRAME, DELTA, END = range(3)
+TAIL_REMOVED = 1
+FOOD_MOVED = 2
+NO_FOOD = 0xFFFF
+
+KEYFRAME_HEADER = struct.Struct("<BIIBHH")
+DELTA_HEADER = struct.Struct("<BIIBH")
+END_FRAME = struct.Struct("<BII")
+CELL = struct.Struct("<H")
+
+
+def encode_keyframe(game: SnakeGame) -> bytes:
+    food = NO_FOOD if game.food is None else game.food
+    cells = [
+        game.body[(game.head - index) % game.cells] for index in range(game.length)
+    ]
+    header = KEYFRAME_HEADER.pack(
+        KEYFRAME, game.tick, game.score, game.size, food, game.length
+    )
+    return header + struct.pack(f"<{game.length}H", *cells)
+
+
+def encode_delta(
+    tick: int, score: int, head: int, tail_removed: bool, food: Optional[int]
+) -> bytes:
+    """A delta frame, pass the food only if it moved"""
+    flags = TAIL_REMOVED if tail_removed else 0
+    frame = DELTA_HEADER.pack(
+        DELTA, tick, score, flags | (FOOD_MOVED if food is not None else 0), head
+    )
+    if food is not None:
+        frame += CELL.pack(food)
+    return frame
+
+
+def encode_end(tick: int, score: int) -> bytes:
+    return END_FRAME.pack(END, tick, score)
+
+
+def end_after(frame: bytes) -> bytes:
+    """An end frame for a game whose last frame was this one"""
+    # Every frame type starts with the same type, tick and score fields
+    return encode_end(*struct.unpack_from("<II", frame, 1))
+
+
+def is_valid_frame(frame: bytes) -> bool:
+    """Whether bytes from a publisher have the shape of one frame"""
+    if not frame:
+        return False
+    kind = frame[0]
+    if kind == KEYFRAME:
+        if len(frame) < KEYFRAME_HEADER.size:
+            return False
+        length = KEYFRAME_HEADER.unpack_from(frame)[5]
+        return len(frame) == KEYFRAME_HEADER.size + length * CELL.size
+    if kind == DELTA:
+        if len(frame) < DELTA_HEADER.size:
+            return False
+        extra = CELL.size if frame[9] & FOOD_MOVED else 0
+        return len(frame) == DELTA_HEADER.size + extra
+    return kind == END and len(frame) == END_FRAME.size
+
+
+class FrameEncoder:
+    """Turns successive states of one engine game into frames"""
+
+    def __init__(self, keyframe_interval: int = KEYFRAME_INTERVAL):
+        self.keyframe_interval = keyframe_interval
+        self._length = 0
+        self._food = None
+        self._last_keyframe = None
+
+    def encode(self, game: SnakeGame) -> bytes:
+        if game.over:
+            return encode_end(game.tick, game.score)
+        if (
+            self._last_keyframe is None
+            or game.tick - self._last_keyframe >= self.keyframe_interval
+        ):
+            frame = encode_keyframe(game)
+            self._last_keyframe = game.tick
+        else:
+            frame = encode_delta(
+                game.tick,
+                game.score,
+                game.body[game.head],
+                game.length == self._length,
+                game.food if game.food != self._food else None,
+            )
+        self._length = game.length
+        self._food = game.food
+        return frame
+
+
+class Spectator:
+    """Frames waiting to be sent to one spectator"""
+
+    def __init__(self, buffer: int):
+        self.buffer = buffer
+        self.frames: Deque[bytes] = deque()
+        self.waiting_for_keyframe = True
+        self.ended = False
+        self._loop = asyncio.get_running_loop()
+        self._ready = asyncio.Event()
+
+    def deliver(self, frame: bytes) -> None:
+        kind = frame[0]
+        if len(self.frames) >= self.buffer:
+            # Too slow to keep up, skip ahead to the next keyframe
+            self.frames.clear()
+            self.waiting_for_keyframe = True
+        if kind == KEYFRAME:
+            self.waiting_for_keyframe = False
+        elif kind == DELTA and self.waiting_for_keyframe:
+            # Deltas only make sense on top of the board they follow
+            return
+
+        self.frames.append(frame)
+        if kind == END:
+            self.ended = True
+        self._ready.set()
+
+    async def get(self) -> List[bytes]:
+        """Wait for frames, an empty list means the game ended"""
+        while not self.frames:
+            if self.ended:
+                return []
+            self._ready.clear()
+            await self._ready.wait()
+        frames = list(self.frames)
+        self.frames.clear()
+        return frames
+
+
+class Channel:
+    """The spectators of one game plus what a newcomer needs to catch up"""
+
+    def __init__(self):
+        self.spectators: Set[Spectator] = set()
+        self.keyframe: Optional[bytes] = None
+        # Deltas since the keyframe, bounded in case a publisher stops sending them
+        self.deltas: List[bytes] = []
+        self.ended: Optional[bytes] = None
+
+
+class Broadcaster:
+    """Fans each game's frames out to its spectators"""
+
+    def __init__(self, buffer: int = SPECTATOR_BUFFER):
+        self.buffer = buffer
+        self._channels: Dict[int, Channel] = {}
+        # Encoders of watched games that the server simulates
+        self._encoders: Dict[int, FrameEncoder] = {}
+
+    def spectator_count(self, game_id: int) -> int:
+        channel = self._channels.get(game_id)
+        return len(channel.spectators) if channel else 0
+
+    def subscribe(self, game_id: int) -> Spectator:
+        channel = self._channels.setdefault(game_id, Channel())
+        spectator = Spectator(self.buffer)
+        for frame in ([channel.keyframe] if channel.keyframe else []) + channel.deltas:
+            spectator.deliver(frame)
+        if channel.ended:
+            spectator.deliver(channel.ended)
+        channel.spectators.add(spectator)
+        return spectator
+
+    def unsubscribe(self, game_id: int, spectator: Spectator) -> None:
+        channel = self._channels.get(game_id)
+        if channel is None:
+            return
+        channel.spectators.discard(spectator)
+        if not channel.spectators and (channel.ended or channel.keyframe is None):
+            del self._channels[game_id]
+
+    def publish(self, game_id: int, frame: bytes) -> None:
+        """Send one encoded frame to every spectator, safe from any thread"""
+        channel = self._channels.setdefault(game_id, Channel())
+        kind = frame[0]
+        if kind == KEYFRAME:
+            channel.keyframe = frame
+            channel.deltas.clear()
+        elif kind == DELTA and channel.keyframe is not None:
+            channel.deltas.append(frame)
+            if len(channel.deltas) > self.buffer:
+                channel.keyframe = None
+                channel.deltas.clear()
+        elif kind == END:
+            channel.ended = frame
+            channel.keyframe = None
+            channel.deltas.clear()
+
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        for spectator in list(channel.spectators):
+            if spectator._loop.is_closed():
+                channel.spectators.discard(spectator)
+            elif running is spectator._loop:
+                spectator.deliver(frame)
+            else:
+                spectator._loop.call_soon_threadsafe(spectator.deliver, frame)
+
+        if kind == END and not channel.spectators:
+            del self._channels[game_id]
+
+    def publish_game(self, game_id: int, game: SnakeGame) -> None:
+        """Publish the state of an engine game, if anybody is watching it"""
+        if game_id not in self._channels:
+            # Start over with a keyframe once somebody tunes in
+            self._encoders.pop(game_id, None)
+            return
+        encoder = self._encoders.setdefault(game_id, FrameEncoder())
+        self.publish(game_id, encoder.encode(game))
+        if game.over:
+            del self._encoders[game_id]
+
+
+spectators = Broadcaster()
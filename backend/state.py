@@ -0,0 +1,686 @@
+"""
+Shared state behind /players, /leaderboard and the live player feed
+
+One worker can keep all of this in memory, but the CDK stack scales the
+backend out over Fargate tasks each running uvicorn workers, and in memory
+every one of them would only know the games it served itself.
+STATE_BACKEND picks where the state lives:
+
+- memory: in this process, for a single worker and for tests
+- redis: in Redis at REDIS_URL, shared by every worker. The leaderboard and
+  the ranks of all users are sorted sets, the playing games are a hash plus sorted sets by score and
+  change events go out over pub/sub to each worker, which hands them to its
+  own watchers.
+
+Both lists are paged by keyset: a page starts right after the (score, id) of
+the previous page's last row, at the cost of a seek however deep it is.
+
+The state also keeps when each live game, playing or idle, was last seen,
+which the reaper reads to retire the games whose browser went away.
+"""
+
+import asyncio
+import bisect
+import json
+import heapq
+import logging
+import os
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from engine import GAME_MODES
+
+from leaderboard import LEADERBOARD_SIZE, Leaderboard, leaderboard
+from live import PlayerFeed, player_feed
+from ranks import RankIndex
+
+logger = logging.getLogger(__name__)
+
+# memory or redis
+STATE_BACKEND = os.getenv("STATE_BACKEND", "memory")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+# Prefix of every key and channel, so deployments can share a Redis
+REDIS_PREFIX = os.getenv("REDIS_PREFIX", "snake:")
+
+# Moves games that are still in the players hash to their new score, so a
+# late update can't bring back a game that already left. XX only touches the
+# per mode set the game is in.
+# KEYS: players, players version, then the score sets.
+# ARGV: member, sort score, member, sort score, ...
+SET_PLAYING_SCORES = """
+local changed = 0
+for i = 1, #ARGV, 2 do
+    if redis.call('HEXISTS', KEYS[1], ARGV[i]) == 1 then
+        for k = 3, #KEYS do
+            redis.call('ZADD', KEYS[k], 'XX', ARGV[i + 1], ARGV[i])
+        end
+        changed = 1
+    end
+end
+if changed == 1 then
+    redis.call('INCR', KEYS[2])
+end
+"""
+
+# One keyset page of a sorted set. A probe member placed where the cursor
+# row is, or was, gives the rank to start at in O(log n).
+# KEYS: the sorted set. ARGV: sort score, probe member, count
+SEEK = """
+redis.call('ZADD', KEYS[1], ARGV[1], ARGV[2])
+local rank = redis.call('ZRANK', KEYS[1], ARGV[2])
+redis.call('ZREM', KEYS[1], ARGV[2])
+return redis.call('ZRANGE', KEYS[1], rank, rank + ARGV[3] - 1, 'WITHSCORES')
+"""
+
+
+# Moves the last seen time of live games to now, returns where each game was
+# found: playing, idle or false when it isn't live.
+# KEYS: playing heartbeats, idle heartbeats. ARGV: now, member, member, ...
+TOUCH = """
+local found = {}
+for i = 2, #ARGV do
+    found[i - 1] = false
+    for k, status in ipairs({'playing', 'idle'}) do
+        if redis.call('ZSCORE', KEYS[k], ARGV[i]) then
+            redis.call('ZADD', KEYS[k], ARGV[1], ARGV[i])
+            found[i - 1] = status
+            break
+        end
+    end
+end
+return found
+"""
+
+
+class SharedState:
+    """The leaderboard, the games being played and their change events"""
+
+    async def start(self) -> None:
+        pass
+
+    async def stop(self) -> None:
+        pass
+
+    async def needs_seeding(self) -> bool:
+        """True for exactly one worker when the state starts out empty"""
+        raise NotImplementedError
+
+    async def load_leaderboard(self, rows: Iterable[Tuple[int, str, int]]) -> None:
+        raise NotImplementedError
+
+    async def submit_score(self, user_id: int, username: str, score: int) -> bool:
+        """Record a finished score, returns True if the leaderboard changed"""
+        raise NotImplementedError
+
+    async def top(
+        self,
+        limit: int,
+        offset: int = 0,
+        after: Optional[Tuple[int, int]] = None,
+    ) -> List[Tuple[int, str, int]]:
+        """Return (user_id, username, score) rows, past after's (score, user_id)"""
+        raise NotImplementedError
+
+    async def load_ranks(self, rows: Iterable[Tuple[int, int]]) -> None:
+        """Add (user_id, best score) rows to the ranks of all users"""
+        raise NotImplementedError
+
+    async def rank(self, user_id: int) -> Optional[Tuple[int, int, int]]:
+        """(rank, best score, users ranked), None without a finished game"""
+        raise NotImplementedError
+
+    async def around(self, user_id: int, count: int) -> List[Tuple[int, int, int]]:
+        """(rank, user_id, score) of a user and of count users on either side"""
+        raise NotImplementedError
+
+    async def load_players(self, players: Iterable[dict]) -> None:
+        raise NotImplementedError
+
+    async def players(self) -> List[dict]:
+        raise NotImplementedError
+
+    async def players_page(
+        self,
+        limit: int,
+        after: Optional[Tuple[int, int]] = None,
+        game_mode: Optional[str] = None,
+    ) -> List[dict]:
+        """Playing games by score then game id, past after's (score, game_id)"""
+        raise NotImplementedError
+
+    async def player_joined(self, player: dict) -> None:
+        raise NotImplementedError
+
+    async def player_scores(self, scores: Dict[int, int]) -> None:
+        raise NotImplementedError
+
+    async def player_left(self, game_id: int, status: str) -> None:
+        await self.players_left({game_id: status})
+
+    async def players_left(self, statuses: Dict[int, str]) -> None:
+        """Games leaving the list, idle ones stay live until they finish"""
+        raise NotImplementedError
+
+    async def version(self, name: str) -> int:
+        """A counter of the players or leaderboard that moves on every change"""
+        raise NotImplementedError
+
+    async def changed(self, name: str) -> None:
+        """Move a version on for a change made outside the state"""
+        raise NotImplementedError
+
+    async def track(
+        self, game_ids: Iterable[int], status: str = "playing", now=None
+    ) -> None:
+        """Start the last seen clock of live games, playing or idle"""
+        raise NotImplementedError
+
+    async def untrack(self, game_ids: Iterable[int]) -> None:
+        raise NotImplementedError
+
+    async def touch(self, game_ids: List[int], now=None) -> List[Optional[str]]:
+        """Mark games as seen now, returns each one's status, None if not live"""
+        raise NotImplementedError
+
+    async def stale_games(
+        self, status: str, before: float, limit: int
+    ) -> List[Tuple[int, float]]:
+        """(game_id, last seen) of games not seen since before, oldest first"""
+        raise NotImplementedError
+
+
+class MemoryState(SharedState):
+    """State of this process only"""
+
+    def __init__(
+        self, board: Leaderboard, feed: PlayerFeed, ranks: Optional[RankIndex] = None
+    ):
+        self.leaderboard = board
+        self.feed = feed
+        self.ranks = RankIndex() if ranks is None else ranks
+        self._players: Dict[int, dict] = {}
+        # Sorted (-score, game_id) of all playing games, and of each mode's
+        self._order: Dict[Optional[str], List[Tuple[int, int]]] = {None: []}
+        self._versions = {"players": 0, "leaderboard": 0}
+        # Last seen time of every live game, by status
+        self._seen: Dict[str, Dict[int, float]] = {"playing": {}, "idle": {}}
+
+    async def needs_seeding(self) -> bool:
+        return True
+
+    async def load_leaderboard(self, rows: Iterable[Tuple[int, str, int]]) -> None:
+        self.leaderboard.load(rows)
+        self._versions["leaderboard"] += 1
+
+    async def submit_score(self, user_id: int, username: str, score: int) -> bool:
+        # Every finished game counts, it may change a filtered leaderboard
+        self._versions["leaderboard"] += 1
+        self.ranks.submit(user_id, score)
+        return self.leaderboard.submit(user_id, username, score)
+
+    async def top(
+        self,
+        limit: int,
+        offset: int = 0,
+        after: Optional[Tuple[int, int]] = None,
+    ) -> List[Tuple[int, str, int]]:
+        return self.leaderboard.top(limit, offset, after)
+
+    async def load_ranks(self, rows: Iterable[Tuple[int, int]]) -> None:
+        self.ranks.extend(rows)
+
+    async def rank(self, user_id: int) -> Optional[Tuple[int, int, int]]:
+        found = self.ranks.rank(user_id)
+        return None if found is None else (*found, len(self.ranks))
+
+    async def around(self, user_id: int, count: int) -> List[Tuple[int, int, int]]:
+        return self.ranks.around(user_id, count)
+
+    def _index(self, player: dict) -> None:
+        key = (-player["score"], player["game_id"])
+        for mode in (None, player["game_mode"]):
+            bisect.insort(self._order.setdefault(mode, []), key)
+
+    def _unindex(self, player: dict) -> None:
+        key = (-player["score"], player["game_id"])
+        for mode in (None, player["game_mode"]):
+            order = self._order[mode]
+            del order[bisect.bisect_left(order, key)]
+
+    async def load_players(self, players: Iterable[dict]) -> None:
+        self._players = {player["game_id"]: dict(player) for player in players}
+        self._order = {None: []}
+        for player in self._players.values():
+            self._index(player)
+        self._versions["players"] += 1
+
+    async def players(self) -> List[dict]:
+        return [dict(player) for player in self._players.values()]
+
+    async def players_page(
+        self,
+        limit: int,
+        after: Optional[Tuple[int, int]] = None,
+        game_mode: Optional[str] = None,
+    ) -> List[dict]:
+        order = self._order.get(game_mode, [])
+        start = 0
+        if after is not None:
+            start = bisect.bisect_right(order, (-after[0], after[1]))
+        return [
+            dict(self._players[game_id]) for _, game_id in order[start : start + limit]
+        ]
+
+    async def player_joined(self, player: dict) -> None:
+        previous = self._players.get(player["game_id"])
+        if previous is not None:
+            self._unindex(previous)
+        self._players[player["game_id"]] = dict(player)
+        self._index(player)
+        self._versions["players"] += 1
+        await self.track([player["game_id"]])
+        self.feed.joined(player)
+
+    async def player_scores(self, scores: Dict[int, int]) -> None:
+        for game_id, score in scores.items():
+            player = self._players.get(game_id)
+            if player is not None:
+                self._unindex(player)
+                player["score"] = score
+                self._index(player)
+                self._versions["players"] += 1
+            self.feed.score_changed(game_id, score)
+
+    async def players_left(self, statuses: Dict[int, str]) -> None:
+        for game_id, status in statuses.items():
+            player = self._players.pop(game_id, None)
+            if player is not None:
+                self._unindex(player)
+                self._versions["players"] += 1
+            seen = self._seen["playing"].pop(game_id, None)
+            if status == "idle":
+                self._seen["idle"].setdefault(game_id, seen or time.time())
+            else:
+                self._seen["idle"].pop(game_id, None)
+            self.feed.left(game_id, status)
+
+    async def version(self, name: str) -> int:
+        return self._versions[name]
+
+    async def changed(self, name: str) -> None:
+        self._versions[name] += 1
+
+    async def track(
+        self, game_ids: Iterable[int], status: str = "playing", now=None
+    ) -> None:
+        now = time.time() if now is None else now
+        for game_id in game_ids:
+            for seen in self._seen.values():
+                seen.pop(game_id, None)
+            self._seen[status][game_id] = now
+
+    async def untrack(self, game_ids: Iterable[int]) -> None:
+        for game_id in game_ids:
+            for seen in self._seen.values():
+                seen.pop(game_id, None)
+
+    async def touch(self, game_ids: List[int], now=None) -> List[Optional[str]]:
+        now = time.time() if now is None else now
+        found = []
+        for game_id in game_ids:
+            status = next(
+                (status for status, seen in self._seen.items() if game_id in seen),
+                None,
+            )
+            if status is not None:
+                self._seen[status][game_id] = now
+            found.append(status)
+        return found
+
+    async def stale_games(
+        self, status: str, before: float, limit: int
+    ) -> List[Tuple[int, float]]:
+        stale = (item for item in self._seen[status].items() if item[1] < before)
+        return heapq.nsmallest(limit, stale, key=lambda item: item[1])
+
+
+class RedisState(SharedState):
+    """State shared by every worker through Redis"""
+
+    def __init__(
+        self,
+        redis,
+        feed: PlayerFeed,
+        capacity: int = LEADERBOARD_SIZE,
+        prefix: str = REDIS_PREFIX,
+    ):
+        # A redis.asyncio client created with decode_responses=True
+        self.redis = redis
+        self.feed = feed
+        self.capacity = capacity
+        # Members are "<zero padded user id>:<username>" scored by -score, so
+        # ascending order is best score first and then lowest user id, like
+        # the in-memory leaderboard
+        self.leaderboard_key = f"{prefix}leaderboard"
+        # Every user with a finished game, by zero padded id scored by -score,
+        # in the same order but not capped
+        self.ranks_key = f"{prefix}ranks"
+        # Playing games are keyed by their zero padded id: player JSON in a
+        # hash, and the score in sorted sets of all games and of each mode's,
+        # scored by -score so they order like the leaderboard
+        self.players_key = f"{prefix}players"
+        self.order_key = f"{prefix}players_by_score"
+        self.mode_keys = {mode: f"{self.order_key}:{mode}" for mode in GAME_MODES}
+        # Last seen time of live games, padded ids scored by a Unix time
+        self.seen_keys = {
+            "playing": f"{prefix}seen:playing",
+            "idle": f"{prefix}seen:idle",
+        }
+        self.seeded_key = f"{prefix}seeded"
+        self.channel = f"{prefix}player_events"
+        self.version_prefix = f"{prefix}version:"
+        self._set_playing_scores = redis.register_script(SET_PLAYING_SCORES)
+        self._seek = redis.register_script(SEEK)
+        self._touch = redis.register_script(TOUCH)
+        self._listener = None
+
+    async def start(self) -> None:
+        self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self) -> None:
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+        await self.redis.aclose()
+
+    async def _listen(self) -> None:
+        """Hand events published by any worker to this worker's watchers"""
+        while True:
+            try:
+                async with self.redis.pubsub() as pubsub:
+                    await pubsub.subscribe(self.channel)
+                    # Events may have been missed while not subscribed
+                    self.feed.resync()
+                    async for message in pubsub.listen():
+                        if message["type"] == "message":
+                            for event in json.loads(message["data"]):
+                                self.feed.publish(event)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Player events subscription failed, reconnecting")
+                await asyncio.sleep(1)
+
+    async def needs_seeding(self) -> bool:
+        return bool(await self.redis.set(self.seeded_key, 1, nx=True))
+
+    async def _page(
+        self, key: str, start: int, count: int, after: Optional[Tuple[int, str]]
+    ) -> List[Tuple[str, float]]:
+        """Members and sort scores of a sorted set, past after's (score, probe)"""
+        if after is None:
+            return await self.redis.zrange(
+                key, start, start + count - 1, withscores=True
+            )
+        score, probe = after
+        flat = await self._seek(keys=[key], args=[-score, probe, start + count])
+        return [(flat[i], float(flat[i + 1])) for i in range(2 * start, len(flat), 2)]
+
+    def _member(self, user_id: int, username: str) -> str:
+        return f"{user_id:010d}:{username}"
+
+    async def load_leaderboard(self, rows: Iterable[Tuple[int, str, int]]) -> None:
+        members = {
+            self._member(user_id, username): -score for user_id, username, score in rows
+        }
+        if not members:
+            return
+        async with self.redis.pipeline() as pipe:
+            pipe.zadd(self.leaderboard_key, members, lt=True)
+            pipe.zremrangebyrank(self.leaderboard_key, self.capacity, -1)
+            pipe.incr(f"{self.version_prefix}leaderboard")
+            await pipe.execute()
+
+    async def submit_score(self, user_id: int, username: str, score: int) -> bool:
+        member = self._member(user_id, username)
+        async with self.redis.pipeline() as pipe:
+            # LT only ever moves a user up, like keeping their best score
+            pipe.zadd(self.leaderboard_key, {member: -score}, lt=True, ch=True)
+            pipe.zremrangebyrank(self.leaderboard_key, self.capacity, -1)
+            pipe.zscore(self.leaderboard_key, member)
+            # Every finished game counts, it may change a filtered leaderboard
+            pipe.incr(f"{self.version_prefix}leaderboard")
+            pipe.zadd(self.ranks_key, {f"{user_id:010d}": -score}, lt=True)
+            changed, _, kept, _, _ = await pipe.execute()
+        return bool(changed) and kept is not None
+
+    async def top(
+        self,
+        limit: int,
+        offset: int = 0,
+        after: Optional[Tuple[int, int]] = None,
+    ) -> List[Tuple[int, str, int]]:
+        if after is not None:
+            # ";" sorts right after the ":" of the cursor user's own member
+            after = (after[0], f"{after[1]:010d};")
+        rows = await self._page(self.leaderboard_key, offset, limit, after)
+        entries = []
+        for member, score in rows:
+            user_id, username = member.split(":", 1)
+            entries.append((int(user_id), username, -int(score)))
+        return entries
+
+    async def load_ranks(self, rows: Iterable[Tuple[int, int]]) -> None:
+        members = {f"{user_id:010d}": -score for user_id, score in rows}
+        if members:
+            await self.redis.zadd(self.ranks_key, members, lt=True)
+
+    async def rank(self, user_id: int) -> Optional[Tuple[int, int, int]]:
+        async with self.redis.pipeline() as pipe:
+            # A sorted set is a skip list that counts the members it skips
+            pipe.zrank(self.ranks_key, f"{user_id:010d}")
+            pipe.zscore(self.ranks_key, f"{user_id:010d}")
+            pipe.zcard(self.ranks_key)
+            index, score, total = await pipe.execute()
+        if index is None:
+            return None
+        return index + 1, -int(score), total
+
+    async def around(self, user_id: int, count: int) -> List[Tuple[int, int, int]]:
+        index = await self.redis.zrank(self.ranks_key, f"{user_id:010d}")
+        if index is None:
+            return []
+        first = max(0, index - count)
+        rows = await self.redis.zrange(
+            self.ranks_key, first, index + count, withscores=True
+        )
+        return [
+            (first + offset + 1, int(member), -int(score))
+            for offset, (member, score) in enumerate(rows)
+        ]
+
+    def _game(self, game_id: int) -> str:
+        return f"{game_id:010d}"
+
+    def _order_keys(self, player: dict) -> List[str]:
+        mode_key = self.mode_keys.get(player["game_mode"])
+        return [self.order_key] + ([mode_key] if mode_key else [])
+
+    async def load_players(self, players: Iterable[dict]) -> None:
+        players = list(players)
+        async with self.redis.pipeline() as pipe:
+            pipe.delete(self.players_key, self.order_key, *self.mode_keys.values())
+            for player in players:
+                member = self._game(player["game_id"])
+                pipe.hset(self.players_key, member, json.dumps(player))
+                for key in self._order_keys(player):
+                    pipe.zadd(key, {member: -player["score"]})
+            pipe.incr(f"{self.version_prefix}players")
+            await pipe.execute()
+
+    async def players(self) -> List[dict]:
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.hgetall(self.players_key)
+            pipe.zrange(self.order_key, 0, -1, withscores=True)
+            players, scores = await pipe.execute()
+        scores = dict(scores)
+        result = []
+        for member, encoded in players.items():
+            player = json.loads(encoded)
+            if member in scores:
+                player["score"] = -int(scores[member])
+            result.append(player)
+        return result
+
+    async def players_page(
+        self,
+        limit: int,
+        after: Optional[Tuple[int, int]] = None,
+        game_mode: Optional[str] = None,
+    ) -> List[dict]:
+        key = self.order_key if game_mode is None else self.mode_keys.get(game_mode)
+        if key is None:
+            return []
+        if after is not None:
+            after = (after[0], f"{self._game(after[1])};")
+        rows = await self._page(key, 0, limit, after)
+        if not rows:
+            return []
+        encoded = await self.redis.hmget(self.players_key, [row[0] for row in rows])
+        page = []
+        for (_, score), player in zip(rows, encoded):
+            # Left between the two reads
+            if player is not None:
+                page.append({**json.loads(player), "score": -int(score)})
+        return page
+
+    async def player_joined(self, player: dict) -> None:
+        event = {"type": "joined", "game_id": player["game_id"], "player": player}
+        member = self._game(player["game_id"])
+        async with self.redis.pipeline() as pipe:
+            pipe.hset(self.players_key, member, json.dumps(player))
+            for key in self._order_keys(player):
+                pipe.zadd(key, {member: -player["score"]})
+            pipe.zrem(self.seen_keys["idle"], member)
+            pipe.zadd(self.seen_keys["playing"], {member: time.time()})
+            pipe.incr(f"{self.version_prefix}players")
+            pipe.publish(self.channel, json.dumps([event]))
+            await pipe.execute()
+
+    async def player_scores(self, scores: Dict[int, int]) -> None:
+        if not scores:
+            return
+        events = [
+            {"type": "score", "game_id": game_id, "score": score}
+            for game_id, score in scores.items()
+        ]
+        args = []
+        for game_id, score in scores.items():
+            args += [self._game(game_id), -score]
+        async with self.redis.pipeline() as pipe:
+            await self._set_playing_scores(
+                keys=[
+                    self.players_key,
+                    f"{self.version_prefix}players",
+                    self.order_key,
+                    *self.mode_keys.values(),
+                ],
+                args=args,
+                client=pipe,
+            )
+            pipe.publish(self.channel, json.dumps(events))
+            await pipe.execute()
+
+    async def players_left(self, statuses: Dict[int, str]) -> None:
+        if not statuses:
+            return
+        events = [
+            {"type": "left", "game_id": game_id, "status": status}
+            for game_id, status in statuses.items()
+        ]
+        members = [self._game(game_id) for game_id in statuses]
+        idle = [self._game(game_id) for game_id, s in statuses.items() if s == "idle"]
+        seen = {}
+        if idle:
+            # Idle games keep the time they were last seen playing
+            now = time.time()
+            scores = await self.redis.zmscore(self.seen_keys["playing"], idle)
+            seen = {
+                member: now if score is None else score
+                for member, score in zip(idle, scores)
+            }
+        async with self.redis.pipeline() as pipe:
+            pipe.hdel(self.players_key, *members)
+            for key in [self.order_key, *self.mode_keys.values()]:
+                pipe.zrem(key, *members)
+            pipe.zrem(self.seen_keys["playing"], *members)
+            pipe.zrem(self.seen_keys["idle"], *members)
+            if seen:
+                pipe.zadd(self.seen_keys["idle"], seen)
+            pipe.incr(f"{self.version_prefix}players")
+            pipe.publish(self.channel, json.dumps(events))
+            await pipe.execute()
+
+    async def version(self, name: str) -> int:
+        return int(await self.redis.get(f"{self.version_prefix}{name}") or 0)
+
+    async def changed(self, name: str) -> None:
+        await self.redis.incr(f"{self.version_prefix}{name}")
+
+    async def track(
+        self, game_ids: Iterable[int], status: str = "playing", now=None
+    ) -> None:
+        now = time.time() if now is None else now
+        members = {self._game(game_id): now for game_id in game_ids}
+        if not members:
+            return
+        async with self.redis.pipeline() as pipe:
+            for key in self.seen_keys.values():
+                pipe.zrem(key, *members)
+            pipe.zadd(self.seen_keys[status], members)
+            await pipe.execute()
+
+    async def untrack(self, game_ids: Iterable[int]) -> None:
+        members = [self._game(game_id) for game_id in game_ids]
+        if not members:
+            return
+        async with self.redis.pipeline() as pipe:
+            for key in self.seen_keys.values():
+                pipe.zrem(key, *members)
+            await pipe.execute()
+
+    async def touch(self, game_ids: List[int], now=None) -> List[Optional[str]]:
+        if not game_ids:
+            return []
+        now = time.time() if now is None else now
+        found = await self._touch(
+            keys=[self.seen_keys["playing"], self.seen_keys["idle"]],
+            args=[now, *(self._game(game_id) for game_id in game_ids)],
+        )
+        return [status or None for status in found]
+
+    async def stale_games(
+        self, status: str, before: float, limit: int
+    ) -> List[Tuple[int, float]]:
+        rows = await self.redis.zrangebyscore(
+            self.seen_keys[status], "-inf", f"({before}", 0, limit, withscores=True
+        )
+        return [(int(member), seen) for member, seen in rows]
+
+
+def create_state() -> SharedState:
+    if STATE_BACKEND == "memory":
+        return MemoryState(leaderboard, player_feed)
+    if STATE_BACKEND == "redis":
+        # Only deployments that share state need the client installed
+        from redis.asyncio import Redis
+
+        return RedisState(Redis.from_url(REDIS_URL, decode_responses=True), player_feed)
+    raise ValueError(f"Unknown state backend: {STATE_BACKEND}")
+
+
+state = create_state()
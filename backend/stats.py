@@ -0,0 +1,164 @@
+"""
+Per user game stats behind GET /users/{id}/stats
+
+A finished game adds to its user's user_stats row for its game mode: one more
+game played, its score to the total and maybe the best, and the time from
+its start to its finish. That happens in the transaction that finishes the
+game, and only the first time it finishes: the same UPDATE sets
+games.finished_at, but only on a game that never finished before, so a game
+whose returned finished_at isn't the time it was just given was counted
+already. Reading a user's stats is then one row per game mode, however many
+games they played. The rows can be rebuilt from the games, live and
+archived, as after a bulk import, while nothing else finishes games.
+"""
+
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import case, delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql.elements import ColumnElement
+
+from archive import finished_games
+from models import Game, UserStats, dialect_insert
+
+StatsKey = Tuple[int, str]
+
+
+def first_finish(finished_at) -> ColumnElement:
+    """games.finished_at of a game finishing at finished_at, kept if it finished"""
+    return case(
+        (Game.finished_at.is_(None) & (Game.status != "finished"), finished_at),
+        else_=Game.finished_at,
+    )
+
+
+def play_seconds(game: Game) -> float:
+    if game.created_at is None or game.finished_at is None:
+        return 0.0
+    return max(0.0, (game.finished_at - game.created_at).total_seconds())
+
+
+def fold(games: Iterable[Game]) -> Dict[StatsKey, List]:
+    """[games played, total score, best score, seconds] per (user_id, mode)"""
+    totals: Dict[StatsKey, List] = {}
+    for game in games:
+        score = game.score or 0
+        row = totals.setdefault((game.user_id, game.game_mode), [0, 0, score, 0.0])
+        row[0] += 1
+        row[1] += score
+        row[2] = max(row[2], score)
+        row[3] += play_seconds(game)
+    return totals
+
+
+async def apply(db: AsyncSession, totals: Dict[StatsKey, List]) -> None:
+    """Add totals to the users' stats, in the caller's transaction"""
+    if not totals:
+        return
+    statement = dialect_insert(db)(UserStats)
+    new = statement.excluded
+    await db.execute(
+        statement.on_conflict_do_update(
+            index_elements=[UserStats.user_id, UserStats.game_mode],
+            set_={
+                "games_played": UserStats.games_played + new.games_played,
+                "total_score": UserStats.total_score + new.total_score,
+                "best_score": case(
+                    (new.best_score > UserStats.best_score, new.best_score),
+                    else_=UserStats.best_score,
+                ),
+                "play_seconds": UserStats.play_seconds + new.play_seconds,
+            },
+        ),
+        [
+            {
+                "user_id": user_id,
+                "game_mode": game_mode,
+                "games_played": played,
+                "total_score": total,
+                "best_score": best,
+                "play_seconds": seconds,
+            }
+            for (user_id, game_mode), (played, total, best, seconds) in totals.items()
+        ],
+    )
+
+
+async def record_games(
+    db: AsyncSession, games: Iterable[Game], finished_at: Dict[int, datetime]
+) -> None:
+    """Count the games that just finished for the first time at finished_at"""
+    await apply(
+        db,
+        fold(
+            game
+            for game in games
+            if game.status == "finished"
+            and game.finished_at is not None
+            and game.finished_at == finished_at.get(game.id)
+        ),
+    )
+
+
+async def backfill(session_factory, chunk: int = 5000) -> int:
+    """Rebuild every user's stats from the finished games, returns the games read"""
+    async with session_factory() as db:
+        await db.execute(delete(UserStats))
+        games = finished_games(
+            "id", "user_id", "game_mode", "score", "created_at", "finished_at"
+        )
+        count = 0
+        last_id = 0
+        while True:
+            rows = (
+                await db.execute(
+                    select(games)
+                    .where(games.c.id > last_id)
+                    .order_by(games.c.id)
+                    .limit(chunk)
+                )
+            ).all()
+            if not rows:
+                # Counts only ever add up, so they're swapped in at once
+                await db.commit()
+                return count
+            await apply(db, fold(rows))
+            count += len(rows)
+            last_id = rows[-1].id
+
+
+async def user_stats(db: AsyncSession, user_id: int) -> List[UserStats]:
+    result = await db.execute(
+        select(UserStats)
+        .where(UserStats.user_id == user_id)
+        .order_by(UserStats.game_mode)
+    )
+    return list(result.scalars())
+
+
+def summary(rows: List[UserStats]) -> dict:
+    """Totals over every game mode, and per game mode"""
+
+    def describe(played: int, total: int, best: Optional[int], seconds: float):
+        return {
+            "games_played": played,
+            "best_score": best,
+            "average_score": total / played if played else None,
+            "play_seconds": seconds,
+        }
+
+    return {
+        **describe(
+            sum(row.games_played for row in rows),
+            sum(row.total_score for row in rows),
+            max((row.best_score for row in rows), default=None),
+            sum(row.play_seconds for row in rows),
+        ),
+        "modes": {
+            row.game_mode: describe(
+                row.games_played, row.total_score, row.best_score, row.play_seconds
+            )
+            for row in rows
+        },
+    }
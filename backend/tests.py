@@ -1,27 +1,102 @@
+import asyncio
+import base64
+import csv
+import io
+import os
+import random
+import struct
+import subprocess
+import sys
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from datetime import datetime, timedelta
+import orjson
+import pytest
+from alembic import command
+from alembic.config import Config
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from main import app, get_db
-from models import Base
+from httpx import ASGITransport, AsyncClient
+from sqlalchemy import create_engine, event, insert, inspect, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool
+from main import (
+    Player,
+    app,
+    get_db,
+    get_leaderboard_from_db,
+    get_players_from_db,
+)
+from models import Base, Game, GameArchive, ScoreRollup, User, UserStats
+from leaderboard import Leaderboard
+from ranks import RankIndex
+from live import PlayerFeed
+from state import MemoryState, RedisState
+from reaper import GameReaper
+from archive import archive
+from state import state
+from paging import decode_cursor, encode_cursor, window_start
+from rollups import (
+    ALL_TIME,
+    ANY_MODE,
+    backfill,
+    compact,
+    leaderboard_page,
+    stream_best_scores,
+)
+from stats import backfill as backfill_stats
+from scores import score_buffer
+import transfer
+from pool import InstrumentedPool, PoolMetrics, warm_pool
+from serve import cpu_quota, worker_count
+from profiling import (
+    ProfilingMiddleware,
+    RequestMetrics,
+    RequestProfile,
+    StackSampler,
+)
+from users import MISSING, UserCache, user_cache
+from engine import DOWN, LEFT, RIGHT, UP, SnakeGame, arena
+from replays import ReplayError, decode_inputs, encode_inputs, replay_score
+from spectate import (
+    CELL,
+    DELTA,
+    DELTA_HEADER,
+    END,
+    FOOD_MOVED,
+    KEYFRAME,
+    KEYFRAME_HEADER,
+    TAIL_REMOVED,
+    Broadcaster,
+    FrameEncoder,
+    encode_delta,
+    encode_end,
+    encode_keyframe,
+)
 
 # Create a test database
-SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+SQLALCHEMY_DATABASE_URL = "sqlite+aiosqlite:///./test.db"
+# TestClient runs each request on a fresh event loop, so don't pool connections
+engine = create_async_engine(SQLALCHEMY_DATABASE_URL, poolclass=NullPool)
+TestingSessionLocal = async_sessionmaker(
+    bind=engine, autoflush=False, expire_on_commit=False
 )
-TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
 
 # Create all tables
-Base.metadata.create_all(bind=engine)
+async def create_test_tables():
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+
+asyncio.run(create_test_tables())
 
 
 # Override the get_db dependency
-def override_get_db():
-    try:
-        db = TestingSessionLocal()
+async def override_get_db():
+    async with TestingSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 
 app.dependency_overrides[get_db] = override_get_db
@@ -54,6 +129,82 @@ def test_login():
     assert "token" in data
 
 
+def test_login_is_cached():
+    with count_statements() as statements:
+        first = client.post("/login", json={"username": "cacheduser"}).json()
+    assert len(statements) == 2  # lookup, INSERT ... ON CONFLICT DO NOTHING
+
+    with count_statements() as statements:
+        second = client.post("/login", json={"username": "cacheduser"}).json()
+    assert len(statements) == 0
+    assert second["id"] == first["id"]
+
+    # Known users are rejected without a round trip
+    with count_statements() as statements:
+        response = client.post("/users", json={"username": "cacheduser"})
+    assert response.status_code == 409
+    assert len(statements) == 0
+
+
+def test_login_after_concurrent_create():
+    # The name was missing a moment ago but another worker has created it since
+    user_cache.put_missing("racer")
+
+    async def create_elsewhere():
+        sessions = app.dependency_overrides[get_db]()
+        try:
+            db = await anext(sessions)
+            db.add(User(username="racer"))
+            await db.commit()
+        finally:
+            await sessions.aclose()
+
+    asyncio.run(create_elsewhere())
+    with count_statements() as statements:
+        response = client.post("/login", json={"username": "racer"})
+    assert response.status_code == 200
+    assert len(statements) == 2  # upsert finds the conflict, then the lookup
+
+    created = client.post("/login", json={"username": "racer"}).json()
+    assert response.json()["id"] == created["id"]
+
+
+def test_concurrent_logins_share_one_create():
+    async def login_many():
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as http:
+            responses = await asyncio.gather(
+                *(http.post("/login", json={"username": "herd"}) for _ in range(20))
+            )
+        return [response.json()["id"] for response in responses]
+
+    with count_statements() as statements:
+        ids = asyncio.run(login_many())
+    assert len(set(ids)) == 1
+    assert len(statements) == 2
+
+
+def test_user_cache_expiry_and_eviction():
+    now = [0.0]
+    cache = UserCache(size=2, ttl=10, negative_ttl=1, clock=lambda: now[0])
+    cache.put(1, "a")
+    cache.put_missing("b")
+    assert cache.get("a") == (1, "a")
+    assert cache.get("b") is MISSING
+    assert cache.get("c") is None
+
+    now[0] = 2
+    assert cache.get("b") is None  # negative entries expire quickly
+    cache.put(2, "b")
+    cache.get("a")
+    cache.put(3, "c")  # evicts the least recently used entry
+    assert cache.get("b") is None
+    assert cache.get("a") == (1, "a")
+
+    now[0] = 20
+    assert cache.get("a") is None
+
+
 def test_start_game():
     # First create a user
     user_response = client.post("/users", json={"username": "gameuser"})
@@ -91,6 +242,73 @@ def test_update_score():
     assert data["score"] == 100
 
 
+def flush_score_buffer():
+    # Use whichever session the app is currently given
+    async def flush():
+        sessions = app.dependency_overrides[get_db]()
+        try:
+            return await score_buffer.flush(await anext(sessions))
+        finally:
+            await sessions.aclose()
+
+    return asyncio.run(flush())
+
+
+def test_batch_score_updates():
+    user_response = client.post("/users", json={"username": "batchuser"})
+    user_id = user_response.json()["id"]
+    game_ids = [
+        client.post("/games", json={"user_id": user_id, "game_mode": "walls"}).json()[
+            "id"
+        ]
+        for _ in range(2)
+    ]
+
+    response = client.post(
+        "/games/scores:batch",
+        json={
+            "scores": [
+                {"game_id": game_ids[0], "score": 10},
+                {"game_id": game_ids[0], "score": 30},
+                {"game_id": game_ids[0], "score": 20},
+                {"game_id": game_ids[1], "score": 5},
+            ]
+        },
+    )
+    assert response.status_code == 202
+    assert response.json() == {"accepted": 4}
+
+    # Repeated updates to one game coalesce to its highest score
+    assert flush_score_buffer() == 2
+    response = client.put(f"/games/{game_ids[0]}/status", json={"status": "finished"})
+    assert response.json()["score"] == 30
+
+    # A status change picks up a score that hasn't been flushed yet
+    client.post(
+        "/games/scores:batch", json={"scores": [{"game_id": game_ids[1], "score": 15}]}
+    )
+    response = client.put(f"/games/{game_ids[1]}/status", json={"status": "finished"})
+    assert response.json()["score"] == 15
+    assert flush_score_buffer() == 0
+
+    # Finished and unknown games take no more scores, buffered or not
+    response = client.post(
+        "/games/scores:batch",
+        json={
+            "scores": [
+                {"game_id": game_ids[1], "score": 900},
+                {"game_id": 999999, "score": 900},
+            ]
+        },
+    )
+    assert response.json() == {"accepted": 0}
+    assert flush_score_buffer() == 0
+    score_buffer.add(game_ids[1], 900)
+    flush_score_buffer()
+    games = client.get(f"/users/{user_id}/games").json()
+    assert [game["score"] for game in games] == [15, 30]
+
+
 def test_update_game_status():
     # First create a user and game
     user_response = client.post("/users", json={"username": "statususer"})
@@ -117,6 +335,35 @@ def test_get_leaderboard():
     assert isinstance(data, list)
 
 
+def test_leaderboard_keeps_best_score_per_user():
+    user_response = client.post("/users", json={"username": "bestscoreuser"})
+    user_id = user_response.json()["id"]
+
+    # Finish two games, the lower second score must not replace the first
+    for score in (300, 200):
+        game_response = client.post(
+            "/games", json={"user_id": user_id, "game_mode": "walls"}
+        )
+        game_id = game_response.json()["id"]
+        client.put(f"/games/{game_id}/score", json={"score": score})
+        client.put(f"/games/{game_id}/status", json={"status": "finished"})
+
+    response = client.get("/leaderboard")
+    assert response.status_code == 200
+    entries = [entry for entry in response.json() if entry["id"] == user_id]
+    assert entries == [{"id": user_id, "username": "bestscoreuser", "score": 300}]
+
+
+def test_leaderboard_capacity_and_paging():
+    board = Leaderboard(capacity=3)
+    for user_id, score in [(1, 10), (2, 40), (3, 30), (4, 20), (1, 50)]:
+        board.submit(user_id, f"user{user_id}", score)
+
+    # User 1 was evicted by user 4, then came back with a better score
+    assert board.top(10) == [(1, "user1", 50), (2, "user2", 40), (3, "user3", 30)]
+    assert board.top(2, offset=1) == [(2, "user2", 40), (3, "user3", 30)]
+
+
 def test_get_players():
     response = client.get("/players")
     assert response.status_code == 200
@@ -124,6 +371,941 @@ def test_get_players():
     assert isinstance(data, list)
 
 
+def test_lists_are_served_from_plain_rows():
+    user_id = client.post("/users", json={"username": "rowsuser"}).json()["id"]
+    game_id = client.post(
+        "/games", json={"user_id": user_id, "game_mode": "walls"}
+    ).json()["id"]
+
+    async def load():
+        # Whichever database the app is pointed at
+        async for db in app.dependency_overrides[get_db]():
+            return await get_players_from_db(db), await get_leaderboard_from_db(db)
+
+    # The rows that seed the state already have the shape of the responses
+    players, leaderboard = asyncio.run(load())
+    player = next(player for player in players if player["game_id"] == game_id)
+    assert Player.model_validate(player).model_dump() == player
+    assert all(len(entry) == 3 for entry in leaderboard)
+
+    response = client.get("/players")
+    assert response.headers["content-type"] == "application/json"
+    assert player in response.json()
+
+
+def finish_game(user_id, game_mode, score):
+    game_id = client.post(
+        "/games", json={"user_id": user_id, "game_mode": game_mode}
+    ).json()["id"]
+    client.put(f"/games/{game_id}/score", json={"score": score})
+    client.put(f"/games/{game_id}/status", json={"status": "finished"})
+    return game_id
+
+
+def test_rank_index_orders_like_a_sort():
+    rng = random.Random(7)
+    # Narrow buckets and a low cap so scores share, overflow and grow buckets
+    index = RankIndex(width=10, buckets=64)
+    best = {}
+    for step in range(500):
+        rows = [(rng.randint(1, 60), rng.randint(-5, 120) * 10)]
+        if step % 3:
+            index.submit(*rows[0])
+        else:
+            rows.append((rng.randint(1, 60), rng.randint(-5, 1200)))
+            index.extend(rows)
+        for user_id, score in rows:
+            best[user_id] = max(score, best.get(user_id, score))
+
+        order = sorted(best, key=lambda user_id: (-best[user_id], user_id))
+        for rank, user_id in enumerate(order, 1):
+            assert index.rank(user_id) == (rank, best[user_id])
+        user_id = rng.choice(order)
+        rank = order.index(user_id) + 1
+        assert index.around(user_id, 3) == [
+            (other_rank, other, best[other])
+            for other_rank, other in enumerate(order, 1)
+            if abs(other_rank - rank) <= 3
+        ]
+    assert index.rank(1000) is None and index.around(1000, 3) == []
+
+
+def test_state_backends_rank_every_user():
+    async def scenario(shared):
+        await shared.load_ranks([(1, 50), (2, 70), (3, 50)])
+        await shared.load_ranks([(4, 10)])
+        assert await shared.rank(3) == (3, 50, 4)
+        await shared.submit_score(4, "four", 60)
+        await shared.submit_score(2, "two", 20)
+        assert await shared.rank(4) == (2, 60, 4)
+        assert await shared.around(3, 1) == [(3, 1, 50), (4, 3, 50)]
+        assert await shared.around(2, 0) == [(1, 2, 70)]
+        assert await shared.rank(5) is None and await shared.around(5, 2) == []
+        await shared.stop()
+
+    asyncio.run(scenario(MemoryState(Leaderboard(), PlayerFeed())))
+    asyncio.run(scenario(redis_states(1)[0]))
+
+
+def test_user_rank_and_neighbours():
+    user_ids = [
+        client.post("/users", json={"username": f"ranked{i}"}).json()["id"]
+        for i in range(3)
+    ]
+    for user_id, score in zip(user_ids, (1_357_910, 1_357_930, 1_357_920)):
+        finish_game(user_id, "walls", score)
+
+    response = client.get(f"/users/{user_ids[2]}/rank")
+    assert response.status_code == 200
+    ranked = response.json()
+    assert ranked["username"] == "ranked2" and ranked["score"] == 1_357_920
+    assert ranked["total"] >= ranked["rank"] > 1
+
+    response = client.get(f"/leaderboard/around/{user_ids[2]}", params={"count": 1})
+    assert response.json() == [
+        {
+            "id": user_ids[1],
+            "username": "ranked1",
+            "score": 1_357_930,
+            "rank": ranked["rank"] - 1,
+        },
+        {
+            "id": user_ids[2],
+            "username": "ranked2",
+            "score": 1_357_920,
+            "rank": ranked["rank"],
+        },
+        {
+            "id": user_ids[0],
+            "username": "ranked0",
+            "score": 1_357_910,
+            "rank": ranked["rank"] + 1,
+        },
+    ]
+
+    unranked = client.post("/users", json={"username": "unranked"}).json()["id"]
+    assert client.get(f"/users/{unranked}/rank").status_code == 404
+    assert client.get(f"/leaderboard/around/{unranked}").status_code == 404
+    assert client.get("/users/999999/rank").status_code == 404
+
+    # What a starting worker loads the ranks from
+    async def streamed():
+        async with active_session() as db:
+            return [rows async for rows in stream_best_scores(db, chunk=2)]
+
+    chunks = asyncio.run(streamed())
+    assert max(len(rows) for rows in chunks) == 2
+    best = dict(row for rows in chunks for row in rows)
+    assert [best[user_id] for user_id in user_ids] == [1_357_910, 1_357_930, 1_357_920]
+    assert unranked not in best
+
+
+def test_filtered_leaderboard_pages_by_cursor():
+    first = client.post("/users", json={"username": "keysetfirst"}).json()["id"]
+    second = client.post("/users", json={"username": "keysetsecond"}).json()["id"]
+    finish_game(first, "walls", 2_000_500)
+    finish_game(first, "walls", 2_000_300)
+    finish_game(first, "pass-through", 2_000_700)
+    finish_game(second, "walls", 2_000_400)
+
+    response = client.get("/leaderboard?game_mode=walls&window=today&limit=1")
+    assert response.json() == [
+        {"id": first, "username": "keysetfirst", "score": 2_000_500}
+    ]
+    # The user's lower walls game is skipped, they're already ranked
+    cursor = response.headers["x-next-cursor"]
+    response = client.get(f"/leaderboard?game_mode=walls&limit=1&cursor={cursor}")
+    assert response.json() == [
+        {"id": second, "username": "keysetsecond", "score": 2_000_400}
+    ]
+    response = client.get("/leaderboard?game_mode=pass-through&limit=1")
+    assert response.json()[0]["score"] == 2_000_700
+
+    assert client.get("/leaderboard?cursor=nonsense").status_code == 400
+    assert client.get("/leaderboard?window=week&offset=1").status_code == 400
+    assert client.get("/leaderboard?game_mode=snakes").status_code == 422
+
+
+def test_all_time_leaderboard_cursor_ends_with_the_board(monkeypatch):
+    board = Leaderboard(capacity=3)
+    board.load([(id, f"user{id}", 100 * id) for id in range(1, 5)])
+    monkeypatch.setattr(state, "leaderboard", board)
+
+    # A full last page of the kept top-N points nowhere, not to an empty page.
+    # offset=0 keeps the responses apart from other tests' in the cache
+    pages = []
+    url = "/leaderboard?limit=1&offset=0"
+    while url:
+        response = client.get(url)
+        pages.append([entry["score"] for entry in response.json()])
+        cursor = response.headers.get("x-next-cursor")
+        url = cursor and f"/leaderboard?limit=1&offset=0&cursor={cursor}"
+    assert pages == [[400], [300], [200]]
+    response = client.get("/leaderboard?limit=3&offset=0")
+    assert "x-next-cursor" not in response.headers
+
+
+def test_players_pages_by_cursor():
+    user_id = client.post("/users", json={"username": "pageduser"}).json()["id"]
+    game_ids = []
+    for score in (3_000_000, 3_000_000, 2_999_000):
+        game_id = client.post(
+            "/games", json={"user_id": user_id, "game_mode": "walls"}
+        ).json()["id"]
+        client.put(f"/games/{game_id}/score", json={"score": score})
+        game_ids.append(game_id)
+
+    # Walk every page, best score first and then oldest game
+    seen = []
+    url = "/players?limit=2"
+    while url:
+        response = client.get(url)
+        assert len(response.json()) <= 2
+        seen += [(player["score"], player["game_id"]) for player in response.json()]
+        cursor = response.headers.get("x-next-cursor")
+        url = cursor and f"/players?limit=2&cursor={cursor}"
+    assert seen == sorted(seen, key=lambda row: (-row[0], row[1]))
+    assert len(set(seen)) == len(seen)
+    assert seen[:3] == [
+        (3_000_000, game_ids[0]),
+        (3_000_000, game_ids[1]),
+        (2_999_000, game_ids[2]),
+    ]
+
+    response = client.get("/players?game_mode=pass-through")
+    assert game_ids[0] not in [player["game_id"] for player in response.json()]
+    for game_id in game_ids:
+        client.put(f"/games/{game_id}/status", json={"status": "finished"})
+
+
+def test_cursors_and_windows():
+    assert decode_cursor(encode_cursor(-5, 2**40)) == (-5, 2**40)
+    # Saturday the 17th: the week began on Monday the 12th
+    now = datetime(2026, 10, 17, 13, 30)
+    assert window_start("today", now) == datetime(2026, 10, 17)
+    assert window_start("week", now) == datetime(2026, 10, 12)
+    assert window_start("all", now) is None
+
+
+@asynccontextmanager
+async def active_session():
+    # Whichever test module's database the app is using
+    async for db in app.dependency_overrides[get_db]():
+        yield db
+
+
+def test_rollups_keep_the_best_game_per_period():
+    user_id = client.post("/users", json={"username": "rollupuser"}).json()["id"]
+    finish_game(user_id, "walls", 4_000_100)
+    best = finish_game(user_id, "walls", 4_000_300)
+    other = finish_game(user_id, "pass-through", 4_000_200)
+
+    async def rollups():
+        async with active_session() as db:
+            result = await db.execute(
+                select(
+                    ScoreRollup.period,
+                    ScoreRollup.game_mode,
+                    ScoreRollup.best_score,
+                    ScoreRollup.best_game_id,
+                ).where(ScoreRollup.user_id == user_id)
+            )
+            return sorted(tuple(row) for row in result)
+
+    expected = sorted(
+        (period, mode, score, game_id)
+        for period in ("day", "week", "all")
+        for mode, score, game_id in (
+            ("walls", 4_000_300, best),
+            ("*", 4_000_300, best),
+            ("pass-through", 4_000_200, other),
+        )
+    )
+    assert asyncio.run(rollups()) == expected
+
+    async def page(window, now):
+        async with active_session() as db:
+            return await leaderboard_page(db, 100, "walls", window, now=now)
+
+    later = datetime.utcnow() + timedelta(days=8)
+    assert (user_id, "rollupuser", 4_000_300, best) in asyncio.run(page("today", None))
+    assert all(row[0] != user_id for row in asyncio.run(page("today", later)))
+
+    # Days past retention go, this week and all time stay
+    async def compact_at(now):
+        async with active_session() as db:
+            return await compact(db, now)
+
+    assert asyncio.run(compact_at(later)) >= 3
+    assert [row for row in asyncio.run(rollups()) if row[0] == "day"] == []
+    assert len(asyncio.run(rollups())) == 6
+
+    # The backfill rebuilds them all from the games, serving the rows it keeps
+    # at every commit on the way
+    served = []
+
+    @asynccontextmanager
+    async def watched_session():
+        async with active_session() as db:
+            commit = db.commit
+
+            async def watched_commit():
+                await commit()
+                served.append(len(await rollups()))
+
+            db.commit = watched_commit
+            yield db
+
+    assert asyncio.run(backfill(watched_session, chunk=2)) >= 3
+    assert asyncio.run(rollups()) == expected
+    assert served and min(served) >= 6
+
+
+def test_reaper_idles_then_finishes_stale_games():
+    user_id = client.post("/users", json={"username": "reapeduser"}).json()["id"]
+    game_id = client.post(
+        "/games", json={"user_id": user_id, "game_mode": "walls"}
+    ).json()["id"]
+    client.put(f"/games/{game_id}/score", json={"score": 5_000_000})
+    reaper = GameReaper(idle_timeout=60, finish_timeout=600, batch_size=1)
+
+    async def reap():
+        async with active_session() as db:
+            return await reaper.reap(db)
+
+    async def game_status():
+        async with active_session() as db:
+            return (await db.get(Game, game_id)).status
+
+    def listed():
+        players = client.get("/players?limit=1000").json()
+        return game_id in [player["game_id"] for player in players]
+
+    # Only games last seen long ago are reaped, every other test's are fresh
+    asyncio.run(state.track([game_id], now=1000.0))
+    asyncio.run(reap())
+    assert asyncio.run(game_status()) == "idle"
+    assert not listed()
+    assert reaper.idled == 1
+
+    # A heartbeat brings it back
+    assert client.post(f"/games/{game_id}/heartbeat").status_code == 204
+    assert asyncio.run(game_status()) == "playing"
+    assert listed()
+    assert client.get("/internal/metrics/reaper").json()["revived"] >= 1
+
+    asyncio.run(state.track([game_id], now=1000.0))
+    asyncio.run(reap())
+    asyncio.run(reap())
+    assert asyncio.run(game_status()) == "finished"
+    assert reaper.snapshot()["finished"] == 1
+    # Ranked like any other finished game
+    entry = {"id": user_id, "username": "reapeduser", "score": 5_000_000}
+    assert entry in client.get("/leaderboard?limit=100").json()
+    assert client.get("/leaderboard?game_mode=walls&limit=1").json()[0]["id"] == user_id
+    # And counted in the stats once, however often it's finished
+    client.put(f"/games/{game_id}/status", json={"status": "finished"})
+    assert client.get(f"/users/{user_id}/stats").json()["games_played"] == 1
+
+    assert client.post(f"/games/{game_id}/heartbeat").status_code == 404
+    assert client.post("/games/999999/heartbeat").status_code == 404
+
+
+def test_user_stats_add_up_finished_games():
+    user_id = client.post("/users", json={"username": "statsuser"}).json()["id"]
+    assert client.get(f"/users/{user_id}/stats").json() == {
+        "id": user_id,
+        "username": "statsuser",
+        "games_played": 0,
+        "best_score": None,
+        "average_score": None,
+        "play_seconds": 0.0,
+        "modes": {},
+    }
+
+    finish_game(user_id, "walls", 100)
+    finish_game(user_id, "walls", 300)
+    through = finish_game(user_id, "pass-through", 50)
+    # Finishing a game again doesn't count it twice
+    client.put(f"/games/{through}/status", json={"status": "finished"})
+    client.post("/games", json={"user_id": user_id, "game_mode": "walls"})
+
+    stats = client.get(f"/users/{user_id}/stats").json()
+    assert (stats["games_played"], stats["best_score"]) == (3, 300)
+    assert stats["average_score"] == 150
+    walls = stats["modes"]["walls"]
+    assert (walls["games_played"], walls["best_score"]) == (2, 300)
+    assert walls["average_score"] == 200
+    assert stats["play_seconds"] >= walls["play_seconds"] >= 0
+    assert client.get("/users/999999/stats").status_code == 404
+
+
+def test_user_games_page_in_constant_statements():
+    user_id = client.post("/users", json={"username": "historyuser"}).json()["id"]
+    finished = [finish_game(user_id, "walls", score) for score in (10, 20, 30)]
+    playing = client.post(
+        "/games", json={"user_id": user_id, "game_mode": "pass-through"}
+    ).json()["id"]
+
+    with count_statements() as statements:
+        response = client.get(f"/users/{user_id}/games?limit=2")
+    assert [game["id"] for game in response.json()] == [playing, finished[2]]
+    assert response.json()[0]["finished_at"] is None
+    first_page = len(statements)
+
+    cursor = response.headers["x-next-cursor"]
+    with count_statements() as statements:
+        response = client.get(f"/users/{user_id}/games?limit=20&cursor={cursor}")
+    games = response.json()
+    assert [game["id"] for game in games] == finished[1::-1]
+    assert games[0]["status"] == "finished" and games[0]["finished_at"]
+    assert "x-next-cursor" not in response.headers
+    # The user and one page of games
+    assert len(statements) == first_page == 2
+
+    assert client.get("/users/999999/games").status_code == 404
+
+
+def test_archival_moves_old_games_but_keeps_their_history():
+    user_id = client.post("/users", json={"username": "archiveuser"}).json()["id"]
+    old = [
+        finish_game(user_id, mode, score)
+        for mode, score in (("walls", 700), ("walls", 500))
+    ]
+    recent = finish_game(user_id, "pass-through", 300)
+    live = client.post(
+        "/games", json={"user_id": user_id, "game_mode": "walls"}
+    ).json()["id"]
+    history = [game["id"] for game in client.get(f"/users/{user_id}/games").json()]
+    stats = client.get(f"/users/{user_id}/stats").json()
+
+    async def backdate():
+        async with active_session() as db:
+            for game in (
+                await db.execute(select(Game).where(Game.id.in_(old)))
+            ).scalars():
+                game.created_at -= timedelta(days=60)
+                game.finished_at -= timedelta(days=60)
+            await db.commit()
+
+    async def tables():
+        async with active_session() as db:
+            hot = (
+                await db.execute(select(Game.id).where(Game.user_id == user_id))
+            ).scalars()
+            cold = await db.execute(
+                select(GameArchive.id).where(GameArchive.user_id == user_id)
+            )
+            rollups = await db.execute(
+                select(
+                    ScoreRollup.period, ScoreRollup.game_mode, ScoreRollup.best_score
+                ).where(ScoreRollup.user_id == user_id)
+            )
+            return sorted(hot), sorted(cold.scalars()), sorted(rollups)
+
+    asyncio.run(backdate())
+    before = asyncio.run(tables())
+    # A batch at a time, only what finished and started long enough ago
+    assert asyncio.run(archive(active_session, batch=1)) == 2
+    assert asyncio.run(archive(active_session)) == 0
+    hot, cold, rollups = asyncio.run(tables())
+    assert (hot, cold) == (sorted([recent, live]), sorted(old))
+    assert rollups == before[2]
+    assert (
+        client.put(f"/games/{old[0]}/status", json={"status": "finished"}).status_code
+        == 404
+    )
+
+    # A user's history and stats read both tables, page by page
+    with count_statements() as statements:
+        response = client.get(f"/users/{user_id}/games?limit=2")
+    assert len(statements) == 2
+    cursor = response.headers["x-next-cursor"]
+    rest = client.get(f"/users/{user_id}/games?cursor={cursor}").json()
+    assert [game["id"] for game in response.json() + rest] == history
+    assert rest[-1]["score"] == 700 and rest[-1]["status"] == "finished"
+    assert client.get(f"/users/{user_id}/stats").json() == stats
+
+    # So do the rebuilds of the rollups and stats, and the ranks' seed
+    asyncio.run(backfill(active_session))
+    asyncio.run(backfill_stats(active_session))
+    # The backdated games' days and weeks changed, all time didn't
+    all_time = [row for row in before[2] if row[0] == "all"]
+    assert [row for row in asyncio.run(tables())[2] if row[0] == "all"] == all_time
+    assert client.get(f"/users/{user_id}/stats").json() == stats
+
+    async def best_scores():
+        async with active_session() as db:
+            return dict(
+                row
+                for rows in [r async for r in stream_best_scores(db)]
+                for row in rows
+            )
+
+    assert asyncio.run(best_scores())[user_id] == 700
+
+
+def test_admin_export_streams_tables(monkeypatch):
+    user_id = client.post("/users", json={"username": "exportuser"}).json()["id"]
+    finish_game(user_id, "walls", 40)
+    admin = {"Authorization": "Bearer admin-secret"}
+    # Off without a token, and closed to any other
+    assert client.get("/admin/export/users", headers=admin).status_code == 403
+    monkeypatch.setattr("main.ADMIN_TOKEN", "admin-secret")
+    wrong = {"Authorization": "Bearer guess"}
+    assert client.get("/admin/export/users", headers=wrong).status_code == 403
+    assert client.get("/admin/export/tables", headers=admin).status_code == 422
+
+    async def count(model):
+        async with active_session() as db:
+            return len((await db.execute(select(model.id))).all())
+
+    response = client.get("/admin/export/games", headers=admin)
+    assert response.headers["content-type"] == "application/x-ndjson"
+    games = [orjson.loads(line) for line in response.text.splitlines()]
+    assert len(games) == asyncio.run(count(Game))
+    assert [game["id"] for game in games] == sorted(game["id"] for game in games)
+    assert {"user_id": user_id, "score": 40, "status": "finished"}.items() <= games[
+        -1
+    ].items()
+
+    response = client.get("/admin/export/users?format=csv", headers=admin)
+    assert response.headers["content-type"].startswith("text/csv")
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert len(rows) == asyncio.run(count(User))
+    assert {"id": str(user_id), "username": "exportuser"}.items() <= rows[-1].items()
+
+
+@pytest.mark.parametrize("format", ["ndjson", "csv", "parquet"])
+def test_transfer_round_trips_a_database(tmp_path, format):
+    if format == "parquet":
+        pytest.importorskip("pyarrow")
+    user_id = client.post("/users", json={"username": f"dump{format}"}).json()["id"]
+    finish_game(user_id, "walls", 70)
+    finish_game(user_id, "pass-through", 90)
+    client.post("/games", json={"user_id": user_id, "game_mode": "walls"})
+
+    async def add_unrecorded_game():
+        # From before statuses were recorded, CSV must keep it None
+        async with active_session() as db:
+            await db.execute(
+                insert(Game).values(user_id=user_id, game_mode="walls", status=None)
+            )
+            await db.commit()
+
+    asyncio.run(add_unrecorded_game())
+
+    target = create_async_engine(
+        f"sqlite+aiosqlite:///{tmp_path / 'copy.db'}", poolclass=NullPool
+    )
+    copy = async_sessionmaker(bind=target, autoflush=False, expire_on_commit=False)
+
+    async def rows(session_factory):
+        async with session_factory() as db:
+
+            async def table(model, *where):
+                query = select(*model.__table__.columns).where(*where)
+                return sorted(tuple(row) for row in await db.execute(query))
+
+            return (
+                await table(User),
+                await table(Game),
+                await table(GameArchive),
+                # Derived, so rebuilt rather than copied
+                await table(UserStats, UserStats.user_id == user_id),
+                await table(ScoreRollup, ScoreRollup.user_id == user_id),
+            )
+
+    async def round_trip():
+        async with target.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        # Small chunks, so each table takes a few of them
+        exported = await transfer.export_dump(
+            active_session, str(tmp_path), format, chunk=3
+        )
+        imported = await transfer.import_dump(copy, str(tmp_path), format, chunk=3)
+        assert exported == imported
+        assert imported["games"] > 3
+        return await rows(active_session), await rows(copy)
+
+    try:
+        source, restored = asyncio.run(round_trip())
+    finally:
+        asyncio.run(target.dispose())
+    assert restored == source
+    assert len(restored[3]) == 2 and len(restored[4]) == 9
+
+
+def test_polled_lists_revalidate_with_etags():
+    user_id = client.post("/users", json={"username": "etaguser"}).json()["id"]
+    first = client.get("/players")
+    etag = first.headers["etag"]
+    assert first.headers["cache-control"] == "public, max-age=1"
+
+    # Unchanged: a conditional request gets an empty 304
+    unchanged = client.get("/players", headers={"If-None-Match": etag})
+    assert unchanged.status_code == 304
+    assert unchanged.content == b""
+    assert unchanged.headers["etag"] == etag
+
+    # Starting a game moves the version, so the list is built again
+    game_id = client.post(
+        "/games", json={"user_id": user_id, "game_mode": "walls"}
+    ).json()["id"]
+    changed = client.get("/players", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["etag"] != etag
+    assert game_id in [player["game_id"] for player in changed.json()]
+
+    # A finished game that makes the leaderboard is served right away
+    top = client.get("/leaderboard?limit=1")
+    client.put(f"/games/{game_id}/score", json={"score": 9_000_000})
+    client.put(f"/games/{game_id}/status", json={"status": "finished"})
+    response = client.get(
+        "/leaderboard?limit=1", headers={"If-None-Match": top.headers["etag"]}
+    )
+    assert response.status_code == 200
+    assert response.json() == [
+        {"id": user_id, "username": "etaguser", "score": 9_000_000}
+    ]
+
+
+def test_windowed_leaderboards_revalidate_at_midnight(monkeypatch):
+    user_id = client.post("/users", json={"username": "midnightuser"}).json()["id"]
+    finish_game(user_id, "walls", 8_500_000)
+    entry = {"id": user_id, "username": "midnightuser", "score": 8_500_000}
+    today = client.get("/leaderboard?window=today&limit=100")
+    assert entry in today.json()
+    etag = today.headers["etag"]
+    assert (
+        client.get(
+            "/leaderboard?window=today&limit=100", headers={"If-None-Match": etag}
+        ).status_code
+        == 304
+    )
+
+    # Nothing is written at midnight, yesterday's best is still not today's
+    tomorrow = datetime.utcnow() + timedelta(days=1)
+    monkeypatch.setattr(
+        "paging.datetime", type("Clock", (datetime,), {"utcnow": lambda: tomorrow})
+    )
+    response = client.get(
+        "/leaderboard?window=today&limit=100", headers={"If-None-Match": etag}
+    )
+    assert response.status_code == 200
+    assert entry not in response.json()
+    monkeypatch.undo()
+
+    # The backfill rebuilds what the leaderboards are read from
+    version = asyncio.run(state.version("leaderboard"))
+    asyncio.run(backfill(TestingSessionLocal))
+    assert asyncio.run(state.version("leaderboard")) > version
+
+
+def test_players_websocket_streams_updates():
+    user_response = client.post("/users", json={"username": "watcheduser"})
+    user_id = user_response.json()["id"]
+
+    with client.websocket_connect("/ws/players") as websocket:
+        snapshot = websocket.receive_json()
+        assert snapshot["type"] == "snapshot"
+        assert isinstance(snapshot["players"], list)
+
+        game_response = client.post(
+            "/games", json={"user_id": user_id, "game_mode": "walls"}
+        )
+        game_id = game_response.json()["id"]
+        event = websocket.receive_json()
+        assert event["type"] == "joined"
+        assert event["player"]["game_id"] == game_id
+        assert event["player"]["username"] == "watcheduser"
+
+        client.put(f"/games/{game_id}/score", json={"score": 40})
+        assert websocket.receive_json() == {
+            "type": "score",
+            "game_id": game_id,
+            "score": 40,
+        }
+
+        client.put(f"/games/{game_id}/status", json={"status": "finished"})
+        assert websocket.receive_json() == {
+            "type": "left",
+            "game_id": game_id,
+            "status": "finished",
+        }
+
+
+def test_player_feed_coalesces_slow_consumers():
+    async def scenario():
+        feed = PlayerFeed(buffer=2)
+        subscription = feed.subscribe()
+
+        # Updates to a game the consumer hasn't seen yet fold into its join
+        feed.joined({"game_id": 1, "score": 0})
+        feed.score_changed(1, 30)
+        # A game that joined and left may be in the consumer's snapshot, so
+        # only the left is kept
+        feed.joined({"game_id": 2, "score": 0})
+        feed.left(2, "finished")
+        assert await subscription.get() == [
+            {"type": "joined", "game_id": 1, "player": {"game_id": 1, "score": 30}},
+            {"type": "left", "game_id": 2, "status": "finished"},
+        ]
+
+        # Too many distinct games pending asks for a fresh snapshot
+        for game_id in range(3):
+            feed.score_changed(game_id, 10)
+        assert await subscription.get() is None
+
+    asyncio.run(scenario())
+
+
+def redis_states(count):
+    # Workers sharing one in-process Redis stand-in
+    import fakeredis
+
+    server = fakeredis.FakeServer()
+    return [
+        RedisState(
+            fakeredis.FakeAsyncRedis(server=server, decode_responses=True),
+            PlayerFeed(),
+            capacity=3,
+        )
+        for _ in range(count)
+    ]
+
+
+def test_state_backends_agree():
+    async def scenario(shared):
+        assert await shared.needs_seeding()
+        await shared.load_leaderboard([(1, "user1", 10), (2, "user2", 40)])
+        assert await shared.submit_score(3, "user3", 30)
+        assert not await shared.submit_score(2, "user2", 20)
+        assert await shared.submit_score(4, "user4", 20)
+        # Full: user 1 is evicted and a score below the last doesn't get in
+        assert not await shared.submit_score(5, "user5", 5)
+        assert await shared.top(10) == [
+            (2, "user2", 40),
+            (3, "user3", 30),
+            (4, "user4", 20),
+        ]
+        assert await shared.top(1, offset=1) == [(3, "user3", 30)]
+        # Keyset pages start right after the (score, user_id) they are given
+        assert await shared.top(2, after=(40, 2)) == [
+            (3, "user3", 30),
+            (4, "user4", 20),
+        ]
+        assert await shared.top(1, after=(30, 1)) == [(3, "user3", 30)]
+        # Any finished game may change a filtered leaderboard
+        version = await shared.version("leaderboard")
+        assert not await shared.submit_score(3, "user3", 25)
+        assert await shared.version("leaderboard") > version
+
+        def player(game_id, game_mode, score=0):
+            return {"game_id": game_id, "game_mode": game_mode, "score": score}
+
+        await shared.load_players([player(1, "walls")])
+        await shared.player_joined(player(2, "pass-through"))
+        await shared.player_joined(player(3, "walls"))
+        await shared.player_scores({1: 30, 2: 10})
+        assert await shared.players_page(2) == [
+            player(1, "walls", 30),
+            player(2, "pass-through", 10),
+        ]
+        assert await shared.players_page(5, after=(10, 2)) == [player(3, "walls")]
+        assert await shared.players_page(5, game_mode="walls") == [
+            player(1, "walls", 30),
+            player(3, "walls"),
+        ]
+        # The cursor's own game may have moved since, the page still starts
+        # where it was
+        await shared.player_scores({1: 5})
+        assert await shared.players_page(5, after=(30, 1), game_mode="walls") == [
+            player(1, "walls", 5),
+            player(3, "walls"),
+        ]
+
+        await shared.player_left(2, "finished")
+        await shared.player_left(3, "finished")
+        # A late score for a game that left doesn't bring it back
+        version = await shared.version("players")
+        await shared.player_scores({2: 50})
+        assert await shared.version("players") == version
+        assert await shared.players() == [player(1, "walls", 5)]
+        assert await shared.players_page(5, game_mode="pass-through") == []
+        await shared.stop()
+
+    asyncio.run(scenario(MemoryState(Leaderboard(capacity=3), PlayerFeed())))
+    asyncio.run(scenario(redis_states(1)[0]))
+
+
+def test_state_backends_track_last_seen():
+    async def scenario(shared):
+        await shared.track([1, 2], now=100.0)
+        await shared.track([3], "idle", now=50.0)
+        assert await shared.touch([2, 3, 4], now=200.0) == ["playing", "idle", None]
+        assert await shared.stale_games("playing", 150.0, 10) == [(1, 100.0)]
+        assert await shared.stale_games("idle", 300.0, 10) == [(3, 200.0)]
+
+        # Idle games keep the time they were last seen, finished ones go
+        await shared.players_left({1: "idle", 2: "finished"})
+        assert await shared.stale_games("playing", 1000.0, 10) == []
+        assert await shared.stale_games("idle", 1000.0, 1) == [(1, 100.0)]
+        assert await shared.touch([2], now=300.0) == [None]
+
+        await shared.player_joined(
+            {"game_id": 1, "game_mode": "walls", "score": 0, "status": "playing"}
+        )
+        assert await shared.touch([1], now=400.0) == ["playing"]
+        await shared.untrack([1, 3])
+        assert await shared.touch([1, 3]) == [None, None]
+        await shared.stop()
+
+    asyncio.run(scenario(MemoryState(Leaderboard(), PlayerFeed())))
+    asyncio.run(scenario(redis_states(1)[0]))
+
+
+def test_redis_state_is_shared_between_workers():
+    async def scenario():
+        first, second = redis_states(2)
+        await first.start()
+        await second.start()
+        subscription = second.feed.subscribe()
+        # Subscribing to the channel asks watchers for a snapshot
+        assert await subscription.get() is None
+
+        assert await first.needs_seeding()
+        assert not await second.needs_seeding()
+
+        await first.player_joined(
+            {"game_id": 7, "username": "remote", "score": 0, "game_mode": "walls"}
+        )
+        await first.player_scores({7: 20})
+        assert await asyncio.wait_for(subscription.get(), 1) == [
+            {
+                "type": "joined",
+                "game_id": 7,
+                "player": {
+                    "game_id": 7,
+                    "username": "remote",
+                    "score": 20,
+                    "game_mode": "walls",
+                },
+            }
+        ]
+        assert await second.players_page(10) == [
+            {"game_id": 7, "username": "remote", "score": 20, "game_mode": "walls"}
+        ]
+
+        await second.submit_score(7, "remote", 20)
+        assert await first.top(10) == [(7, "remote", 20)]
+        await first.stop()
+        await second.stop()
+
+    asyncio.run(scenario())
+
+
+def test_backfill_reloads_a_seeded_redis_state(monkeypatch):
+    user_id = client.post("/users", json={"username": "reloaduser"}).json()["id"]
+
+    async def scenario(shared):
+        # Seeded by a running app, before games came in behind its back, like
+        # from an import
+        assert await shared.needs_seeding()
+        async with active_session() as db:
+            await db.execute(
+                insert(Game).values(
+                    user_id=user_id, game_mode="walls", status="finished", score=4_500
+                )
+            )
+            await db.commit()
+        monkeypatch.setattr("rollups.state", shared)
+        await backfill(active_session)
+        assert (await shared.rank(user_id))[1] == 4_500
+        async with active_session() as db:
+            assert await shared.top(3) == await get_leaderboard_from_db(db, 3)
+        await shared.stop()
+
+    asyncio.run(scenario(redis_states(1)[0]))
+
+
+def test_migrations_match_models(tmp_path):
+    database = tmp_path / "migrated.db"
+    config = Config(os.path.join(os.path.dirname(__file__), "alembic.ini"))
+    config.set_main_option("sqlalchemy.url", f"sqlite:///{database}")
+    command.upgrade(config, "head")
+
+    inspector = inspect(create_engine(f"sqlite:///{database}"))
+    for table in Base.metadata.sorted_tables:
+        migrated = {index["name"] for index in inspector.get_indexes(table.name)}
+        assert migrated == {index.name for index in table.indexes}
+
+
+def test_migration_fills_the_all_time_rollups(tmp_path):
+    database = tmp_path / "upgraded.db"
+    config = Config(os.path.join(os.path.dirname(__file__), "alembic.ini"))
+    config.set_main_option("sqlalchemy.url", f"sqlite:///{database}")
+    command.upgrade(config, "0006")
+
+    played = datetime(2026, 1, 5)
+    games = [
+        (1, 1, 50, "walls", "finished", played),
+        (2, 1, 80, "pass-through", "finished", played),
+        (3, 1, 900, "walls", "playing", played),
+        (4, 2, 30, "walls", "finished", played),
+        (5, 2, 30, "walls", "rejected", played),
+    ]
+    migrated = create_engine(f"sqlite:///{database}")
+    with migrated.begin() as connection:
+        for id in (1, 2):
+            connection.execute(
+                User.__table__.insert().values(id=id, username=f"old{id}")
+            )
+        for table, rows in ((Game, games), (GameArchive, [(6, 2, 70, "walls")])):
+            for id, user_id, score, mode, *rest in rows:
+                status, created_at = rest or ("finished", played)
+                connection.execute(
+                    table.__table__.insert().values(
+                        id=id,
+                        user_id=user_id,
+                        score=score,
+                        game_mode=mode,
+                        status=status,
+                        created_at=created_at,
+                    )
+                )
+        # Written by the app since 0004, a better row stays
+        connection.execute(
+            ScoreRollup.__table__.insert().values(
+                period="all",
+                period_start=ALL_TIME,
+                game_mode="pass-through",
+                user_id=1,
+                best_score=100,
+                best_game_id=7,
+            )
+        )
+    command.upgrade(config, "head")
+
+    with migrated.connect() as connection:
+        rows = connection.execute(
+            select(
+                ScoreRollup.game_mode,
+                ScoreRollup.user_id,
+                ScoreRollup.best_score,
+                ScoreRollup.best_game_id,
+            ).where(ScoreRollup.period == "all", ScoreRollup.period_start == ALL_TIME)
+        )
+        assert set(rows) == {
+            ("walls", 1, 50, 1),
+            ("pass-through", 1, 100, 7),
+            (ANY_MODE, 1, 80, 2),
+            ("walls", 2, 70, 6),
+            (ANY_MODE, 2, 70, 6),
+        }
+    migrated.dispose()
+
+
 def test_health_check():
     response = client.get("/health")
     assert response.status_code == 200
@@ -131,6 +1313,582 @@ def test_health_check():
     assert data["status"] == "healthy"
 
 
+@contextmanager
+def count_statements():
+    # Records the SQL of every statement sent to any engine
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(Engine, "before_cursor_execute", record)
+    try:
+        yield statements
+    finally:
+        event.remove(Engine, "before_cursor_execute", record)
+
+
+def test_statements_per_request():
+    # Guards the single round trip writes against regressions
+    with count_statements() as statements:
+        user_id = client.post("/users", json={"username": "countuser"}).json()["id"]
+    assert len(statements) == 1  # INSERT ... ON CONFLICT DO NOTHING RETURNING
+
+    with count_statements() as statements:
+        game_response = client.post(
+            "/games", json={"user_id": user_id, "game_mode": "walls"}
+        )
+    game_id = game_response.json()["id"]
+    assert len(statements) == 2  # user check, INSERT ... RETURNING
+
+    with count_statements() as statements:
+        client.put(f"/games/{game_id}/score", json={"score": 10})
+    assert len(statements) == 1
+
+    with count_statements() as statements:
+        response = client.put(f"/games/{game_id}/status", json={"status": "finished"})
+    assert len(statements) == 3  # UPDATE ... RETURNING, rollup and stats upserts
+    assert response.json()["score"] == 10
+
+    with count_statements() as statements:
+        client.put("/games/999999/score", json={"score": 10})
+    assert len(statements) == 2  # UPDATE, then the lookup telling 404 from 409
+
+
+def test_db_pool_metrics():
+    response = client.get("/internal/metrics/db-pool")
+    assert response.status_code == 200
+    data = response.json()
+    assert data["wait_seconds"]["buckets"][-1]["le"] == "+Inf"
+    assert {"size", "checked_out", "overflow", "timeouts", "connects"} <= set(data)
+
+
+def test_metrics_are_served_per_route():
+    client.get("/health")
+    client.get("/leaderboard?game_mode=walls")
+    client.get("/no/such/path")
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    text = response.text
+    assert (
+        'snake_request_duration_seconds_bucket{route="/health",method="GET",le="+Inf"}'
+        in text
+    )
+    for part in ("db", "render", "handler"):
+        assert (
+            f'snake_request_seconds_total{{route="/leaderboard",method="GET",'
+            f'part="{part}"}}' in text
+        )
+    assert 'snake_request_statements_count{route="/leaderboard"' in text
+    # Unknown paths share one label
+    assert 'route="unmatched",method="GET",status="404"' in text
+    assert "/no/such/path" not in text
+
+
+def test_preflights_are_labelled_by_route():
+    for game_id in (11, 12):
+        response = client.options(
+            f"/games/{game_id}/score",
+            headers={
+                "Origin": "http://localhost:5173",
+                "Access-Control-Request-Method": "PUT",
+            },
+        )
+        assert response.status_code == 200
+
+    text = client.get("/metrics").text
+    series = [
+        line
+        for line in text.splitlines()
+        if line.startswith("snake_responses_total") and 'method="OPTIONS"' in line
+    ]
+    assert series == [
+        'snake_responses_total{route="/games/{game_id}/score",method="OPTIONS",'
+        'status="200"} 2'
+    ]
+    assert "/games/11/score" not in text and "/games/12/score" not in text
+
+
+def test_repeated_statements_count_as_n_plus_one():
+    metrics = RequestMetrics()
+    profile = RequestProfile()
+    profile.statements["SELECT 1"] = 2
+    metrics.observe("/a", "GET", 200, 0.5, profile)
+    assert not metrics.n_plus_one
+
+    profile.statements["SELECT users WHERE id = ?"] = 10
+    profile.db_seconds = 0.2
+    profile.render_seconds = 0.1
+    metrics.observe("/a", "GET", 200, 0.5, profile)
+    assert metrics.n_plus_one[("/a", "GET")] == 1
+    assert metrics.seconds[("/a", "GET", "handler")] == pytest.approx(0.5 + 0.2)
+    text = metrics.render()
+    assert 'snake_n_plus_one_total{route="/a",method="GET"} 1' in text
+    assert 'snake_request_statements_bucket{route="/a",method="GET",le="2"} 1' in text
+    assert 'snake_request_statements_bucket{route="/a",method="GET",le="25"} 2' in text
+
+
+def test_slow_requests_are_sampled(tmp_path):
+    def spin(seconds):
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            pass
+
+    async def slow_app(scope, receive, send):
+        spin(0.1)
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    async def receive():
+        return {"type": "http.request"}
+
+    async def send(message):
+        pass
+
+    metrics = RequestMetrics()
+    middleware = ProfilingMiddleware(
+        slow_app,
+        metrics,
+        StackSampler(interval=0.001),
+        profile_all=False,
+        allow_header=True,
+        threshold=0.05,
+        directory=str(tmp_path),
+    )
+    scope = {"type": "http", "method": "GET", "path": "/slow", "headers": []}
+    asyncio.run(middleware(scope, receive, send))
+    assert list(tmp_path.iterdir()) == []
+
+    scope["headers"] = [(b"x-profile", b"1")]
+    asyncio.run(middleware(scope, receive, send))
+    (profile,) = tmp_path.iterdir()
+    assert profile.name.endswith(".folded")
+    lines = profile.read_text().splitlines()
+    # Collapsed stacks: root first, the sampled frame last, then a count
+    assert any(".spin:" in line.rsplit(" ", 1)[0].split(";")[-1] for line in lines)
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+    # A bare app has no routes, so its requests are unmatched
+    assert sum(metrics.latency[("unmatched", "GET")].counts) == 2
+
+
+def test_worker_count_follows_cpu_quota(tmp_path, monkeypatch):
+    monkeypatch.delenv("WEB_CONCURRENCY", raising=False)
+    # Workers with state of their own would each serve their own lists
+    monkeypatch.setenv("STATE_BACKEND", "memory")
+    (tmp_path / "cpu.max").write_text("max 100000\n")
+    assert worker_count(str(tmp_path)) == 1
+
+    monkeypatch.setenv("STATE_BACKEND", "redis")
+    # The Fargate task's 256 CPU units still get a worker
+    (tmp_path / "cpu.max").write_text("25000 100000\n")
+    assert cpu_quota(str(tmp_path)) == 0.25
+    assert worker_count(str(tmp_path)) == 1
+    (tmp_path / "cpu.max").write_text("250000 100000\n")
+    assert worker_count(str(tmp_path)) == 2
+    (tmp_path / "cpu.max").write_text("max 100000\n")
+    assert cpu_quota(str(tmp_path)) is None
+    assert worker_count(str(tmp_path)) == (os.cpu_count() or 1)
+
+    # cgroup v1
+    (tmp_path / "cpu.max").unlink()
+    (tmp_path / "cpu").mkdir()
+    (tmp_path / "cpu" / "cpu.cfs_quota_us").write_text("300000\n")
+    (tmp_path / "cpu" / "cpu.cfs_period_us").write_text("100000\n")
+    assert worker_count(str(tmp_path)) == 3
+
+    monkeypatch.setenv("WEB_CONCURRENCY", "4")
+    assert worker_count(str(tmp_path)) == 4
+
+
+def test_warm_pool_opens_pooled_connections():
+    async def scenario():
+        pooled = create_async_engine(
+            SQLALCHEMY_DATABASE_URL, poolclass=AsyncAdaptedQueuePool, pool_size=3
+        )
+        try:
+            assert await warm_pool(pooled, 5) == 3
+            assert pooled.pool.checkedin() == 3
+        finally:
+            await pooled.dispose()
+        assert await warm_pool(engine) == 1
+
+    asyncio.run(scenario())
+
+
+def test_app_connects_in_its_lifespan_only(tmp_path):
+    # A fresh interpreter, as this one has loaded the app and the drivers
+    script = """
+import sys
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, inspect
+import main, models
+
+assert models._engine is None and "aiosqlite" not in sys.modules
+with TestClient(main.create_app()) as client:
+    assert client.get("/players").json() == []
+assert models._engine is not None
+tables = inspect(create_engine(sys.argv[1])).get_table_names()
+assert {"users", "games", "score_rollups"} <= set(tables), tables
+"""
+    url = f"sqlite:///{tmp_path / 'fresh.db'}"
+    env = {**os.environ, "DATABASE_URL": url, "DB_CREATE_SCHEMA": "true"}
+    subprocess.run(
+        [sys.executable, "-c", script, url],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+        check=True,
+        timeout=60,
+    )
+
+
+def test_instrumented_pool_records_waits(tmp_path, monkeypatch):
+    metrics = PoolMetrics()
+    monkeypatch.setattr("pool.pool_metrics", metrics)
+
+    async def run():
+        engine = create_async_engine(
+            f"sqlite+aiosqlite:///{tmp_path / 'pool.db'}",
+            poolclass=InstrumentedPool,
+            pool_size=1,
+            max_overflow=0,
+        )
+        metrics.attach(engine)
+        for _ in range(3):
+            async with engine.connect() as connection:
+                await connection.exec_driver_sql("SELECT 1")
+        snapshot = metrics.snapshot(engine.pool)
+        await engine.dispose()
+        return snapshot
+
+    snapshot = asyncio.run(run())
+    assert snapshot["checkouts"] == 3
+    assert snapshot["connects"] == 1  # the one pooled connection is reused
+    assert snapshot["wait_seconds"]["count"] == 3
+    assert snapshot["size"] == 1
+
+
+def test_engine_wraps_in_pass_through_and_dies_on_walls():
+    wrapping = SnakeGame("pass-through", seed=1)
+    walled = SnakeGame("walls", seed=1)
+    for _ in range(10):
+        assert wrapping.step()
+        assert walled.step() or walled.tick == 9
+    assert wrapping.snake()[0] == [0, 10]
+    assert walled.over and walled.tick == 9
+
+
+def test_engine_eats_grows_and_speeds_up():
+    game = SnakeGame("pass-through", seed=3)
+    eaten = 0
+    while eaten < 5:
+        # Steer straight at the food
+        head_x, head_y = game.snake()[0]
+        food_x, food_y = game.state()["food"]
+        if head_x != food_x:
+            game.turn(RIGHT if game.direction != LEFT else UP)
+        else:
+            game.turn(DOWN if game.direction != UP else RIGHT)
+        score = game.score
+        assert game.step()
+        eaten += game.score > score
+    assert game.score == 50
+    assert len(game.snake()) == 6
+    assert game.speed == 140
+
+
+def test_engine_self_collision_and_reversing():
+    game = SnakeGame("pass-through", seed=0)
+    assert not game.turn(LEFT)  # straight back into itself
+    # A snake of five cells turning in a tight square bites its own body
+    game.length = 5
+    for cell, index in zip(range(206, 211), range(-4, 1)):
+        game.body[index % game.cells] = cell
+        game.occupied[cell >> 3] |= 1 << (cell & 7)
+    game.head = 0
+    for direction in (DOWN, LEFT, UP):
+        game.turn(direction)
+        game.step()
+    assert game.over
+
+
+def test_engine_is_deterministic_and_ring_buffer_wraps():
+    first = SnakeGame("pass-through", seed=42)
+    second = SnakeGame("pass-through", seed=42)
+    for tick in range(5000):
+        if tick % 7 == 0:
+            first.turn(tick % 4)
+            second.turn(tick % 4)
+        first.step()
+        second.step()
+    assert first.state() == second.state()
+    # Every body cell is marked taken and nothing else is
+    snake = {y * first.size + x for x, y in first.snake()}
+    assert len(snake) == first.length
+    assert all(
+        first.is_occupied(cell) == (cell in snake) for cell in range(first.cells)
+    )
+
+
+def test_simulated_game_keeps_the_score(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(arena, "clock", lambda: now[0])
+    user_id = client.post("/users", json={"username": "simuser"}).json()["id"]
+    game_id = client.post(
+        "/games", json={"user_id": user_id, "game_mode": "walls", "simulated": True}
+    ).json()["id"]
+
+    state = client.get(f"/games/{game_id}/state").json()
+    assert state["tick"] == 0 and state["snake"] == [[10, 10]]
+
+    now[0] = 0.3
+    state = client.post(f"/games/{game_id}/input", json={"direction": "UP"}).json()
+    assert state["tick"] == 2 and state["snake"][0] == [12, 10]
+
+    response = client.put(f"/games/{game_id}/score", json={"score": 1000})
+    assert response.status_code == 409
+
+    # Far past the top wall, the game finishes on its own
+    now[0] = 60
+    state = client.get(f"/games/{game_id}/state").json()
+    assert state["over"]
+    assert client.get(f"/games/{game_id}/state").status_code == 404
+    players = client.get("/players").json()
+    assert all(player["game_id"] != game_id for player in players)
+
+
+def play_recorded(mode, seed, ticks):
+    """Chase the food for a while, returns the game and its inputs"""
+    game = SnakeGame(mode, seed)
+    inputs = []
+    while game.tick < ticks:
+        (head_x, head_y), food = game.snake()[0], game.state()["food"]
+        if head_x < food[0]:
+            wanted = RIGHT
+        elif head_x > food[0]:
+            wanted = LEFT
+        else:
+            wanted = DOWN if head_y < food[1] else UP
+        if wanted == (game.direction + 2) % 4:
+            # Can't reverse, swing around sideways first
+            wanted = (wanted + 1) % 4
+        if wanted != game.direction and game.turn(wanted):
+            inputs.append((game.tick, wanted))
+        if not game.step():
+            break
+    return game, inputs
+
+
+def test_replay_reproduces_the_score():
+    game, inputs = play_recorded("walls", 7, 2000)
+    assert game.score > 0
+    data = encode_inputs(inputs)
+    assert decode_inputs(data) == inputs
+    assert len(data) < 2 * len(inputs)
+    assert replay_score("walls", 7, game.tick, inputs) == game.score
+    # The same inputs with other food don't add up to the same game
+    assert replay_score("walls", 8, game.tick, inputs) != game.score
+
+
+def test_replay_rejects_malformed_inputs():
+    for data, max_tick in ((b"\x80", 100), (encode_inputs([(500, UP)]), 100)):
+        try:
+            decode_inputs(data, max_tick)
+        except ReplayError:
+            continue
+        raise AssertionError(f"{data!r} decoded")
+
+
+def test_finish_with_replay():
+    user_id = client.post("/users", json={"username": "replayuser"}).json()["id"]
+    game, inputs = play_recorded("pass-through", 11, 600)
+    replay = {
+        "seed": 11,
+        "ticks": game.tick,
+        "inputs": base64.b64encode(encode_inputs(inputs)).decode(),
+    }
+
+    honest, cheat = (
+        client.post(
+            "/games", json={"user_id": user_id, "game_mode": "pass-through"}
+        ).json()["id"]
+        for _ in range(2)
+    )
+    client.put(f"/games/{honest}/score", json={"score": game.score})
+    client.put(f"/games/{cheat}/score", json={"score": game.score + 500})
+    response = client.put(
+        f"/games/{honest}/status", json={"status": "finished", "replay": replay}
+    )
+    assert response.json()["status"] == "finished"
+    response = client.put(
+        f"/games/{cheat}/status", json={"status": "finished", "replay": replay}
+    )
+    assert response.json()["status"] == "rejected"
+    assert response.json()["score"] == game.score + 500
+
+    entries = client.get("/leaderboard", params={"limit": 100}).json()
+    assert {"id": user_id, "username": "replayuser", "score": game.score} in entries
+
+    response = client.put(
+        f"/games/{cheat}/status",
+        json={"status": "finished", "replay": {**replay, "inputs": "not base64!"}},
+    )
+    assert response.status_code == 400
+
+    # The last batch still on its way, or buffered by another worker: the
+    # score sent with the replay is the one checked and kept
+    late, inflated = (
+        client.post(
+            "/games", json={"user_id": user_id, "game_mode": "pass-through"}
+        ).json()["id"]
+        for _ in range(2)
+    )
+    client.post(
+        "/games/scores:batch", json={"scores": [{"game_id": late, "score": 10}]}
+    )
+    score_buffer.take(late)
+    response = client.put(
+        f"/games/{late}/status",
+        json={"status": "finished", "replay": {**replay, "score": game.score}},
+    )
+    assert response.json()["status"] == "finished"
+    assert response.json()["score"] == game.score
+    response = client.post(
+        "/games/scores:batch", json={"scores": [{"game_id": late, "score": 10}]}
+    )
+    assert response.json() == {"accepted": 0}
+    response = client.put(
+        f"/games/{inflated}/status",
+        json={"status": "finished", "replay": {**replay, "score": game.score + 10}},
+    )
+    assert response.json()["status"] == "rejected"
+
+
+def test_finished_games_are_final():
+    user_id = client.post("/users", json={"username": "finaluser"}).json()["id"]
+    game_id, cheat = (
+        client.post(
+            "/games", json={"user_id": user_id, "game_mode": "pass-through"}
+        ).json()["id"]
+        for _ in range(2)
+    )
+    replay = {"seed": 3, "ticks": 0, "inputs": ""}
+    response = client.put(
+        f"/games/{game_id}/status", json={"status": "finished", "replay": replay}
+    )
+    assert response.json()["status"] == "finished"
+
+    # Neither a score nor another status gets past a verified finish
+    response = client.put(f"/games/{game_id}/score", json={"score": 999_999})
+    assert response.status_code == 409
+    response = client.put(f"/games/{game_id}/status", json={"status": "playing"})
+    assert response.status_code == 409
+
+    # Nor past a rejection, with or without a replay
+    client.put(f"/games/{cheat}/score", json={"score": 999_999})
+    response = client.put(
+        f"/games/{cheat}/status", json={"status": "finished", "replay": replay}
+    )
+    assert response.json()["status"] == "rejected"
+    for update in ({"status": "finished"}, {"status": "finished", "replay": replay}):
+        response = client.put(f"/games/{cheat}/status", json=update)
+        assert response.status_code == 409
+
+    response = client.put(f"/games/{cheat}/status", json={"status": "bogus"})
+    assert response.status_code == 422
+    assert client.get(f"/users/{user_id}/rank").json()["score"] == 0
+    assert client.get(f"/users/{user_id}/stats").json()["best_score"] == 0
+
+
+def apply_frames(frames, body=None, food=None):
+    """Rebuild a board from frames the way a spectator does"""
+    for frame in frames:
+        if frame[0] == KEYFRAME:
+            _, _, _, _, food, length = KEYFRAME_HEADER.unpack_from(frame)
+            body = deque(struct.unpack_from(f"<{length}H", frame, KEYFRAME_HEADER.size))
+        elif frame[0] == DELTA:
+            _, _, _, flags, head = DELTA_HEADER.unpack_from(frame)
+            body.appendleft(head)
+            if flags & TAIL_REMOVED:
+                body.pop()
+            if flags & FOOD_MOVED:
+                food = CELL.unpack_from(frame, DELTA_HEADER.size)[0]
+    return body, food
+
+
+def test_delta_frames_rebuild_the_board():
+    game = SnakeGame("pass-through", 5)
+    encoder = FrameEncoder(keyframe_interval=20)
+    frames = [encoder.encode(game)]
+    turns = dict(play_recorded("pass-through", 5, 300)[1])
+    body, food = apply_frames(frames)
+    while game.tick < 300 and not game.over:
+        if game.tick in turns:
+            game.turn(turns[game.tick])
+        game.step()
+        frame = encoder.encode(game)
+        body, food = apply_frames([frame], body, food)
+        if frame[0] == DELTA:
+            assert len(frame) <= DELTA_HEADER.size + CELL.size
+        if not game.over:
+            assert list(body) == [y * 20 + x for x, y in game.snake()]
+            assert food == game.food
+    assert game.score > 0
+
+
+def test_frames_fan_out_as_the_same_bytes():
+    async def run():
+        broadcaster = Broadcaster(buffer=4)
+        game = SnakeGame("pass-through", seed=1)
+        broadcaster.subscribe(7)
+        # Deltas before the first keyframe can't be used by anybody
+        broadcaster.publish(7, encode_delta(1, 0, 1, True, None))
+        broadcaster.publish_game(7, game)
+        first, second = broadcaster.subscribe(7), broadcaster.subscribe(7)
+        delta = encode_delta(2, 0, 2, True, None)
+        broadcaster.publish(7, delta)
+        first_frames, second_frames = await first.get(), await second.get()
+        assert [frame[0] for frame in first_frames] == [KEYFRAME, DELTA]
+        assert first_frames[1] is delta and second_frames[1] is delta
+
+        # A spectator that falls behind skips ahead to the next keyframe
+        for tick in range(3, 10):
+            broadcaster.publish(7, encode_delta(tick, 0, tick, True, None))
+        assert not first.frames and first.waiting_for_keyframe
+        keyframe = encode_keyframe(game)
+        broadcaster.publish(7, keyframe)
+        assert await first.get() == [keyframe]
+        assert (await second.get())[0] is keyframe
+        broadcaster.publish(7, encode_end(10, 0))
+        assert (await first.get())[-1][0] == END
+        assert await first.get() == []
+
+    asyncio.run(run())
+
+
+def test_spectators_receive_published_frames():
+    user_id = client.post("/users", json={"username": "streamer"}).json()["id"]
+    game_id = client.post(
+        "/games", json={"user_id": user_id, "game_mode": "walls"}
+    ).json()["id"]
+    game = SnakeGame("walls", seed=2)
+    encoder = FrameEncoder()
+    keyframe = encoder.encode(game)
+    game.step()
+    delta = encoder.encode(game)
+
+    with client.websocket_connect(f"/ws/games/{game_id}/play") as player:
+        player.send_bytes(keyframe)
+        with client.websocket_connect(f"/ws/games/{game_id}/watch") as watcher:
+            assert watcher.receive_bytes() == keyframe
+            player.send_bytes(b"not a frame")
+            player.send_bytes(delta)
+            assert watcher.receive_bytes() == delta
+            player.close()
+            assert watcher.receive_bytes() == encode_end(game.tick, game.score)
+
+
 # Test error cases
 def test_game_not_found():
     response = client.put("/games/999/score", json={"score": 100})
@@ -0,0 +1,387 @@
+"""
+Bulk export and import of users and games
+
+Dumps game history for analytics, and restores it to seed staging:
+
+    uv run python transfer.py export dump/ --format ndjson
+    uv run python transfer.py import dump/
+
+Export reads each table through a server-side cursor, TRANSFER_CHUNK rows at
+a time, so memory stays flat however big the table is. NDJSON and CSV are
+written as the rows arrive, Parquet (with the parquet extra installed) as one
+row group per chunk. Import reads the files back in chunks of the same size,
+with COPY on Postgres and executemany INSERTs elsewhere, into a database that
+doesn't hold those ids yet. Ids are kept, so the id sequences are moved past
+them afterwards, and the score rollups and user stats, which are derived from
+the games, are rebuilt. The rebuild loads the leaderboard and ranks into a
+redis state, memory workers seed theirs when they start, so restart those
+afterwards. Both directions report their rows and
+rows per second as they go. Archived games are a table of their own, loaded
+into whichever monthly partitions they belong in.
+
+GET /admin/export/{table} streams the same NDJSON or CSV over HTTP to the
+holder of ADMIN_TOKEN.
+"""
+
+import argparse
+import asyncio
+import csv
+import io
+import os
+import sys
+import time
+from datetime import datetime
+from operator import itemgetter
+from typing import AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple
+
+import orjson
+from sqlalchemy import Table, insert, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from archive import ensure_partitions
+from models import Game, GameArchive, SessionLocal, User, get_engine
+from rollups import backfill as backfill_rollups
+from state import state
+from stats import backfill as backfill_stats
+
+# Rows per cursor fetch, file write and import batch
+TRANSFER_CHUNK = int(os.getenv("TRANSFER_CHUNK", 10000))
+# Seconds between progress reports
+PROGRESS_INTERVAL = 2.0
+
+# In the order they're imported, users before the games that refer to them
+TABLES: Dict[str, Table] = {
+    "users": User.__table__,
+    "games": Game.__table__,
+    "games_archive": GameArchive.__table__,
+}
+# Tables whose ids come from a table's sequence
+SEQUENCES = {"users": ["users"], "games": ["games", "games_archive"]}
+FORMATS = ("ndjson", "csv", "parquet")
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+class Progress:
+    """Rows moved so far, reported every PROGRESS_INTERVAL seconds"""
+
+    def __init__(self, label: str, out=sys.stderr, clock=time.perf_counter):
+        self.label = label
+        self.out = out
+        self.clock = clock
+        self.rows = 0
+        self.started = clock()
+        self._reported = self.started
+
+    def add(self, rows: int) -> None:
+        self.rows += rows
+        if self.clock() - self._reported >= PROGRESS_INTERVAL:
+            self.report()
+
+    def report(self) -> None:
+        self._reported = self.clock()
+        elapsed = max(self._reported - self.started, 1e-9)
+        print(
+            f"{self.label}: {self.rows:,} rows, {self.rows / elapsed:,.0f} rows/s",
+            file=self.out,
+        )
+
+
+def column_names(table: Table) -> List[str]:
+    return [column.name for column in table.columns]
+
+
+async def stream_rows(
+    db: AsyncSession, table: Table, chunk: int = TRANSFER_CHUNK
+) -> AsyncIterator[List[Tuple]]:
+    """Every row of a table in id order, chunk by chunk off a server-side cursor"""
+    result = await db.stream(
+        select(*table.columns).order_by(table.c.id).execution_options(yield_per=chunk)
+    )
+    async for rows in result.partitions():
+        yield [tuple(row) for row in rows]
+
+
+def encode_ndjson(columns: List[str], rows: List[Tuple]) -> bytes:
+    return b"".join(
+        orjson.dumps(dict(zip(columns, row)), option=orjson.OPT_APPEND_NEWLINE)
+        for row in rows
+    )
+
+
+def encode_csv(columns: List[str], rows: List[Tuple], header: bool) -> bytes:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(columns)
+    # None is written as an empty field
+    writer.writerows(
+        [value.isoformat() if isinstance(value, datetime) else value for value in row]
+        for row in rows
+    )
+    return buffer.getvalue().encode()
+
+
+def encode(format: str, columns: List[str], rows: List[Tuple], header: bool) -> bytes:
+    if format == "csv":
+        return encode_csv(columns, rows, header)
+    return encode_ndjson(columns, rows)
+
+
+async def export_stream(
+    db: AsyncSession,
+    table: Table,
+    format: str,
+    chunk: int = TRANSFER_CHUNK,
+    progress: Optional[Progress] = None,
+) -> AsyncIterator[bytes]:
+    """A table encoded as NDJSON or CSV, a chunk of rows at a time"""
+    columns = column_names(table)
+    header = True
+    async for rows in stream_rows(db, table, chunk):
+        yield encode(format, columns, rows, header)
+        header = False
+        if progress:
+            progress.add(len(rows))
+    if format == "csv" and header:
+        # An empty table still names its columns
+        yield encode_csv(columns, [], header)
+
+
+def parquet_schema(table: Table):
+    import pyarrow
+
+    types = {
+        int: pyarrow.int64(),
+        str: pyarrow.string(),
+        datetime: pyarrow.timestamp("us"),
+    }
+    return pyarrow.schema(
+        [(column.name, types[column.type.python_type]) for column in table.columns]
+    )
+
+
+async def export_parquet(
+    db: AsyncSession, table: Table, path: str, chunk: int, progress: Progress
+) -> None:
+    # Only needed for Parquet, which the parquet extra installs
+    import pyarrow
+    import pyarrow.parquet
+
+    schema = parquet_schema(table)
+    with pyarrow.parquet.ParquetWriter(path, schema) as writer:
+        async for rows in stream_rows(db, table, chunk):
+            values = zip(*rows)
+            batch = pyarrow.record_batch(
+                [
+                    pyarrow.array(column, field.type)
+                    for column, field in zip(values, schema)
+                ],
+                schema=schema,
+            )
+            # Encoding and writing the row group is blocking, it gets a thread
+            await asyncio.to_thread(writer.write_batch, batch)
+            progress.add(len(rows))
+
+
+async def export_table(
+    session_factory, table: Table, path: str, format: str, chunk: int = TRANSFER_CHUNK
+) -> int:
+    """Write a table to a file, returns the rows written"""
+    progress = Progress(f"export {table.name}")
+    async with session_factory() as db:
+        if format == "parquet":
+            await export_parquet(db, table, path, chunk, progress)
+        else:
+            # File writes go to a thread, off the event loop
+            output = await asyncio.to_thread(open, path, "wb")
+            try:
+                async for data in export_stream(db, table, format, chunk, progress):
+                    await asyncio.to_thread(output.write, data)
+            finally:
+                await asyncio.to_thread(output.close)
+    progress.report()
+    return progress.rows
+
+
+def parse_datetime(value):
+    return None if value in (None, "") else datetime.fromisoformat(value)
+
+
+def parse_int(value):
+    return None if value == "" else int(value)
+
+
+def parse_text(value):
+    return None if value == "" else value
+
+
+def conversions(table: Table, format: str) -> List[Tuple[int, Callable]]:
+    """(index, parser) of the columns a file's values must be parsed for"""
+    parsers = {datetime: parse_datetime}
+    if format == "csv":
+        # Where everything is text, and None an empty field. Text that can't
+        # be None is kept as it is, empty or not
+        parsers[int] = parse_int
+        parsers[str] = parse_text
+    return [
+        (index, parsers[column.type.python_type])
+        for index, column in enumerate(table.columns)
+        if column.type.python_type in parsers
+        and (column.type.python_type is not str or column.nullable)
+    ]
+
+
+def read_chunks(
+    path: str, table: Table, format: str, chunk: int = TRANSFER_CHUNK
+) -> Iterator[List[Tuple]]:
+    """Rows of a table's file, chunk by chunk, in its columns' order"""
+    columns = column_names(table)
+
+    if format == "parquet":
+        import pyarrow.parquet
+
+        # Parquet keeps the types, a batch only needs turning into rows
+        for batch in pyarrow.parquet.ParquetFile(path).iter_batches(
+            batch_size=chunk, columns=columns
+        ):
+            values = batch.to_pydict()
+            yield list(zip(*(values[name] for name in columns)))
+        return
+
+    parse = conversions(table, format)
+    with open(path, newline="" if format == "csv" else None) as source:
+        if format == "csv":
+            reader = csv.reader(source)
+            header = next(reader, columns)
+            pick = itemgetter(*(header.index(name) for name in columns))
+            records = (pick(values) for values in reader)
+        else:
+            pick = itemgetter(*columns)
+            records = (pick(orjson.loads(line)) for line in source if line.strip())
+        rows = []
+        for values in records:
+            if parse:
+                values = list(values)
+                for index, parser in parse:
+                    values[index] = parser(values[index])
+            rows.append(tuple(values))
+            if len(rows) == chunk:
+                yield rows
+                rows = []
+        if rows:
+            yield rows
+
+
+async def load_rows(db: AsyncSession, table: Table, rows: List[Tuple]) -> None:
+    """Insert rows in one round trip, with COPY on Postgres"""
+    columns = column_names(table)
+    if table is GameArchive.__table__:
+        created_at = columns.index("created_at")
+        await ensure_partitions(db, [row[created_at] for row in rows])
+    if db.bind.dialect.name == "postgresql":
+        connection = await db.connection()
+        raw = await connection.get_raw_connection()
+        await raw.driver_connection.copy_records_to_table(
+            table.name, records=rows, columns=columns
+        )
+    else:
+        await db.execute(insert(table), [dict(zip(columns, row)) for row in rows])
+
+
+async def import_table(
+    session_factory, table: Table, path: str, format: str, chunk: int = TRANSFER_CHUNK
+) -> int:
+    """Load a table's file, a transaction per chunk, returns the rows loaded"""
+    progress = Progress(f"import {table.name}")
+    async with session_factory() as db:
+        for rows in read_chunks(path, table, format, chunk):
+            await load_rows(db, table, rows)
+            await db.commit()
+            progress.add(len(rows))
+    progress.report()
+    return progress.rows
+
+
+async def restart_sequences(db: AsyncSession) -> None:
+    """Move Postgres id sequences past the imported ids"""
+    if db.bind.dialect.name != "postgresql":
+        return
+    for owner, tables in SEQUENCES.items():
+        ids = " UNION ALL ".join(f"SELECT MAX(id) AS id FROM {name}" for name in tables)
+        await db.execute(
+            text(
+                f"SELECT setval(pg_get_serial_sequence('{owner}', 'id'), "
+                f"COALESCE((SELECT MAX(id) FROM ({ids}) ids), 0) + 1, false)"
+            )
+        )
+    await db.commit()
+
+
+def dump_path(directory: str, name: str, format: str) -> str:
+    return os.path.join(directory, f"{name}.{format}")
+
+
+async def export_dump(
+    session_factory,
+    directory: str,
+    format: str,
+    names: Optional[List[str]] = None,
+    chunk: int = TRANSFER_CHUNK,
+) -> Dict[str, int]:
+    """Write tables to a file each, returns the rows written per table"""
+    os.makedirs(directory, exist_ok=True)
+    counts = {}
+    for name in names or TABLES:
+        path = dump_path(directory, name, format)
+        counts[name] = await export_table(
+            session_factory, TABLES[name], path, format, chunk
+        )
+    return counts
+
+
+async def import_dump(
+    session_factory,
+    directory: str,
+    format: str,
+    names: Optional[List[str]] = None,
+    chunk: int = TRANSFER_CHUNK,
+) -> Dict[str, int]:
+    """Load tables from their files, then rebuild what's derived from the games"""
+    names = [name for name in TABLES if name in (names or TABLES)]
+    counts = {}
+    for name in names:
+        path = dump_path(directory, name, format)
+        counts[name] = await import_table(
+            session_factory, TABLES[name], path, format, chunk
+        )
+    async with session_factory() as db:
+        await restart_sequences(db)
+    if {"games", "games_archive"} & set(names):
+        print(f"Rolled up {await backfill_rollups(session_factory)} finished games")
+        print(f"Counted {await backfill_stats(session_factory)} games in user stats")
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export or import users and games")
+    parser.add_argument("command", choices=["export", "import"])
+    parser.add_argument("directory", help="holds one file per table")
+    parser.add_argument("--format", choices=FORMATS, default="ndjson")
+    parser.add_argument("--tables", nargs="+", choices=list(TABLES))
+    parser.add_argument("--chunk", type=int, default=TRANSFER_CHUNK, help="rows")
+    args = parser.parse_args()
+
+    async def run():
+        transfer = export_dump if args.command == "export" else import_dump
+        await transfer(
+            SessionLocal, args.directory, args.format, args.tables, args.chunk
+        )
+        await get_engine().dispose()
+        # The import's rebuilds moved the leaderboard's version on
+        await state.stop()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
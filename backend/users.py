@@ -0,0 +1,95 @@
+"""
+Process-local cache of username to user
+
+Returning players log in on every page load, so POST /login looks the name
+up here before touching the database. Names that were just looked up and
+not found are remembered for a short while too, which lets a burst of logins
+for a new name go straight to the insert instead of each running a SELECT
+first. Concurrent misses for the same name share one database round trip.
+Usernames and ids never change, so entries only expire to bound staleness
+across workers and keep memory in check.
+"""
+
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Dict, List, Tuple, Union
+
+# Usernames kept in memory per worker
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", 10000))
+# Seconds a known user stays cached
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", 300))
+# Seconds a name that was not found stays cached as missing
+USER_CACHE_NEGATIVE_TTL = float(os.getenv("USER_CACHE_NEGATIVE_TTL", 5))
+
+# Marks a name that was looked up and not found
+MISSING = object()
+
+
+class UserCache:
+    """Bounded LRU of username -> (user_id, username) with expiry"""
+
+    def __init__(
+        self,
+        size: int = USER_CACHE_SIZE,
+        ttl: float = USER_CACHE_TTL,
+        negative_ttl: float = USER_CACHE_NEGATIVE_TTL,
+        clock=time.monotonic,
+    ):
+        self.size = size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.clock = clock
+        self._entries: OrderedDict[str, Tuple[float, object]] = OrderedDict()
+        # Name -> [lock, number of requests holding or waiting for it]
+        self._locks: Dict[str, List] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, username: str) -> Union[Tuple[int, str], object, None]:
+        """Return the cached user, MISSING, or None when the name is unknown"""
+        entry = self._entries.get(username)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires <= self.clock():
+            del self._entries[username]
+            return None
+        self._entries.move_to_end(username)
+        return value
+
+    def put(self, user_id: int, username: str) -> None:
+        self._store(username, (user_id, username), self.ttl)
+
+    def put_missing(self, username: str) -> None:
+        self._store(username, MISSING, self.negative_ttl)
+
+    def _store(self, username: str, value: object, ttl: float) -> None:
+        self._entries[username] = (self.clock() + ttl, value)
+        self._entries.move_to_end(username)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    @asynccontextmanager
+    async def lock(self, username: str):
+        """Serialize lookups and creates of one name within this worker"""
+        holder = self._locks.get(username)
+        if holder is None:
+            holder = self._locks[username] = [asyncio.Lock(), 0]
+        holder[1] += 1
+        try:
+            async with holder[0]:
+                yield
+        finally:
+            holder[1] -= 1
+            if not holder[1]:
+                del self._locks[username]
+
+
+user_cache = UserCache()
@@ -8,6 +8,7 @@ from aws_cdk import (
     aws_ecs as ecs,
     aws_ecs_patterns as ecs_patterns,
     aws_ec2 as ec2,
+    aws_elasticache as elasticache,
     aws_elasticloadbalancingv2 as elbv2,
     aws_rds as rds,
     aws_s3 as s3,
@@ -58,6 +59,26 @@ class SnakeGameBackendStack(Stack):
             removal_policy=None,  # Set to DESTROY to allow stack deletion
         )
 
+        # Create Redis for the state shared by every backend task
+        cache_security_group = ec2.SecurityGroup(
+            self, "SnakeGameCacheSecurityGroup", vpc=vpc
+        )
+        cache_subnet_group = elasticache.CfnSubnetGroup(
+            self,
+            "SnakeGameCacheSubnetGroup",
+            description="Private subnets of the snake game cache",
+            subnet_ids=[subnet.subnet_id for subnet in vpc.private_subnets],
+        )
+        cache = elasticache.CfnCacheCluster(
+            self,
+            "SnakeGameCache",
+            engine="redis",
+            cache_node_type="cache.t3.micro",
+            num_cache_nodes=1,
+            cache_subnet_group_name=cache_subnet_group.ref,
+            vpc_security_group_ids=[cache_security_group.security_group_id],
+        )
+
         # Create S3 Bucket for static assets (if needed)
         bucket = s3.Bucket(
             self,
@@ -76,7 +97,15 @@ class SnakeGameBackendStack(Stack):
             "BackendContainer",
             image=ecs.ContainerImage.from_asset("./backend"),
             environment={
-                "DATABASE_URL": f"postgresql://admin:admin@{database.db_instance_endpoint.hostname}:{database.db_instance_endpoint.port}/snake_game"
+                "DATABASE_URL": f"postgresql://admin:admin@{database.db_instance_endpoint.hostname}:{database.db_instance_endpoint.port}/snake_game",
+                # Leaves room for scaling out within the ~85 connections of a t2.micro
+                "DB_POOL_SIZE": "5",
+                "DB_MAX_OVERFLOW": "5",
+                "DB_POOL_PRE_PING": "true",
+                "DB_POOL_RECYCLE": "1800",
+                # Tasks share the leaderboard and live players through Redis
+                "STATE_BACKEND": "redis",
+                "REDIS_URL": f"redis://{cache.attr_redis_endpoint_address}:{cache.attr_redis_endpoint_port}/0",
             },
             logging=ecs.LogDriver.aws_logs(stream_prefix="snake-game-backend"),
         )
@@ -97,6 +126,7 @@ class SnakeGameBackendStack(Stack):
 
         # Allow connections to database
         database.connections.allow_from(service, ec2.Port.tcp(5432))
+        cache_security_group.connections.allow_from(service, ec2.Port.tcp(6379))
 
         # Create load balancer
         load_balancer = elbv2.ApplicationLoadBalancer(
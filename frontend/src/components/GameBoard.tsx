@@ -1,14 +1,17 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { useUser } from '../context/UserContext';
 import { gameAPI } from '../services/api';
+import { Direction, encodeInputs, newSeed, nextRandom, Replay } from '../services/replay';
+import { encodeDelta, encodeEnd, encodeKeyframe, KEYFRAME_INTERVAL } from '../services/frames';
 
 // Game constants
 const GRID_SIZE = 20;
 const CELL_SIZE = 20;
 const INITIAL_SPEED = 150;
+// Well inside the backend's GAME_IDLE_TIMEOUT
+const HEARTBEAT_INTERVAL = 20000;
 
 // Types
-type Direction = 'UP' | 'DOWN' | 'LEFT' | 'RIGHT';
 type Position = { x: number; y: number };
 type GameMode = 'pass-through' | 'walls';
 
@@ -22,8 +25,21 @@ interface GameState {
   isPlaying: boolean;
   isGameOver: boolean;
   speed: number;
+  // Everything the backend needs to replay the game and check the score
+  seed: number;
+  randomState: number;
+  tick: number;
+  inputs: [number, Direction][];
 }
 
+const replayOf = (state: GameState): Replay => ({
+  seed: state.seed,
+  ticks: state.tick,
+  inputs: encodeInputs(state.inputs),
+  // Sent along, queued score batches may still be on their way
+  score: state.score,
+});
+
 const GameBoard: React.FC = () => {
   const { currentUser } = useUser();
   const [gameState, setGameState] = useState<GameState>({
@@ -36,25 +52,40 @@ const GameBoard: React.FC = () => {
     isPlaying: false,
     isGameOver: false,
     speed: INITIAL_SPEED,
+    seed: 0,
+    randomState: 0,
+    tick: 0,
+    inputs: [],
   });
   
   const [gameId, setGameId] = useState<number | null>(null);
-
-  // Generate random food position that doesn't overlap with snake
-  const generateFood = (snake: Position[]): Position => {
-    let newFood: Position;
-    let attempts = 0;
-    do {
-      newFood = {
-        x: Math.floor(Math.random() * GRID_SIZE),
-        y: Math.floor(Math.random() * GRID_SIZE),
-      };
-      attempts++;
-    } while (
-      snake.some(segment => segment.x === newFood.x && segment.y === newFood.y) &&
-      attempts < 100 // Prevent infinite loop
-    );
-    return newFood;
+  const socketRef = useRef<WebSocket | null>(null);
+  // The board as spectators last saw it, so only what changed is sent
+  const sentRef = useRef<{ tick: number; length: number; food: Position } | null>(null);
+
+  // Generate a seeded food position that doesn't overlap with snake,
+  // returns it with the generator's next state
+  const generateFood = (snake: Position[], randomState: number): [Position, number] => {
+    const taken = (position: Position) =>
+      snake.some(segment => segment.x === position.x && segment.y === position.y);
+    let newFood: Position = { x: 0, y: 0 };
+    let x: number;
+    let y: number;
+    for (let attempts = 0; attempts < 100; attempts++) {
+      // x first, then y, in the same order as the backend
+      [x, randomState] = nextRandom(randomState);
+      [y, randomState] = nextRandom(randomState);
+      newFood = { x: Math.floor(x * GRID_SIZE), y: Math.floor(y * GRID_SIZE) };
+      if (!taken(newFood)) return [newFood, randomState];
+    }
+    // A crowded board: take the first free cell after the last draw
+    const last = newFood.y * GRID_SIZE + newFood.x;
+    for (let offset = 1; offset < GRID_SIZE * GRID_SIZE; offset++) {
+      const cell = (last + offset) % (GRID_SIZE * GRID_SIZE);
+      const candidate = { x: cell % GRID_SIZE, y: Math.floor(cell / GRID_SIZE) };
+      if (!taken(candidate)) return [candidate, randomState];
+    }
+    return [newFood, randomState];
   };
 
   // Initialize game
@@ -71,9 +102,11 @@ const GameBoard: React.FC = () => {
       const gameResponse = await gameAPI.startGame(currentUser.id, 'pass-through');
       setGameId(gameResponse.id);
       
+      const seed = newSeed();
+      const [food, randomState] = generateFood([{ x: 10, y: 10 }], seed);
       setGameState({
         snake: [{ x: 10, y: 10 }],
-        food: generateFood([{ x: 10, y: 10 }]),
+        food,
         direction: 'RIGHT',
         nextDirection: 'RIGHT',
         gameMode: 'pass-through',
@@ -81,6 +114,10 @@ const GameBoard: React.FC = () => {
         isPlaying: true,
         isGameOver: false,
         speed: INITIAL_SPEED,
+        seed,
+        randomState,
+        tick: 0,
+        inputs: [],
       });
     } catch (err) {
       console.error('Failed to initialize game:', err);
@@ -99,18 +136,30 @@ const GameBoard: React.FC = () => {
       
       if (!gameState.isPlaying || gameState.isGameOver) return;
 
+      // Record every accepted turn with the tick it happened on for the replay
+      const turn = (direction: Direction, opposite: Direction) =>
+        setGameState(prev =>
+          prev.direction === opposite
+            ? prev
+            : {
+                ...prev,
+                nextDirection: direction,
+                inputs: [...prev.inputs, [prev.tick, direction] as [number, Direction]],
+              }
+        );
+
       switch (e.key) {
         case 'ArrowUp':
-          if (gameState.direction !== 'DOWN') setGameState(prev => ({ ...prev, nextDirection: 'UP' }));
+          turn('UP', 'DOWN');
           break;
         case 'ArrowDown':
-          if (gameState.direction !== 'UP') setGameState(prev => ({ ...prev, nextDirection: 'DOWN' }));
+          turn('DOWN', 'UP');
           break;
         case 'ArrowLeft':
-          if (gameState.direction !== 'RIGHT') setGameState(prev => ({ ...prev, nextDirection: 'LEFT' }));
+          turn('LEFT', 'RIGHT');
           break;
         case 'ArrowRight':
-          if (gameState.direction !== 'LEFT') setGameState(prev => ({ ...prev, nextDirection: 'RIGHT' }));
+          turn('RIGHT', 'LEFT');
           break;
         case ' ':
           setGameState(prev => ({ ...prev, isPlaying: !prev.isPlaying }));
@@ -130,7 +179,7 @@ const GameBoard: React.FC = () => {
 
     const moveSnake = async () => {
       setGameState(prev => {
-        const { snake, food, nextDirection, gameMode, score, speed } = prev;
+        const { snake, food, nextDirection, gameMode, score, speed, randomState, tick } = prev;
         const head = { ...snake[0] };
         const direction = nextDirection;
 
@@ -162,7 +211,7 @@ const GameBoard: React.FC = () => {
           if (head.x < 0 || head.x >= GRID_SIZE || head.y < 0 || head.y >= GRID_SIZE) {
             // Update game status to finished when game over
             if (gameId !== null) {
-              gameAPI.updateStatus(gameId, 'finished');
+              gameAPI.updateStatus(gameId, 'finished', replayOf(prev));
             }
             return { ...prev, isGameOver: true, isPlaying: false };
           }
@@ -176,7 +225,7 @@ const GameBoard: React.FC = () => {
         if (selfCollision) {
           // Update game status to finished when game over
           if (gameId !== null) {
-            gameAPI.updateStatus(gameId, 'finished');
+            gameAPI.updateStatus(gameId, 'finished', replayOf(prev));
           }
           return { ...prev, isGameOver: true, isPlaying: false };
         }
@@ -186,12 +235,13 @@ const GameBoard: React.FC = () => {
 
         // Check food collision
         let newFood = food;
+        let newRandomState = randomState;
         let newScore = score;
         let newSpeed = speed;
 
         if (head.x === food.x && head.y === food.y) {
           // Snake ate food
-          newFood = generateFood(newSnake);
+          [newFood, newRandomState] = generateFood(newSnake, randomState);
           newScore += 10;
           
           // Increase speed every 50 points
@@ -201,7 +251,7 @@ const GameBoard: React.FC = () => {
           
           // Update score in backend if game ID exists
           if (gameId !== null) {
-            gameAPI.updateScore(gameId, newScore);
+            gameAPI.queueScores([{ game_id: gameId, score: newScore }]);
           }
         } else {
           // Remove tail if no food was eaten
@@ -215,6 +265,8 @@ const GameBoard: React.FC = () => {
           direction,
           score: newScore,
           speed: newSpeed,
+          randomState: newRandomState,
+          tick: tick + 1,
         };
       });
     };
@@ -223,6 +275,47 @@ const GameBoard: React.FC = () => {
     return () => clearInterval(gameInterval);
   }, [gameState.isPlaying, gameState.isGameOver, gameState.speed, gameId]);
 
+  // Tell the backend the game is still open, paused or not
+  useEffect(() => {
+    if (gameId === null || gameState.isGameOver) return;
+    const heartbeat = setInterval(() => {
+      gameAPI.heartbeat(gameId).catch(() => undefined);
+    }, HEARTBEAT_INTERVAL);
+    return () => clearInterval(heartbeat);
+  }, [gameId, gameState.isGameOver]);
+
+  // Publish board frames for spectators while a game runs
+  useEffect(() => {
+    if (gameId === null) return;
+    const socket = gameAPI.connectPlay(gameId);
+    socket.onopen = () => {
+      sentRef.current = null;
+    };
+    socketRef.current = socket;
+    return () => {
+      socket.close();
+      socketRef.current = null;
+    };
+  }, [gameId]);
+
+  useEffect(() => {
+    const socket = socketRef.current;
+    if (!socket || socket.readyState !== WebSocket.OPEN) return;
+    const { snake, food, tick, score, isGameOver } = gameState;
+    const sent = sentRef.current;
+    if (isGameOver) {
+      socket.send(encodeEnd(tick, score));
+    } else if (!sent || sent.tick !== tick - 1 || tick % KEYFRAME_INTERVAL === 0) {
+      socket.send(encodeKeyframe(tick, score, GRID_SIZE, snake, food));
+    } else {
+      const foodMoved = food.x !== sent.food.x || food.y !== sent.food.y;
+      socket.send(
+        encodeDelta(tick, score, GRID_SIZE, snake[0], snake.length === sent.length, foodMoved ? food : null)
+      );
+    }
+    sentRef.current = { tick, length: snake.length, food };
+  }, [gameState.tick, gameState.isGameOver]);
+
   // Start game on mount
   useEffect(() => {
     if (currentUser) {
@@ -256,7 +349,7 @@ const GameBoard: React.FC = () => {
   const resetGame = async () => {
     if (gameId !== null) {
       // Update game status to finished
-      await gameAPI.updateStatus(gameId, 'finished');
+      await gameAPI.updateStatus(gameId, 'finished', replayOf(gameState));
     }
     initGame();
   };
@@ -0,0 +1,76 @@
+import React, { useState, useEffect } from 'react';
+import { playersAPI } from '../services/api';
+import { applyFrame, Board } from '../services/frames';
+
+const CELL_SIZE = 12;
+
+interface GameViewerProps {
+  gameId: number;
+  username: string;
+  onClose: () => void;
+}
+
+// Spectates one game by replaying its board frames
+const GameViewer: React.FC<GameViewerProps> = ({ gameId, username, onClose }) => {
+  const [board, setBoard] = useState<Board | null>(null);
+
+  useEffect(() => {
+    const socket = playersAPI.watchGame(gameId);
+    socket.onmessage = (message) => {
+      setBoard(current => applyFrame(current, message.data as ArrayBuffer));
+    };
+    return () => socket.close();
+  }, [gameId]);
+
+  return (
+    <div className="mb-6 p-4 rounded-lg border border-blue-500 bg-gray-900 flex flex-col items-center">
+      <div className="w-full flex justify-between items-center mb-3">
+        <h3 className="font-bold text-lg">Watching {username}</h3>
+        <button onClick={onClose} className="px-3 py-1 bg-gray-600 hover:bg-gray-700 rounded transition">
+          Close
+        </button>
+      </div>
+
+      {!board ? (
+        <p className="text-gray-400">Waiting for the next frame...</p>
+      ) : (
+        <>
+          <p className="mb-2">
+            Score: <span className="font-bold text-green-400">{board.score}</span>
+            {board.over && <span className="ml-2 text-red-400 font-bold">Game Over</span>}
+          </p>
+          <div
+            className="relative border-2 border-gray-600 bg-gray-800"
+            style={{ width: board.size * CELL_SIZE, height: board.size * CELL_SIZE }}
+          >
+            {board.snake.map((segment, index) => (
+              <div
+                key={index}
+                className={`absolute rounded-sm ${index === 0 ? 'bg-green-500' : 'bg-green-400'}`}
+                style={{
+                  left: segment.x * CELL_SIZE,
+                  top: segment.y * CELL_SIZE,
+                  width: CELL_SIZE,
+                  height: CELL_SIZE,
+                }}
+              />
+            ))}
+            {board.food && (
+              <div
+                className="absolute bg-red-500 rounded-full"
+                style={{
+                  left: board.food.x * CELL_SIZE,
+                  top: board.food.y * CELL_SIZE,
+                  width: CELL_SIZE,
+                  height: CELL_SIZE,
+                }}
+              />
+            )}
+          </div>
+        </>
+      )}
+    </div>
+  );
+};
+
+export default GameViewer;
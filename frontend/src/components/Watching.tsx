@@ -1,8 +1,10 @@
 import React, { useState, useEffect } from 'react';
 import { playersAPI } from '../services/api';
+import GameViewer from './GameViewer';
 
 interface Player {
   id: number;
+  game_id: number;
   username: string;
   score: number;
   status: 'playing' | 'idle' | 'finished';
@@ -13,8 +15,12 @@ const Watching = () => {
   const [players, setPlayers] = useState<Player[]>([]);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState<string | null>(null);
+  const [watching, setWatching] = useState<Player | null>(null);
 
   useEffect(() => {
+    let interval: ReturnType<typeof setInterval> | null = null;
+    let closed = false;
+
     const fetchPlayers = async () => {
       try {
         setLoading(true);
@@ -29,12 +35,41 @@ const Watching = () => {
       }
     };
 
-    fetchPlayers();
-    
-    // Set up real-time updates
-    const interval = setInterval(fetchPlayers, 5000);
-    
-    return () => clearInterval(interval);
+    // Fall back to polling if the live feed is unavailable
+    const startPolling = () => {
+      if (closed || interval) return;
+      fetchPlayers();
+      interval = setInterval(fetchPlayers, 5000);
+    };
+
+    const socket = playersAPI.connectLive();
+    socket.onmessage = (message) => {
+      const event = JSON.parse(message.data);
+      setLoading(false);
+      setError(null);
+      setPlayers(current => {
+        switch (event.type) {
+          case 'snapshot':
+            return event.players;
+          case 'joined':
+            return [...current.filter(p => p.game_id !== event.game_id), event.player];
+          case 'score':
+            return current.map(p => (p.game_id === event.game_id ? { ...p, score: event.score } : p));
+          case 'left':
+            return current.filter(p => p.game_id !== event.game_id);
+          default:
+            return current;
+        }
+      });
+    };
+    socket.onerror = startPolling;
+    socket.onclose = startPolling;
+
+    return () => {
+      closed = true;
+      socket.close();
+      if (interval) clearInterval(interval);
+    };
   }, []);
 
   if (loading) {
@@ -56,6 +91,15 @@ const Watching = () => {
   return (
     <div className="max-w-4xl mx-auto bg-gray-800 p-6 rounded-lg shadow-lg">
       <h2 className="text-2xl font-bold mb-6 text-center">Watching Other Players</h2>
+
+      {watching && (
+        <GameViewer
+          key={watching.game_id}
+          gameId={watching.game_id}
+          username={watching.username}
+          onClose={() => setWatching(null)}
+        />
+      )}
       
       {players.length === 0 ? (
         <div className="text-center py-8">
@@ -66,7 +110,7 @@ const Watching = () => {
         <div className="grid grid-cols-1 md:grid-cols-2 lg:grid-cols-3 gap-4">
           {players.map(player => (
             <div 
-              key={player.id} 
+              key={player.game_id} 
               className={`p-4 rounded-lg border ${
                 player.status === 'playing' 
                   ? 'border-green-500 bg-green-900/20' 
@@ -80,6 +124,14 @@ const Watching = () => {
                   <h3 className="font-bold text-lg">{player.username}</h3>
                   <p className="text-gray-300">Score: <span className="font-bold">{player.score}</span></p>
                   <p className="text-gray-300">Mode: <span className="font-bold">{player.gameMode}</span></p>
+                  {player.status === 'playing' && (
+                    <button
+                      onClick={() => setWatching(player)}
+                      className="mt-2 px-3 py-1 text-sm bg-blue-600 hover:bg-blue-700 rounded transition"
+                    >
+                      Watch
+                    </button>
+                  )}
                 </div>
                 <span className={`px-2 py-1 rounded text-xs font-bold ${
                   player.status === 'playing' 
@@ -112,7 +164,7 @@ const Watching = () => {
 
       <div className="mt-8 text-center">
         <p className="text-gray-400">Real-time data of other players playing the game</p>
-        <p className="text-gray-500 text-sm mt-2">Data updates automatically every 5 seconds</p>
+        <p className="text-gray-500 text-sm mt-2">Data updates live as players score</p>
       </div>
     </div>
   );
@@ -1,4 +1,5 @@
 import axios from 'axios';
+import { Replay } from './replay';
 
 // Create axios instance with base URL
 const api = axios.create({
@@ -35,6 +36,11 @@ api.interceptors.response.use(
 );
 
 // API Endpoints
+const socketURL = (path: string) => {
+  const baseURL = api.defaults.baseURL || 'http://localhost:8000';
+  return `${baseURL.replace(/^http/, 'ws')}${path}`;
+};
+
 export const authAPI = {
   login: async (username: string) => {
     const response = await api.post('/login', { username });
@@ -59,11 +65,26 @@ export const gameAPI = {
     const response = await api.put(`/games/${gameId}/score`, { score });
     return response.data;
   },
+
+  // Buffered on the server and written in bulk, cheaper than updateScore
+  queueScores: async (scores: { game_id: number; score: number }[]) => {
+    const response = await api.post('/games/scores:batch', { scores });
+    return response.data;
+  },
   
-  updateStatus: async (gameId: number, status: string) => {
-    const response = await api.put(`/games/${gameId}/status`, { status });
+  // A replay lets the server check the score before it is ranked
+  updateStatus: async (gameId: number, status: string, replay?: Replay) => {
+    const response = await api.put(`/games/${gameId}/status`, { status, replay });
     return response.data;
   },
+
+  // Keeps a game that isn't scoring from being reaped as abandoned
+  heartbeat: async (gameId: number) => {
+    await api.post(`/games/${gameId}/heartbeat`);
+  },
+
+  // Publishes this game's board frames to its spectators
+  connectPlay: (gameId: number) => new WebSocket(socketURL(`/ws/games/${gameId}/play`)),
 };
 
 export const leaderboardAPI = {
@@ -78,6 +99,16 @@ export const playersAPI = {
     const response = await api.get('/players');
     return response.data;
   },
+
+  // Live players feed: a snapshot followed by joined/score/left events
+  connectLive: () => new WebSocket(socketURL('/ws/players')),
+
+  // Binary board frames of one game, see services/frames.ts
+  watchGame: (gameId: number) => {
+    const socket = new WebSocket(socketURL(`/ws/games/${gameId}/watch`));
+    socket.binaryType = 'arraybuffer';
+    return socket;
+  },
 };
 
 export default api;
@@ -0,0 +1,103 @@
+// Binary board frames for spectating a game, the format is described in
+// backend/spectate.py. Integers are little-endian, cells are y * size + x.
+
+export const KEYFRAME = 0;
+export const DELTA = 1;
+export const END = 2;
+const TAIL_REMOVED = 1;
+const FOOD_MOVED = 2;
+const NO_FOOD = 0xffff;
+
+// Ticks between keyframes, lets spectators that join late catch up
+export const KEYFRAME_INTERVAL = 50;
+
+type Position = { x: number; y: number };
+
+export interface Board {
+  size: number;
+  snake: Position[];
+  food: Position | null;
+  tick: number;
+  score: number;
+  over: boolean;
+}
+
+const cellOf = (position: Position | null, size: number) =>
+  position === null ? NO_FOOD : position.y * size + position.x;
+
+const positionOf = (cell: number, size: number): Position | null =>
+  cell === NO_FOOD ? null : { x: cell % size, y: Math.floor(cell / size) };
+
+export const encodeKeyframe = (
+  tick: number,
+  score: number,
+  size: number,
+  snake: Position[],
+  food: Position | null
+): ArrayBuffer => {
+  const view = new DataView(new ArrayBuffer(14 + snake.length * 2));
+  view.setUint8(0, KEYFRAME);
+  view.setUint32(1, tick, true);
+  view.setUint32(5, score, true);
+  view.setUint8(9, size);
+  view.setUint16(10, cellOf(food, size), true);
+  view.setUint16(12, snake.length, true);
+  snake.forEach((segment, index) => view.setUint16(14 + index * 2, cellOf(segment, size), true));
+  return view.buffer;
+};
+
+// Pass the food only if it moved since the previous frame
+export const encodeDelta = (
+  tick: number,
+  score: number,
+  size: number,
+  head: Position,
+  tailRemoved: boolean,
+  food: Position | null
+): ArrayBuffer => {
+  const view = new DataView(new ArrayBuffer(food ? 14 : 12));
+  view.setUint8(0, DELTA);
+  view.setUint32(1, tick, true);
+  view.setUint32(5, score, true);
+  view.setUint8(9, (tailRemoved ? TAIL_REMOVED : 0) | (food ? FOOD_MOVED : 0));
+  view.setUint16(10, cellOf(head, size), true);
+  if (food) view.setUint16(12, cellOf(food, size), true);
+  return view.buffer;
+};
+
+export const encodeEnd = (tick: number, score: number): ArrayBuffer => {
+  const view = new DataView(new ArrayBuffer(9));
+  view.setUint8(0, END);
+  view.setUint32(1, tick, true);
+  view.setUint32(5, score, true);
+  return view.buffer;
+};
+
+// Apply one frame, deltas are ignored until the first keyframe arrives
+export const applyFrame = (board: Board | null, data: ArrayBuffer): Board | null => {
+  const view = new DataView(data);
+  const tick = view.getUint32(1, true);
+  const score = view.getUint32(5, true);
+  switch (view.getUint8(0)) {
+    case KEYFRAME: {
+      const size = view.getUint8(9);
+      const snake: Position[] = [];
+      for (let index = 0; index < view.getUint16(12, true); index++) {
+        snake.push(positionOf(view.getUint16(14 + index * 2, true), size) as Position);
+      }
+      return { size, snake, food: positionOf(view.getUint16(10, true), size), tick, score, over: false };
+    }
+    case DELTA: {
+      if (!board) return board;
+      const flags = view.getUint8(9);
+      const snake = [positionOf(view.getUint16(10, true), board.size) as Position, ...board.snake];
+      if (flags & TAIL_REMOVED) snake.pop();
+      const food = flags & FOOD_MOVED ? positionOf(view.getUint16(12, true), board.size) : board.food;
+      return { ...board, snake, food, tick, score };
+    }
+    case END:
+      return board ? { ...board, tick, score, over: true } : board;
+    default:
+      return board;
+  }
+};
@@ -0,0 +1,43 @@
+// Seeded food placement and input recording, so the backend can replay a
+// finished game and check its score. Must stay in step with
+// backend/engine.py and backend/replays.py.
+
+export type Direction = 'UP' | 'DOWN' | 'LEFT' | 'RIGHT';
+
+// Same order as the backend's direction numbers
+const DIRECTIONS: Direction[] = ['UP', 'RIGHT', 'DOWN', 'LEFT'];
+
+export interface Replay {
+  seed: number;
+  ticks: number;
+  inputs: string;
+  // The final score, which the replay must reach
+  score: number;
+}
+
+export const newSeed = (): number => Math.floor(Math.random() * 0x100000000);
+
+// One mulberry32 draw: a float in [0, 1) and the generator's next state.
+// The state is kept in game state so updates stay pure.
+export const nextRandom = (state: number): [number, number] => {
+  const next = (state + 0x6d2b79f5) | 0;
+  let t = Math.imul(next ^ (next >>> 15), 1 | next);
+  t = (t + Math.imul(t ^ (t >>> 7), 61 | t)) ^ t;
+  return [((t ^ (t >>> 14)) >>> 0) / 4294967296, next];
+};
+
+// One varint per direction change: ticks since the previous one << 2 | direction
+export const encodeInputs = (inputs: [number, Direction][]): string => {
+  const bytes: number[] = [];
+  let previous = 0;
+  for (const [tick, direction] of inputs) {
+    let value = (tick - previous) * 4 + DIRECTIONS.indexOf(direction);
+    previous = tick;
+    while (value > 0x7f) {
+      bytes.push((value % 128) | 0x80);
+      value = Math.floor(value / 128);
+    }
+    bytes.push(value);
+  }
+  return btoa(String.fromCharCode(...bytes));
+};